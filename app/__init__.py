@@ -1,35 +1,85 @@
-# Creates the Flask app instance - ties configs, routes, and other components
+# Application factory - create_app() builds the Flask app and ties configs, extensions, routes and commands
+# Importing this package does no database work: tables are created and migrated by `flask db-upgrade`
+# (run.py does it before starting the dev server), so workers, CLI commands and tests start quickly.
+
+import os
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from config import Config
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Initialize Flask app
-app = Flask(__name__)
+from config import engine_options, max_content_length
 
-# Load configurations from config.py
-app.config.from_object(Config)
+# Extensions are created once and bound to the app in create_app()
+db = SQLAlchemy()
 
 # Set up LoginManger from Flask-Login
-login_manager = LoginManager(app)
+login_manager = LoginManager()
 # Redirects users not logged in to the /login route when attempting to access routes that require login
-login_manager.login_view = 'login'  
+login_manager.login_view = 'auth.login'
+# ...except the JSON API, which answers 401
+login_manager.blueprint_login_views = {'api': None}
+
+# Config classes in config.py by name (FLASK_ENV picks one when no name is given)
+CONFIGS = {
+    'development': 'config.DevelopmentConfig',
+    'production': 'config.ProductionConfig',
+}
+
+
+def create_app(config_name=None, overrides=None):
+    """
+    Create and configure a Flask app ('development' or 'production', default from FLASK_ENV).
+    - overrides: settings applied on top of the config class (e.g. another database for benchmarks)
+    """
+    config_name = config_name or os.environ.get('FLASK_ENV') or 'development'
+
+    # Initialize Flask app
+    app = Flask(__name__)
+    # Load configurations from config.py for the environment
+    app.config.from_object(CONFIGS[config_name])
+    if overrides:
+        app.config.update(overrides)
+    # Pool options for the database actually used (overrides may change it)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    # Request bodies bigger than any upload allowed are refused before they are read
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        app.config['MAX_CONTENT_LENGTH'] = max_content_length(app.config)
+    # Behind reverse proxies the client address comes from X-Forwarded-For (TRUSTED_PROXIES in config.py)
+    if app.config['TRUSTED_PROXIES']:
+        proxies = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+    # Initialize SQLAlchemy and Flask-Login with the app
+    db.init_app(app)
+    login_manager.init_app(app)
 
-# Initialize SQLAlchemy with the app
-db = SQLAlchemy(app)
+    # Modules that register tables, session events and the user loader
+    from app import (models, database, search, stats, tagging, cache, identity, passwords, ratelimit, metrics, jobs,
+                     media, geo, analytics)
+    database.init_app(app)
+    metrics.init_app(app)
+    cache.init_app(app)
+    identity.init_app(app)
+    passwords.init_app(app)
+    ratelimit.init_app(app)
+    analytics.init_app(app)
 
-# Import User model so login_manager can use it
-from app.models import User
+    # Routes
+    from app.routes import register_blueprints
+    register_blueprints(app)
 
-# Create db tables
-with app.app_context():
-    db.create_all()
+    # Templates: bytecode cache, row fragments, compiled now instead of on the first requests
+    from app import rendering
+    rendering.init_app(app)
 
-# Flask-Login stores user ID when they log in
-@login_manager.user_loader  # Calls this function to load user from db
-def load_user(user_id):  # Loads user_id of currently logged-in user
-        return User.query.get(int(user_id))  # DB lookup of the user with the user_id from current session
+    # Command line tools: flask --app run <command>
+    from app import migrations, queryplan, importer, exporter
+    for command in (migrations.upgrade_command, migrations.version_command, queryplan.explain_queries_command,
+                    search.rebuild_search_command, stats.rebuild_stats_command, geo.geocode_restaurants_command,
+                    importer.import_data_command, exporter.export_command, metrics.profile_requests_command,
+                    jobs.jobs_worker_command):
+        app.cli.add_command(command)
 
-# Import routes after Flask app is created
-from app import routes
\ No newline at end of file
+    return app
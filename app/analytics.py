@@ -0,0 +1,220 @@
+# Spending and visit analytics for a person - the /user dashboard and /api/analytics
+# - Read from visit_day_stats (one row per person, restaurant and day with meals - a visit - holding the meal
+#   count and the price count, total, min and max), kept up to date on every write by app/stats.py
+# - A person's rows are loaded once, ordered by day, into prefix sums: the totals of any date range are two
+#   binary searches and a subtraction, for the whole history, per month and per restaurant. Nothing here reads
+#   the meals table, the cost depends on the number of visit days, not meals
+# - Loaded timelines are kept per worker in a TTL cache keyed by the person's data version (bumped in the same
+#   transaction as every write to their meals), so another worker's writes are never served stale
+
+# Standard library imports
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date, timedelta
+from itertools import accumulate
+
+# Third-party imports
+from sqlalchemy import select
+
+# Local app imports
+from app import db, queries
+from app.cache import TTLCache, person_version
+from app.models import Restaurant, VisitDayStats
+
+
+# Sized from ANALYTICS_CACHE_SIZE / ANALYTICS_CACHE_TTL by init_app()
+timeline_cache = TTLCache()
+
+# Totals kept as prefix sums, in this order
+TOTALS = ("meals", "visits", "priced_meals", "spend")
+
+
+# PREFIX SUMS
+class Series:
+    """
+    Totals per day (sorted day ordinals), with prefix sums for any range of days.
+    - rows: (day ordinal, (meals, visits, priced meals, spend)) in day order, a day may repeat
+    """
+
+    def __init__(self, rows):
+        self.days = []
+        per_day = []
+        for day, values in rows:
+            if self.days and self.days[-1] == day:
+                per_day[-1] = tuple(map(sum, zip(per_day[-1], values)))
+            else:
+                self.days.append(day)
+                per_day.append(values)
+        # prefix[i] = totals of the first i days
+        self.prefix = list(accumulate(per_day, lambda total, values: tuple(map(sum, zip(total, values))),
+                                      initial=(0, 0, 0, 0.0)))
+
+    def bounds(self, start, end):
+        """Index range of the days from start to end (ordinals, both included)."""
+        return bisect_left(self.days, start), bisect_right(self.days, end)
+
+    def total(self, start, end):
+        """{meals, visits, priced_meals, spend} from day start to day end (ordinals, both included)."""
+        first, last = self.bounds(start, end)
+        return dict(zip(TOTALS, (after - before for after, before in zip(self.prefix[last], self.prefix[first]))))
+
+
+class Timeline:
+    """One person's visit days: a Series over all of them, one per restaurant, and each day's cheapest / dearest."""
+
+    def __init__(self, rows):
+        # rows: (restaurant_id, date, meal_count, price_count, price_total, price_min, price_max) by date
+        everything, restaurants = [], defaultdict(list)
+        # Cheapest and dearest price per day, aligned with self.all.days
+        self.lowest, self.highest = [], []
+        for restaurant_id, day, meal_count, price_count, price_total, price_min, price_max in rows:
+            entry = (day.toordinal(), (meal_count, 1, price_count, price_total))
+            if everything and everything[-1][0] == entry[0]:
+                self.lowest[-1] = _pick(min, self.lowest[-1], price_min)
+                self.highest[-1] = _pick(max, self.highest[-1], price_max)
+            else:
+                self.lowest.append(price_min)
+                self.highest.append(price_max)
+            everything.append(entry)
+            restaurants[restaurant_id].append(entry)
+        self.all = Series(everything)
+        self.restaurants = {restaurant_id: Series(entries) for restaurant_id, entries in restaurants.items()}
+
+    def summary(self, start, end):
+        """Totals from start to end (dates) with the average, cheapest and dearest meal price."""
+        first, last = start.toordinal(), end.toordinal()
+        totals = self.all.total(first, last)
+        # Min and max aren't prefix sums: one pass over the days in the range
+        low, high = self.all.bounds(first, last)
+        lowest = [price for price in self.lowest[low:high] if price is not None]
+        highest = [price for price in self.highest[low:high] if price is not None]
+        average = totals["spend"] / totals["priced_meals"] if totals["priced_meals"] else None
+        return _rounded(dict(totals, average_price=average, min_price=min(lowest, default=None),
+                             max_price=max(highest, default=None)))
+
+    def by_month(self, start, end):
+        """[{month 'YYYY-MM', totals}] for every month from start to end (months without meals included)."""
+        months = []
+        first = start
+        while True:
+            last = min(_month_end(first), end)
+            months.append(_rounded(dict(month=first.strftime("%Y-%m"),
+                                        **self.all.total(first.toordinal(), last.toordinal()))))
+            # Stop on the last month rather than stepping past it (there's no month after December 9999)
+            if last >= end:
+                return months
+            first = last + timedelta(days=1)
+
+    def by_restaurant(self, start, end):
+        """{restaurant_id: totals} for the restaurants visited from start to end."""
+        first, last = start.toordinal(), end.toordinal()
+        found = {}
+        for restaurant_id, series in self.restaurants.items():
+            totals = series.total(first, last)
+            if totals["meals"]:
+                found[restaurant_id] = totals
+        return found
+
+
+def _month_end(day):
+    """Last day of the month of day."""
+    if day.month == 12:
+        return day.replace(day=31)
+    return day.replace(month=day.month + 1, day=1) - timedelta(days=1)
+
+
+def _pick(choose, current, value):
+    if current is None or value is None:
+        return value if current is None else current
+    return choose(current, value)
+
+
+def _rounded(totals):
+    """Money to the cent (sums and differences of floats drift)."""
+    for name in ("spend", "average_price", "min_price", "max_price"):
+        if totals.get(name) is not None:
+            totals[name] = round(totals[name], 2)
+    return totals
+
+
+# LOADING
+def load_timeline(person_id):
+    """A person's Timeline, from the cache when their meals haven't changed since it was loaded."""
+    key = (person_id, person_version(person_id))
+    timeline = timeline_cache.get(key)
+    if timeline is None:
+        # Walks the (person_id, date, restaurant_id) primary key
+        timeline = Timeline(db.session.execute(timeline_statement(person_id)))
+        if timeline_cache.max_entries:
+            timeline_cache.set(key, timeline)
+    return timeline
+
+
+def timeline_statement(person_id):
+    table = VisitDayStats
+    return (select(table.restaurant_id, table.date, table.meal_count, table.price_count, table.price_total,
+                   table.price_min, table.price_max)
+            .where(table.person_id == person_id).order_by(table.date))
+
+
+# REPORTS
+def default_range(today=None):
+    """This year: January 1st to December 31st."""
+    today = today or date.today()
+    return date(today.year, 1, 1), date(today.year, 12, 31)
+
+
+def parse_range(start, end, max_years):
+    """
+    (start, end) dates from 'YYYY-MM-DD' strings, this year's for blank ones.
+    ValueError if a date is invalid, the start is after the end or the range is longer than max_years.
+    """
+    default_start, default_end = default_range()
+    start = date.fromisoformat(start) if start else default_start
+    end = date.fromisoformat(end) if end else default_end
+    if start > end:
+        raise ValueError("The start date is after the end date")
+    # The report has a row per month, bound its size
+    if (end - start).days >= max_years * 366:
+        raise ValueError(f"The range is longer than {max_years} years")
+    return start, end
+
+
+def person_report(person_id, start, end, top=10):
+    """
+    Spending and visits of a person from start to end (dates, both included).
+    - summary: meals, visits, priced_meals, spend, average_price, min_price, max_price
+    - by_month: totals per month, by_cuisine: totals per cuisine (most spent first)
+    - top_restaurants: the `top` most visited restaurants (then most meals), with their totals
+    """
+    timeline = load_timeline(person_id)
+    restaurants = timeline.by_restaurant(start, end)
+
+    # Names and cuisines of the visited restaurants, one query (ranking needs every cuisine anyway)
+    cuisines = dict(db.session.execute(
+        select(Restaurant.id, Restaurant.cuisine).where(Restaurant.id.in_(list(restaurants)))
+    ).all()) if restaurants else {}
+    by_cuisine = defaultdict(lambda: dict.fromkeys(TOTALS, 0))
+    for restaurant_id, totals in restaurants.items():
+        group = by_cuisine[cuisines.get(restaurant_id) or "Other"]
+        for name in TOTALS:
+            group[name] += totals[name]
+
+    ranked = sorted(restaurants, key=lambda restaurant_id: (-restaurants[restaurant_id]["visits"],
+                                                            -restaurants[restaurant_id]["meals"], restaurant_id))
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "summary": timeline.summary(start, end),
+        "by_month": timeline.by_month(start, end),
+        "by_cuisine": sorted((_rounded(dict(cuisine=cuisine, **totals)) for cuisine, totals in by_cuisine.items()),
+                             key=lambda group: (-group["spend"], group["cuisine"])),
+        "top_restaurants": [(restaurant, _rounded(dict(restaurants[restaurant.id])))
+                            for restaurant in queries.load_restaurants(ranked[:top])],
+    }
+
+
+def init_app(app):
+    """Size the timeline cache from the config (0 entries turns it off)."""
+    timeline_cache.max_entries = app.config["ANALYTICS_CACHE_SIZE"]
+    timeline_cache.ttl = app.config["ANALYTICS_CACHE_TTL"]
@@ -0,0 +1,280 @@
+# Page caching
+# - Versions: every write bumps restaurants.version for the restaurants it touched and the "restaurants"
+#   data version for listings, in the same transaction as the write.
+# - ETags: shared read-only pages send a strong ETag built from those versions and answer 304 when unchanged.
+# - The "meal-edits" data version is bumped when a stored meal changes who ate it, where, or its rating: the
+#   recommendation model adds new meals in place, but has to rebuild for those (app/recommend.py).
+# - Server-side cache: rendered pages are kept in an in-process LRU cache with a TTL. Entries are keyed by
+#   version (so another worker's writes are never served stale) and evicted by tag when this process commits.
+# Pages that don't opt in are sent with Cache-Control: no-store (they may show per-user data).
+
+# Standard library imports
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# Third-party imports
+from flask import abort, make_response, request, session
+from sqlalchemy import event, insert, select, update
+
+# Local app imports
+from app import db
+from app.models import Restaurant, DataVersion
+from app.changes import edited_meals, touched_restaurants
+
+
+# Data version bumped by any change to restaurants, meals or tags (listing pages depend on all of them)
+LISTING_VERSION = "restaurants"
+
+# Data version bumped by edits to stored meals' person, restaurant or rating
+MEAL_EDITS_VERSION = "meal-edits"
+MEAL_EDIT_ATTRIBUTES = ("person_id", "person", "restaurant_id", "restaurant", "rating")
+
+
+# Data version of one person's meals (their analytics), bumped by app/stats.py
+def person_version_name(person_id):
+    return f"person:{person_id}"
+
+
+# LRU CACHE WITH TTL AND TAGS
+class TTLCache:
+    """
+    Thread-safe LRU cache with a time to live.
+    - Each entry can have tags, invalidate(tag) evicts every entry with that tag.
+    """
+
+    def __init__(self, max_entries=512, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, tags=()):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            # Evict least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        """Evict every entry with any of the tags."""
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def discard(self, key):
+        """Evict one entry if it is cached."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size."""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        # Caller holds the lock
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+# Sized from PAGE_CACHE_SIZE / PAGE_CACHE_TTL by init_app()
+page_cache = TTLCache()
+
+
+def restaurant_tag(restaurant_id):
+    return f"restaurant:{restaurant_id}"
+
+
+# VERSIONS
+def bump_versions(connection, restaurant_ids):
+    """Increment the version of the given restaurants and the listing version."""
+    restaurant_ids = list(restaurant_ids)
+    if not restaurant_ids:
+        return
+    connection.execute(update(Restaurant.__table__).where(Restaurant.id.in_(restaurant_ids))
+                       .values(version=Restaurant.version + 1))
+    bump_data_version(connection, LISTING_VERSION)
+
+
+def bump_data_version(connection, name):
+    """Increment a named data version (the row is created on its first bump)."""
+    result = connection.execute(update(DataVersion.__table__).where(DataVersion.name == name)
+                                .values(version=DataVersion.version + 1))
+    if result.rowcount == 0:
+        connection.execute(insert(DataVersion.__table__).values(name=name, version=1))
+
+
+def bump_person_versions(connection, person_ids):
+    """Increment the data version of the given people's meals (rows are created on their first write)."""
+    names = [person_version_name(person_id) for person_id in sorted(set(person_ids))]
+    if not names:
+        return
+    table = DataVersion.__table__
+    existing = set(connection.execute(select(table.c.name).where(table.c.name.in_(names))).scalars())
+    if existing:
+        connection.execute(update(table).where(table.c.name.in_(existing)).values(version=table.c.version + 1))
+    missing = [name for name in names if name not in existing]
+    if missing:
+        connection.execute(insert(table), [{"name": name, "version": 1} for name in missing])
+
+
+def restaurant_version(restaurant_id):
+    """Current version of a restaurant page, None if the restaurant doesn't exist."""
+    return db.session.execute(select(Restaurant.version).where(Restaurant.id == restaurant_id)).scalar()
+
+
+def listing_version(**kwargs):
+    """Current version of the listing pages (home page, search results)."""
+    return db.session.execute(
+        select(DataVersion.version).where(DataVersion.name == LISTING_VERSION)
+    ).scalar() or 0
+
+
+def person_version(person_id):
+    """Current data version of a person's meals (0 before their first meal)."""
+    return db.session.execute(
+        select(DataVersion.version).where(DataVersion.name == person_version_name(person_id))
+    ).scalar() or 0
+
+
+# SESSION EVENTS
+# Bump versions in the same transaction as the write, and remember what to evict once it commits
+@event.listens_for(db.session, "after_flush")
+def bump_touched_versions(session, flush_context):
+    touched = touched_restaurants(session)
+    if touched:
+        bump_versions(session.connection(), touched)
+        session.info.setdefault("cache_touched", set()).update(touched)
+    if edited_meals(session, MEAL_EDIT_ATTRIBUTES):
+        bump_data_version(session.connection(), MEAL_EDITS_VERSION)
+
+
+@event.listens_for(db.session, "after_commit")
+def evict_touched_pages(session):
+    touched = session.info.pop("cache_touched", None)
+    if touched:
+        invalidate_restaurants(touched)
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_touched_pages(session):
+    session.info.pop("cache_touched", None)
+
+
+def invalidate_restaurants(restaurant_ids):
+    """Evict the cached pages of the given restaurants and every listing page."""
+    page_cache.invalidate(LISTING_VERSION, *(restaurant_tag(rid) for rid in restaurant_ids))
+
+
+# PER-ROUTE POLICY
+def cached_page(version, tags):
+    """
+    Decorator for shared, read-only GET pages (HTML or JSON).
+    - version(**view_args): current version of the data on the page (None means 404)
+    - tags(**view_args): cache tags to evict the page by
+    Sends a strong ETag, answers 304 to a matching If-None-Match and serves repeat renders from page_cache.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pages showing a flash message are one-off, render them normally (the no-store default applies)
+            if request.method != "GET" or session.get("_flashes"):
+                return view(*args, **kwargs)
+
+            current = version(**kwargs)
+            if current is None:
+                abort(404)
+
+            # Same URL and same data version -> same page
+            key = (request.full_path, current)
+            etag = hashlib.sha1(f"{request.full_path}|{current}".encode()).hexdigest()[:20]
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                cached = page_cache.get(key)
+                if cached is None:
+                    response = make_response(view(*args, **kwargs))
+                    # Only cache successful pages (not redirects or errors)
+                    if response.status_code != 200:
+                        return response
+                    # Keep the content type with the body (HTML pages and JSON API responses)
+                    if response.is_streamed:
+                        # Streamed page: cached once the last chunk has been sent
+                        response.response = _cache_when_sent(response.response, key, response.content_type,
+                                                             tags(**kwargs))
+                    else:
+                        page_cache.set(key, (response.get_data(), response.content_type), tags(**kwargs))
+                else:
+                    body, content_type = cached
+                    response = make_response(body)
+                    response.content_type = content_type
+
+            response.set_etag(etag)
+            # Browsers may keep the page but must check the ETag each time; shared proxies must not store it
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapper
+    return decorator
+
+
+def _cache_when_sent(chunks, key, content_type, tags):
+    """Pass a streamed body through and cache it if it was sent to the end."""
+    body = []
+    for chunk in chunks:
+        body.append(chunk.encode() if isinstance(chunk, str) else chunk)
+        yield chunk
+    page_cache.set(key, (b"".join(body), content_type), tags)
+
+
+# Default policy for every response that didn't set one
+def apply_cache_policy(response):
+    """Never cache pages that didn't opt in to caching (they may show per-user data)."""
+    if request.endpoint != "static" and "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def init_app(app):
+    """Size the page cache from the config and install the default cache policy."""
+    page_cache.max_entries = app.config["PAGE_CACHE_SIZE"]
+    page_cache.ttl = app.config["PAGE_CACHE_TTL"]
+    app.after_request(apply_cache_policy)
@@ -0,0 +1,53 @@
+# Helpers for session events - work out which restaurants a flush changed
+# Used by everything derived from a restaurant's rows (search index, page cache versions)
+
+# Standard library imports
+from itertools import chain
+
+# Third-party imports
+from sqlalchemy import select
+
+# Local app imports
+from app import db
+from app.models import Restaurant, Meal, Tag, restaurant_tags
+
+
+def touched_restaurants(session):
+    """
+    Ids of the restaurants whose own row, meals or tags are changed by the current flush.
+    - Call from before_flush/after_flush (new, dirty and deleted still hold the flushed objects).
+    - A meal moved to another restaurant touches both restaurants.
+    """
+    touched = set()
+    renamed_tags = []
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Restaurant):
+            # Includes adding or removing tags (the tags collection belongs to the restaurant)
+            touched.add(obj.id)
+        elif isinstance(obj, Meal):
+            touched.add(obj.restaurant_id)
+            history = db.inspect(obj).attrs.restaurant_id.history
+            touched.update(history.deleted or ())
+        elif isinstance(obj, Tag) and obj.id is not None and obj not in session.new:
+            renamed_tags.append(obj.id)
+    if renamed_tags:
+        # Renaming or deleting a tag changes every restaurant that has it
+        touched.update(session.connection().execute(
+            select(restaurant_tags.c.restaurant_id).where(restaurant_tags.c.tag_id.in_(renamed_tags))
+        ).scalars())
+    touched.discard(None)
+    return touched
+
+
+def edited_meals(session, attributes):
+    """
+    Ids of stored meals (not new ones) whose given attributes are changed by the current flush.
+    - Call from after_flush (attribute history is still there). Relationship attributes work too.
+    """
+    edited = set()
+    for obj in session.dirty:
+        if isinstance(obj, Meal) and obj.id is not None:
+            state = db.inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in attributes):
+                edited.add(obj.id)
+    return edited
@@ -0,0 +1,114 @@
+# Database engine tuning and connection pool statistics
+# - SQLite: the SQLITE_PRAGMAS from config.py are set on every new connection (WAL, busy timeout...)
+# - Pool events count checkouts, new connections and invalidated connections, reported by pool_stats()
+# - After a fork (gunicorn --preload, multiprocessing) the child drops the parent's pooled connections
+
+# Standard library imports
+import os
+import threading
+
+# Third-party imports
+from flask import current_app
+from sqlalchemy import event
+
+# Local app imports
+from app import db
+
+
+# POOL STATISTICS
+class PoolCounters:
+    """Counts pool events for this worker process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0  # new database connections opened
+        self.checkouts = 0  # connections handed to a request/session
+        self.checked_out = 0  # connections in use right now
+        self.peak_checked_out = 0
+        self.invalidated = 0  # connections thrown away (errors, failed pre-ping)
+
+    def as_dict(self):
+        with self.lock:
+            return {"connects": self.connects, "checkouts": self.checkouts, "checked_out": self.checked_out,
+                    "peak_checked_out": self.peak_checked_out, "invalidated": self.invalidated}
+
+
+counters = PoolCounters()
+
+# Engines set up by init_app() (disposed in forked children)
+_engines = []
+
+
+def count_connect(dbapi_connection, connection_record):
+    with counters.lock:
+        counters.connects += 1
+
+
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    with counters.lock:
+        counters.checkouts += 1
+        counters.checked_out += 1
+        counters.peak_checked_out = max(counters.peak_checked_out, counters.checked_out)
+
+
+def count_checkin(dbapi_connection, connection_record):
+    with counters.lock:
+        counters.checked_out = max(counters.checked_out - 1, 0)
+
+
+def count_invalidate(dbapi_connection, connection_record, exception):
+    with counters.lock:
+        counters.invalidated += 1
+
+
+def pool_stats():
+    """Pool size and usage for this worker process."""
+    engine = db.engine
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__, "status": pool.status(), "events": counters.as_dict()}
+    # QueuePool (file databases and server databases) reports its size and current use
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if method is not None:
+            stats[name] = method()
+    if engine.dialect.name == "sqlite":
+        stats["sqlite_pragmas"] = current_app.config["SQLITE_PRAGMAS"]
+    return stats
+
+
+# ENGINE SETUP
+def init_app(app):
+    """Add the SQLite PRAGMA hook and the pool counters to the app's engine."""
+    with app.app_context():
+        engine = db.engine
+
+    if engine.dialect.name == "sqlite":
+        pragmas = dict(app.config["SQLITE_PRAGMAS"])
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            """Apply the configured PRAGMAs to a new SQLite connection."""
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {name} = {value}")
+            finally:
+                cursor.close()
+
+    event.listen(engine, "connect", count_connect)
+    event.listen(engine, "checkout", count_checkout)
+    event.listen(engine, "checkin", count_checkin)
+    event.listen(engine, "invalidate", count_invalidate)
+    _engines.append(engine)
+
+
+# FORK SAFETY
+# A forked child must not use the parent's connections - give it an empty pool (without closing the parent's)
+def _after_fork_in_child():
+    global counters
+    for engine in _engines:
+        engine.dispose(close=False)
+    counters = PoolCounters()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
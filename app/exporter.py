@@ -0,0 +1,172 @@
+# Streaming export of the restaurants, meals, tags, restaurant_tags and people tables (for the analytics warehouse)
+# - Rows are read with a streaming cursor (yield_per), a batch at a time, in id order
+# - Output is CSV or JSON Lines, optionally gzip-compressed, produced in fixed-size chunks
+# - Memory use doesn't depend on the size of the table
+# - Incremental exports: only rows with an id above a watermark, and for meals only meals since a date.
+#   restaurant_tags has no id of its own (a tag added to an old restaurant would never pass a watermark), so it is
+#   always exported in full
+# Served by the /export/<table> route as a chunked response and by `flask export` on the command line.
+
+# Standard library imports
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date
+
+# Third-party imports
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+# Local app imports
+from app import db
+from app.models import People, Restaurant, Meal, Tag, restaurant_tags
+
+
+# Exported tables and their columns (no password hashes, no derived data)
+TABLES = {
+    "restaurants": (Restaurant.id, Restaurant.name, Restaurant.address, Restaurant.phone_number,
+                    Restaurant.cuisine, Restaurant.rating, Restaurant.latitude, Restaurant.longitude),
+    "meals": (Meal.id, Meal.restaurant_id, Meal.person_id, Meal.name, Meal.date, Meal.price, Meal.rating,
+              Meal.notes),
+    "tags": (Tag.id, Tag.name),
+    "restaurant_tags": (restaurant_tags.c.restaurant_id, restaurant_tags.c.tag_id),
+    "people": (People.id, People.name),
+}
+FORMATS = ("csv", "jsonl")
+
+MIMETYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+# Progress of one export, filled in while the rows are streamed
+class ExportProgress:
+    """Rows written and the highest id written (the watermark for the next incremental export)."""
+
+    def __init__(self):
+        self.rows = 0
+        self.last_id = None
+
+
+def export_statement(table, since_id=None, since_date=None):
+    """SELECT for one table in id order, with the incremental filters."""
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table!r}, expected one of {', '.join(TABLES)}")
+    columns = TABLES[table]
+    # Primary key order (restaurant_tags: by restaurant, then tag)
+    stmt = select(*columns).order_by(*columns[0].table.primary_key.columns)
+    if since_id is not None:
+        if table == "restaurant_tags":
+            raise ValueError("since_id doesn't apply to restaurant_tags, export it in full")
+        stmt = stmt.where(columns[0] > since_id)
+    if since_date is not None:
+        if table != "meals":
+            raise ValueError("since_date only applies to meals")
+        stmt = stmt.where(Meal.date >= since_date)
+    return stmt
+
+
+# READING
+def stream_rows(engine, table, since_id=None, since_date=None, progress=None, batch_size=1000):
+    """Yield the rows of a table as tuples, batch_size rows at a time from a streaming cursor."""
+    stmt = export_statement(table, since_id, since_date)
+    with engine.connect() as connection:
+        result = connection.execute(stmt.execution_options(yield_per=batch_size))
+        for row in result:
+            if progress is not None:
+                progress.rows += 1
+                progress.last_id = row[0]
+            yield row
+
+
+# ENCODING
+def _json_value(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def encode_rows(rows, columns, fmt, chunk_size=64 * 1024):
+    """Yield text chunks of about chunk_size characters (CSV with a header row, or JSON Lines)."""
+    buffer = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        write = writer.writerow
+    elif fmt == "jsonl":
+        def write(row):
+            buffer.write(json.dumps(dict(zip(columns, map(_json_value, row))), separators=(",", ":")))
+            buffer.write("\n")
+    else:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+    for row in rows:
+        write(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Compress a stream of bytes into a gzip stream as it goes."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(table, fmt="csv", compress=False, since_id=None, since_date=None, progress=None, engine=None):
+    """Yield the encoded (and optionally gzip-compressed) export of a table as bytes."""
+    # Fail before the first chunk is sent on bad arguments
+    export_statement(table, since_id, since_date)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+    # The chunks are produced after the request has returned, read the config and engine now
+    config = current_app.config
+    columns = [column.key for column in TABLES[table]]
+    rows = stream_rows(engine or db.engine, table, since_id, since_date, progress, config["EXPORT_BATCH_SIZE"])
+    chunks = (text.encode("utf-8") for text in encode_rows(rows, columns, fmt, config["EXPORT_CHUNK_SIZE"]))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(table, fmt, compress):
+    return f"{table}.{fmt}" + (".gz" if compress else "")
+
+
+# CLI
+@click.command("export")
+@with_appcontext
+@click.argument("table", type=click.Choice(list(TABLES)))
+@click.option("-o", "--output", type=click.Path(dir_okay=False, allow_dash=True), default="-",
+              help="File to write ('-' for stdout, a .gz name compresses).")
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default="csv")
+@click.option("--gzip", "compress", is_flag=True, help="Compress the output with gzip.")
+@click.option("--since-id", type=int, default=None,
+              help="Only rows with an id above this watermark (not for restaurant_tags).")
+@click.option("--since-date", type=click.DateTime(["%Y-%m-%d"]), default=None, help="Only meals on or after this date.")
+def export_command(table, output, fmt, compress, since_id, since_date):
+    """Stream a table to a CSV or JSON Lines file. Prints the last id exported (the next --since-id)."""
+    compress = compress or output.endswith(".gz")
+    progress = ExportProgress()
+    try:
+        chunks = export_chunks(table, fmt, compress, since_id, since_date and since_date.date(), progress)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+
+    out = sys.stdout.buffer if output == "-" else open(output, "wb")
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        else:
+            out.flush()
+
+    click.echo(f"Exported {progress.rows} {table} rows, last id {progress.last_id}.", err=True)
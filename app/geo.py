@@ -0,0 +1,347 @@
+# Restaurant locations and "near me" lookups
+# - restaurants.latitude / longitude (degrees) are filled in from the address when a restaurant is added or its
+#   address changes, by an offline geocoder - there's no network:
+#   - default: a local lookup file (GEOCODER_FILE), CSV with address, latitude and longitude columns
+#   - GEOCODER: any function address -> (latitude, longitude) or None replaces it (another local source, tests)
+# - Spatial index:
+#   - SQLite: R*Tree virtual table restaurant_locations, one point per restaurant with rowid = restaurants.id
+#   - Other databases: the (latitude, longitude) index on restaurants (a latitude band, then longitude)
+# - A radius query looks up the circle's bounding box in the index, with the cuisine / rating filters on the
+#   matching rows only, then measures the great-circle distance of those candidates and loads the closest
+# - Boxes stop at the poles and at +-180 degrees longitude (no wrapping across the date line)
+# The index is kept in sync from session events like the search index. Core writers (import, delete job) call
+# sync_locations() themselves.
+
+# Standard library imports
+import csv
+import heapq
+import math
+import os
+import re
+import threading
+from itertools import chain
+
+# Third-party imports
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, column, event, select, table, text, update
+
+# Local app imports
+from app import db
+from app import cache, queries
+from app.models import Restaurant
+
+
+# R*Tree table, one row per restaurant with coordinates (min = max, a point)
+LOCATION_TABLE = "restaurant_locations"
+locations = table(LOCATION_TABLE, column("id"), column("min_lat"), column("max_lat"), column("min_lon"),
+                  column("max_lon"))
+
+# Mean Earth radius, and the length of a degree of latitude
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Restaurants are synced in chunks so IN lists stay small
+SYNC_CHUNK = 500
+
+# Street words written the same way in addresses and in the lookup file
+ABBREVIATIONS = {"street": "st", "avenue": "ave", "road": "rd", "drive": "dr", "boulevard": "blvd", "lane": "ln",
+                 "court": "ct", "place": "pl", "highway": "hwy", "parkway": "pkwy", "square": "sq", "suite": "ste",
+                 "north": "n", "south": "s", "east": "e", "west": "w"}
+
+
+# Check which index the configured database supports
+def uses_rtree(connection):
+    """True when the database is SQLite (R*Tree), False for the (latitude, longitude) index fallback."""
+    return connection.dialect.name == "sqlite"
+
+
+# COORDINATES
+def parse_point(latitude, longitude):
+    """(latitude, longitude) as floats from user input, None if both are blank. ValueError if invalid."""
+    if latitude in (None, "") and longitude in (None, ""):
+        return None
+    try:
+        point = (float(latitude), float(longitude))
+    except (TypeError, ValueError):
+        raise ValueError("Latitude and longitude must both be numbers.") from None
+    if not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+        raise ValueError("Latitude must be between -90 and 90, longitude between -180 and 180.")
+    return point
+
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+    """Great-circle distance between two points in km (haversine)."""
+    lat1, lat2 = math.radians(latitude), math.radians(other_latitude)
+    half_lat = (lat2 - lat1) / 2
+    half_lon = math.radians(other_longitude - longitude) / 2
+    a = math.sin(half_lat) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(half_lon) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(south, west, north, east) of a box holding the circle around a point, in degrees."""
+    delta = radius_km / KM_PER_DEGREE
+    south, north = max(-90.0, latitude - delta), min(90.0, latitude + delta)
+    # A degree of longitude is shortest on the box's edge nearest a pole
+    edge = max(abs(south), abs(north))
+    if edge >= 90 or delta >= 90 * math.cos(math.radians(edge)):
+        return south, -180.0, north, 180.0
+    lon_delta = delta / math.cos(math.radians(edge))
+    return south, max(-180.0, longitude - lon_delta), north, min(180.0, longitude + lon_delta)
+
+
+# GEOCODING
+def normalize_address(address):
+    """Lookup key for an address: lowercase words, street words abbreviated, ", " between the parts."""
+    parts = []
+    for part in (address or "").lower().split(","):
+        words = [ABBREVIATIONS.get(word, word) for word in re.findall(r"\w+", part)]
+        if words:
+            parts.append(" ".join(words))
+    return ", ".join(parts)
+
+
+class LookupFileGeocoder:
+    """
+    Geocoder reading a CSV lookup file (address, latitude, longitude columns with a header row).
+    - An address is looked up whole, then without its first parts: "12 Main St, Springfield, IL" tries
+      "springfield, il" and "il" next, so the file can list street addresses, towns or postcodes
+    - The file is read again when it changes, a missing file geocodes nothing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._points = {}
+        self._modified = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            modified = os.path.getmtime(self.path)
+        except OSError:
+            modified = None
+        with self._lock:
+            if modified != self._modified:
+                points = {}
+                if modified is not None:
+                    with open(self.path, encoding="utf-8-sig", newline="") as stream:
+                        for row in csv.DictReader(stream):
+                            key = normalize_address(row.get("address"))
+                            try:
+                                point = parse_point(row.get("latitude"), row.get("longitude"))
+                            except ValueError:
+                                continue
+                            if key and point:
+                                points[key] = point
+                self._points, self._modified = points, modified
+            return self._points
+
+    def __call__(self, address):
+        points = self._load()
+        parts = normalize_address(address).split(", ")
+        for start in range(len(parts)):
+            point = points.get(", ".join(parts[start:]))
+            if point:
+                return point
+        return None
+
+
+# One lookup file geocoder per path, per worker
+_lookup_files = {}
+
+
+def get_geocoder():
+    """The configured geocoder: GEOCODER if set, else the GEOCODER_FILE lookup file."""
+    geocoder = current_app.config["GEOCODER"]
+    if geocoder is None:
+        path = current_app.config["GEOCODER_FILE"]
+        geocoder = _lookup_files.get(path) or _lookup_files.setdefault(path, LookupFileGeocoder(path))
+    return geocoder
+
+
+def geocode(address):
+    """(latitude, longitude) of an address, None if it is blank or not found."""
+    if not address or not address.strip():
+        return None
+    return get_geocoder()(address)
+
+
+# CREATE THE INDEX
+def create_location_index(connection):
+    """
+    Create the R*Tree table if it is missing (SQLite only, other databases use ix_restaurants_location).
+    - Returns True if the index was just created and needs to be filled.
+    """
+    if not uses_rtree(connection):
+        return False
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": LOCATION_TABLE}
+    ).first()
+    if exists:
+        return False
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE {LOCATION_TABLE} USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+    ))
+    return True
+
+
+# KEEP THE INDEX IN SYNC
+def _copy_points(connection, where=""):
+    connection.execute(text(
+        f"INSERT INTO {LOCATION_TABLE} (id, min_lat, max_lat, min_lon, max_lon) "
+        "SELECT id, latitude, latitude, longitude, longitude FROM restaurants "
+        f"WHERE latitude IS NOT NULL AND longitude IS NOT NULL {where}"
+    ))
+
+
+def sync_locations(connection, restaurant_ids):
+    """Copy the coordinates of the given restaurants into the index (restaurants that no longer exist are removed)."""
+    if not uses_rtree(connection):
+        return
+    restaurant_ids = sorted({rid for rid in restaurant_ids if rid is not None})
+    for start in range(0, len(restaurant_ids), SYNC_CHUNK):
+        ids = ",".join(str(rid) for rid in restaurant_ids[start:start + SYNC_CHUNK])
+        connection.execute(text(f"DELETE FROM {LOCATION_TABLE} WHERE id IN ({ids})"))
+        _copy_points(connection, f"AND id IN ({ids})")
+
+
+def rebuild_location_index(connection):
+    """Refill the index from every restaurant with coordinates."""
+    if uses_rtree(connection):
+        connection.execute(text(f"DELETE FROM {LOCATION_TABLE}"))
+        _copy_points(connection)
+
+
+# Coordinates come from the address unless they were set in the same flush
+@event.listens_for(db.session, "before_flush")
+def geocode_addresses(session, flush_context, instances):
+    for obj in chain(session.new, session.dirty):
+        if not isinstance(obj, Restaurant):
+            continue
+        attrs = db.inspect(obj).attrs
+        if attrs.latitude.history.has_changes() or attrs.longitude.history.has_changes():
+            continue
+        if obj in session.new or attrs.address.history.has_changes():
+            obj.latitude, obj.longitude = geocode(obj.address) or (None, None)
+
+
+# Runs after every flush, inside the same transaction, so the index commits or rolls back with the data
+@event.listens_for(db.session, "after_flush")
+def sync_location_index(session, flush_context):
+    moved = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Restaurant):
+            attrs = db.inspect(obj).attrs
+            if obj in session.deleted or attrs.latitude.history.has_changes() or \
+                    attrs.longitude.history.has_changes():
+                moved.add(obj.id)
+    if moved:
+        sync_locations(session.connection(), moved)
+
+
+# NEAR ME
+def location_statement(connection, south, west, north, east, cuisine=None, min_rating=None):
+    """SELECT (id, latitude, longitude) of the restaurants inside a box, with the facet filters."""
+    stmt = select(Restaurant.id, Restaurant.latitude, Restaurant.longitude)
+    cuisine_column, rating_column = Restaurant.cuisine, Restaurant.rating
+    if uses_rtree(connection):
+        # The box is looked up in the R*Tree, then the matching restaurants by primary key
+        stmt = (stmt.select_from(locations).join(Restaurant, Restaurant.id == locations.c.id)
+                .where(locations.c.max_lat >= south, locations.c.min_lat <= north,
+                       locations.c.max_lon >= west, locations.c.min_lon <= east))
+        # Facets are checked on those rows only: as expressions SQLite can't start from the (cuisine, rating)
+        # index instead, which holds every restaurant of a cuisine in the country
+        cuisine_column, rating_column = Restaurant.cuisine.concat(""), Restaurant.rating + 0
+    else:
+        stmt = stmt.where(Restaurant.latitude.between(south, north), Restaurant.longitude.between(west, east))
+    if cuisine:
+        stmt = stmt.where(cuisine_column == cuisine)
+    if min_rating is not None:
+        stmt = stmt.where(rating_column >= min_rating)
+    return stmt
+
+
+def _closest(latitude, longitude, box, radius_km, cuisine, min_rating, limit):
+    south, west, north, east = box
+    stmt = location_statement(db.session.connection(), south, west, north, east, cuisine, min_rating)
+    # distance_km() inlined for the candidates: the haversine term grows with the distance, so it is compared
+    # and ordered as it is (no square root or arcsine per candidate)
+    sin, cos, to_radians = math.sin, math.cos, math.pi / 180
+    lat0, lon0 = latitude * to_radians, longitude * to_radians
+    cos0 = cos(lat0)
+    most = 1.0 if radius_km is None else sin(min(math.pi / 2, radius_km / (2 * EARTH_RADIUS_KM))) ** 2
+    found = []
+    for restaurant_id, lat, lon in db.session.execute(stmt):
+        # The R*Tree stores rounded coordinates: check the exact ones
+        if not (south <= lat <= north and west <= lon <= east):
+            continue
+        lat1 = lat * to_radians
+        half_lat, half_lon = sin((lat1 - lat0) / 2), sin((lon * to_radians - lon0) / 2)
+        term = half_lat * half_lat + cos0 * cos(lat1) * half_lon * half_lon
+        if term <= most:
+            found.append((term, restaurant_id))
+
+    nearest = heapq.nsmallest(limit, found)
+    restaurants = queries.load_restaurants([restaurant_id for _, restaurant_id in nearest])
+    return [(restaurant, round(2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(term))), 3))
+            for restaurant, (term, _) in zip(restaurants, nearest)]
+
+
+def restaurants_near(latitude, longitude, radius_km, cuisine=None, min_rating=None, limit=20):
+    """Restaurants within radius_km of a point, closest first: [(Restaurant, distance in km)]."""
+    box = bounding_box(latitude, longitude, radius_km)
+    return _closest(latitude, longitude, box, radius_km, cuisine, min_rating, limit)
+
+
+def restaurants_in_box(south, west, north, east, cuisine=None, min_rating=None, limit=20, max_radius_km=None):
+    """
+    Restaurants inside a box, closest to its centre first: [(Restaurant, distance in km from the centre)].
+    - max_radius_km: ValueError if a corner is farther than this from the centre (every candidate is loaded)
+    """
+    for corner in ((south, west), (north, east)):
+        parse_point(*corner)
+    if south > north or west > east:
+        raise ValueError("The box must be south,west,north,east with south <= north and west <= east.")
+    latitude, longitude = (south + north) / 2, (west + east) / 2
+    if max_radius_km is not None:
+        corners = ((south, west), (south, east), (north, west), (north, east))
+        if max(distance_km(latitude, longitude, *corner) for corner in corners) > max_radius_km:
+            raise ValueError(f"The box must fit in a circle of {max_radius_km} km around its centre.")
+    return _closest(latitude, longitude, (south, west, north, east), None, cuisine, min_rating, limit)
+
+
+# Command line: flask --app run geocode-restaurants
+@click.command("geocode-restaurants")
+@with_appcontext
+@click.option("--all", "everything", is_flag=True, help="Geocode every restaurant again, not only the missing ones.")
+def geocode_restaurants_command(everything):
+    """Fill in restaurant coordinates from their addresses (a batch per transaction), then rebuild the index."""
+    batch_size = current_app.config["JOB_BATCH_SIZE"]
+    last_id, checked, found = 0, 0, 0
+    while True:
+        with db.engine.begin() as connection:
+            stmt = select(Restaurant.id, Restaurant.address).where(Restaurant.id > last_id)
+            if not everything:
+                stmt = stmt.where(Restaurant.latitude.is_(None), Restaurant.address.isnot(None))
+            rows = connection.execute(stmt.order_by(Restaurant.id).limit(batch_size)).all()
+            if not rows:
+                break
+            points = {restaurant_id: geocode(address) for restaurant_id, address in rows}
+            values = [{"restaurant_id": restaurant_id, "lat": point[0] if point else None,
+                       "lon": point[1] if point else None}
+                      for restaurant_id, point in points.items() if point or everything]
+            if values:
+                connection.execute(update(Restaurant.__table__)
+                                   .where(Restaurant.__table__.c.id == bindparam("restaurant_id"))
+                                   .values(latitude=bindparam("lat"), longitude=bindparam("lon")), values)
+                changed = [value["restaurant_id"] for value in values]
+                sync_locations(connection, changed)
+                cache.bump_versions(connection, changed)
+        if values:
+            cache.invalidate_restaurants(changed)
+        last_id = rows[-1].id
+        checked += len(rows)
+        found += sum(1 for point in points.values() if point)
+    click.echo(f"Geocoded {found} of {checked} restaurants.")
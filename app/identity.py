@@ -0,0 +1,113 @@
+# Identity cache for Flask-Login
+# load_user runs on every request that passes through @login_required. Instead of querying the users table each
+# time, a read-only snapshot of the user (with the linked People name) is kept in a bounded TTL cache.
+# The snapshot is evicted when the user or their person row is changed or deleted (any password change) and on logout,
+# and the TTL bounds how long another worker can keep serving an identity changed elsewhere.
+
+# Third-party imports
+from flask_login import UserMixin
+from sqlalchemy import event, select
+
+# Local app imports
+from app import db, login_manager
+from app.models import People, User
+from app.cache import TTLCache
+
+
+# Read-only copy of a logged-in user
+class UserSnapshot(UserMixin):
+    """Detached, immutable user for current_user (no password hash, no lazy loads)."""
+
+    __slots__ = ("id", "username", "person_id", "person_name")
+
+    def __init__(self, id, username, person_id, person_name):
+        for name, value in zip(self.__slots__, (id, username, person_id, person_name)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSnapshot is read-only")
+
+    def __repr__(self):
+        return f"<UserSnapshot {self.id} {self.username!r}>"
+
+
+# Sized from USER_CACHE_SIZE / USER_CACHE_TTL by init_app()
+user_cache = TTLCache()
+
+
+def person_tag(person_id):
+    return f"person:{person_id}"
+
+
+# USER LOADER
+# Flask-Login calls this on every request with the user id stored in the session
+@login_manager.user_loader
+def load_user(user_id):
+    """Return the UserSnapshot for a session's user id, from the cache or with one query."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None:
+        return snapshot
+
+    row = db.session.execute(
+        select(User.id, User.username, User.person_id, People.name)
+        .join(People, People.id == User.person_id)
+        .where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None
+
+    snapshot = UserSnapshot(*row)
+    user_cache.set(user_id, snapshot, tags=[person_tag(snapshot.person_id)])
+    return snapshot
+
+
+def forget_user(user_id):
+    """Evict a user from the cache (logout)."""
+    try:
+        user_cache.discard(int(user_id))
+    except (TypeError, ValueError):
+        pass
+
+
+def identity_stats():
+    """Hit/miss counters for the identity cache."""
+    return user_cache.stats()
+
+
+# SESSION EVENTS
+# Remember changed or deleted users and people, and evict them once the change is committed
+@event.listens_for(db.session, "after_flush")
+def collect_changed_users(session, flush_context):
+    users = session.info.setdefault("identity_users", set())
+    people = session.info.setdefault("identity_people", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            users.add(obj.id)
+        elif isinstance(obj, People):
+            people.add(obj.id)
+
+
+@event.listens_for(db.session, "after_commit")
+def evict_changed_users(session):
+    for user_id in session.info.pop("identity_users", ()):
+        user_cache.discard(user_id)
+    people = session.info.pop("identity_people", ())
+    if people:
+        user_cache.invalidate(*(person_tag(person_id) for person_id in people))
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_changed_users(session):
+    session.info.pop("identity_users", None)
+    session.info.pop("identity_people", None)
+
+
+def init_app(app):
+    """Size the identity cache from the config."""
+    user_cache.max_entries = app.config["USER_CACHE_SIZE"]
+    user_cache.ttl = app.config["USER_CACHE_TTL"]
@@ -0,0 +1,309 @@
+# Bulk import of restaurants, meals and tags from CSV or JSON Lines
+# - Rows are read one at a time from the stream, never loaded into memory all at once
+# - Rows are checked with the same rules as the forms (app/validation.py)
+# - Restaurant and person names are resolved to ids through dicts loaded once at the start
+# - Valid rows are inserted in batches (one executemany and one transaction per batch)
+# - A bad row is reported with its line number and skipped, the run carries on
+# - Restaurants get coordinates from latitude/longitude columns, or from the offline geocoder (app/geo.py)
+# Core inserts don't fire the session events, so the statistics, tag counts, page versions, search index and
+# location index are updated here.
+
+# Standard library imports
+import csv
+import io
+import json
+import sys
+import time
+from collections import Counter
+from datetime import date
+
+# Third-party imports
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+# Local app imports
+from app import db
+from app.models import People, Restaurant, Meal, Tag, restaurant_tags
+from app.validation import restaurant_error, meal_error, clean_text, parse_price
+from app.tagging import normalize_tag
+from app import cache, geo, search, stats, tagging
+
+
+KINDS = ("restaurants", "meals", "tags")
+FORMATS = ("csv", "jsonl")
+
+# Only the first errors are kept in the report (all are counted)
+MAX_REPORTED_ERRORS = 1000
+
+
+# Result of an import run
+class ImportReport:
+    """Rows read, rows inserted, per-row errors and throughput of one import."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []  # (line, message)
+        self.elapsed = 0.0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "error_count": self.error_count,
+            "errors": [{"line": line, "message": message} for line, message in self.errors],
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1),
+        }
+
+
+# READING
+def read_rows(stream, fmt):
+    """Yield (line, row, error) for each record in a text stream. row is a dict, or None when error is set."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+    elif fmt == "jsonl":
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as error:
+                yield line, None, f"Invalid JSON: {error}"
+                continue
+            if not isinstance(row, dict):
+                yield line, None, "Each line must be a JSON object."
+                continue
+            yield line, row, None
+    else:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+
+def format_for(filename):
+    """Guess the format from a file name (.jsonl / .ndjson are JSON Lines, anything else CSV)."""
+    return "jsonl" if filename.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+# IMPORTER
+class BulkImporter:
+    """
+    Imports one kind of record. Name -> id dicts are loaded when the importer is created
+    and extended with the rows it inserts.
+    """
+
+    def __init__(self, kind, batch_size=None):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind {kind!r}, expected one of {', '.join(KINDS)}")
+        self.kind = kind
+        self.batch_size = batch_size or current_app.config["IMPORT_BATCH_SIZE"]
+        self.parse = getattr(self, f"_parse_{kind}")
+        self.insert = getattr(self, f"_insert_{kind}")
+
+        session = db.session
+        self.restaurants = dict(session.execute(select(Restaurant.name, Restaurant.id)).all())
+        if kind == "meals":
+            # Names aren't unique in people - the oldest person with a name wins
+            self.people = {}
+            for person_id, name in session.execute(select(People.id, People.name).order_by(People.id)):
+                self.people.setdefault(name, person_id)
+        if kind == "tags":
+            self.tags = set(session.execute(
+                select(restaurant_tags.c.restaurant_id, Tag.name).join(Tag, Tag.id == restaurant_tags.c.tag_id)
+            ).all())
+        # Search documents are rebuilt once at the end (a restaurant's document includes all its meal notes)
+        self.touched = set()
+
+    def run(self, stream, fmt):
+        """Import every row of the stream. Returns an ImportReport."""
+        report = ImportReport(self.kind)
+        start = time.perf_counter()
+        batch = []
+        try:
+            for line, row, error in read_rows(stream, fmt):
+                report.rows += 1
+                if error is None:
+                    values, error = self.parse(row)
+                if error:
+                    report.error(line, error)
+                    continue
+                batch.append((line, values))
+                if len(batch) >= self.batch_size:
+                    self._write(batch, report)
+                    batch = []
+            if batch:
+                self._write(batch, report)
+        finally:
+            self._reindex()
+            report.elapsed = time.perf_counter() - start
+        return report
+
+    # One transaction per batch, falling back to row by row if the database rejects the batch
+    def _write(self, batch, report):
+        try:
+            self._commit([values for _, values in batch])
+            report.inserted += len(batch)
+            return
+        except IntegrityError:
+            db.session.rollback()
+
+        # e.g. another user added the same restaurant while the import was running
+        for line, values in batch:
+            try:
+                self._commit([values])
+                report.inserted += 1
+            except IntegrityError as error:
+                db.session.rollback()
+                report.error(line, f"Rejected by the database: {error.orig}")
+
+    def _commit(self, rows):
+        connection = db.session.connection()
+        touched = self.insert(connection, rows)
+        cache.bump_versions(connection, touched)
+        db.session.commit()
+        cache.invalidate_restaurants(touched)
+        self.touched.update(touched)
+
+    def _reindex(self):
+        if not self.touched:
+            return
+        try:
+            search.reindex_restaurants(db.session.connection(), self.touched)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    # RESTAURANTS
+    def _parse_restaurants(self, row):
+        name = clean_text(row.get("name"))
+        address = clean_text(row.get("address"))
+        phone = clean_text(row.get("phone"))
+        cuisine = clean_text(row.get("cuisine"))
+        rating = clean_text(row.get("rating"))
+
+        error = restaurant_error(name, phone, cuisine, rating)
+        if error:
+            return None, error
+        try:
+            point = geo.parse_point(clean_text(row.get("latitude")), clean_text(row.get("longitude")))
+        except ValueError as error:
+            return None, str(error)
+        if name in self.restaurants:
+            return None, "Restaurant already exists."
+        # Claim the name so a duplicate later in the file is reported too
+        self.restaurants[name] = None
+        latitude, longitude = point or geo.geocode(address) or (None, None)
+        return {"name": name, "address": address, "phone_number": phone, "cuisine": cuisine,
+                "rating": int(rating), "latitude": latitude, "longitude": longitude}, None
+
+    def _insert_restaurants(self, connection, rows):
+        result = connection.execute(
+            insert(Restaurant.__table__).returning(Restaurant.id, Restaurant.name), rows
+        )
+        ids = []
+        for restaurant_id, name in result:
+            self.restaurants[name] = restaurant_id
+            ids.append(restaurant_id)
+        stats.create_restaurant_rows(connection, ids)
+        geo.sync_locations(connection, ids)
+        return ids
+
+    # MEALS
+    def _parse_meals(self, row):
+        restaurant = clean_text(row.get("restaurant"))
+        person = clean_text(row.get("person"))
+        name = clean_text(row.get("name"))
+        day = clean_text(row.get("date"))
+        price = clean_text(row.get("price"))
+
+        error = meal_error(name, day, price)
+        if error:
+            return None, error
+        restaurant_id = self.restaurants.get(restaurant)
+        if restaurant_id is None:
+            return None, f"Unknown restaurant {restaurant!r}."
+        person_id = self.people.get(person)
+        if person_id is None:
+            return None, f"Unknown person {person!r}."
+        return {"restaurant_id": restaurant_id, "person_id": person_id, "name": name,
+                "date": date.fromisoformat(day), "price": parse_price(price),
+                "rating": clean_text(row.get("rating")), "notes": clean_text(row.get("notes"))}, None
+
+    def _insert_meals(self, connection, rows):
+        connection.execute(insert(Meal.__table__), rows)
+        stats.apply_meal_deltas(
+            connection, [(row["restaurant_id"], row["person_id"], row["date"], row["price"]) for row in rows], []
+        )
+        return {row["restaurant_id"] for row in rows}
+
+    # TAGS
+    def _parse_tags(self, row):
+        restaurant = clean_text(row.get("restaurant"))
+        name = normalize_tag(row.get("name"))
+        if not name:
+            return None, "Please enter a tag name."
+        restaurant_id = self.restaurants.get(restaurant)
+        if restaurant_id is None:
+            return None, f"Unknown restaurant {restaurant!r}."
+        if (restaurant_id, name) in self.tags:
+            return None, "Restaurant already has this tag."
+        self.tags.add((restaurant_id, name))
+        return {"restaurant_id": restaurant_id, "name": name}, None
+
+    def _insert_tags(self, connection, rows):
+        # Tag ids are looked up per batch, names new to the vocabulary are added in the same transaction
+        ids = tagging.tag_ids(connection, [row["name"] for row in rows])
+        connection.execute(insert(restaurant_tags), [{"restaurant_id": row["restaurant_id"],
+                                                      "tag_id": ids[row["name"]]} for row in rows])
+        tagging.apply_tag_deltas(connection, Counter(ids[row["name"]] for row in rows))
+        return {row["restaurant_id"] for row in rows}
+
+
+def import_rows(stream, kind, fmt="csv", batch_size=None):
+    """Import records of one kind from a text stream. Returns an ImportReport."""
+    return BulkImporter(kind, batch_size).run(stream, fmt)
+
+
+# CLI
+@click.command("import-data")
+@with_appcontext
+@click.argument("path", type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option("--kind", type=click.Choice(KINDS), required=True, help="What the file contains.")
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default=None,
+              help="File format (default: from the file extension, stdin is CSV).")
+@click.option("--batch-size", type=int, default=None, help="Rows per transaction.")
+def import_data_command(path, kind, fmt, batch_size):
+    """Import restaurants, meals or tags from a CSV or JSON Lines file ('-' reads stdin)."""
+    if path == "-":
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+        fmt = fmt or "csv"
+    else:
+        stream = open(path, encoding="utf-8-sig", newline="")
+        fmt = fmt or format_for(path)
+
+    with stream:
+        report = import_rows(stream, kind, fmt, batch_size)
+
+    for line, message in report.errors:
+        click.echo(f"line {line}: {message}", err=True)
+    if report.error_count > len(report.errors):
+        click.echo(f"... {report.error_count - len(report.errors)} more errors", err=True)
+    click.echo(f"Imported {report.inserted} of {report.rows} {kind} rows in {report.elapsed:.2f}s "
+               f"({report.rows_per_sec:.0f} rows/sec), {report.error_count} errors.")
@@ -0,0 +1,391 @@
+# Background jobs - a small work queue in the jobs table, run by a pool of worker threads
+# - enqueue() stores a job and returns straight away: routes answer 202 with the job id, clients poll
+#   /api/jobs/<id> for the status, progress and result
+# - Workers claim the next ready job with a single UPDATE ... RETURNING, so several threads and processes can
+#   share the queue without running a job twice
+# - A job that raises is retried after JOB_RETRY_DELAY seconds (doubling each attempt) until max_attempts
+# - A running job holds a lease (run_after) renewed by every progress report; if its worker dies the lease runs
+#   out and another worker takes the job over. A handler that can't report for a while (one long transaction)
+#   takes a longer lease before it starts
+# - A handler may register an on_failure clean-up, called once the job has failed for good - also when the
+#   worker died on the last attempt and housekeeping fails the job
+# - Handlers work in batches of JOB_BATCH_SIZE rows, one short transaction each, so a big cascade or rebuild never
+#   holds the SQLite write lock for long and a retry carries on where the last attempt stopped
+# Worker threads start in the web process on the first enqueue (JOB_WORKERS of them). With JOB_WORKERS=0 the jobs
+# wait for a separate `flask jobs-worker` process.
+
+# Standard library imports
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Third-party imports
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+# Local app imports
+from app import db
+from app.models import Restaurant, Meal, MealPhoto, RestaurantStats, Job, restaurant_tags
+from app import cache, geo, search, stats, tagging
+
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+# Seconds between clean-ups of finished and abandoned jobs (per worker process)
+HOUSEKEEPING_EVERY = 60
+
+# Registered handlers: {kind: (function(run) -> result, max attempts or None for JOB_MAX_ATTEMPTS,
+#                               function(payload) called when the job fails for good, or None)}
+HANDLERS = {}
+
+
+# Decorator to register a job handler
+def job_handler(kind, max_attempts=None, on_failure=None):
+    """Register fn(run) as the handler of a job kind. Its return value (JSON-able) is stored as the result."""
+    def register(fn):
+        HANDLERS[kind] = (fn, max_attempts, on_failure)
+        return fn
+    return register
+
+
+class JobRun:
+    """The job a handler is running: id, payload and attempt number, and progress reporting."""
+
+    def __init__(self, job_id, kind, payload, attempt, max_attempts):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.attempt = attempt
+        self.max_attempts = max_attempts
+
+    def report(self, lease=None, **progress):
+        """Store progress for status polling and renew the job's lease (lease seconds, or JOB_STALE_AFTER)."""
+        with db.engine.begin() as connection:
+            connection.execute(update(Job.__table__).where(Job.id == self.id)
+                               .values(progress=progress, run_after=_lease_end(lease)))
+
+
+def _lease_end(seconds=None):
+    return datetime.now() + timedelta(seconds=seconds or current_app.config["JOB_STALE_AFTER"])
+
+
+# QUEUE
+def enqueue(kind, payload=None, key=None):
+    """
+    Queue a job and wake the workers. Returns the Job (committed, so its id can be sent to the client).
+    - key: a job with the same key that is still queued or running is returned instead of queueing another one
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}, expected one of {', '.join(HANDLERS)}")
+    if key is not None:
+        job = _active_job(key)
+        if job is not None:
+            return job
+
+    now = datetime.now()
+    job = Job(kind=kind, payload=payload or {}, key=key, status=QUEUED, attempts=0,
+              max_attempts=HANDLERS[kind][1] or current_app.config["JOB_MAX_ATTEMPTS"], created_at=now,
+              run_after=now)
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request queued a job with the same key at the same moment (ux_jobs_active_key) - use its job,
+        # or queue again if it has finished since
+        db.session.rollback()
+        if key is None:
+            raise
+        return _active_job(key) or enqueue(kind, payload, key)
+
+    if current_app.config["JOB_WORKERS"]:
+        start_workers(current_app._get_current_object(), current_app.config["JOB_WORKERS"])
+    _wakeup.set()
+    return job
+
+
+def _active_job(key):
+    return Job.query.filter(Job.key == key, Job.status.in_(ACTIVE)).first()
+
+
+def describe(job):
+    """Status of a job for polling clients (JSON-able)."""
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "progress": job.progress,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(timespec="seconds"),
+        "started_at": job.started_at.isoformat(timespec="seconds") if job.started_at else None,
+        "finished_at": job.finished_at.isoformat(timespec="seconds") if job.finished_at else None,
+    }
+
+
+def _claim():
+    """Mark the next ready job as running (one UPDATE, safe between workers). Returns a JobRun or None."""
+    jobs = Job.__table__
+    now = datetime.now()
+    # Queued jobs past their retry delay, and running jobs whose worker stopped renewing the lease
+    ready = and_(jobs.c.run_after <= now, or_(
+        jobs.c.status == QUEUED,
+        and_(jobs.c.status == RUNNING, jobs.c.attempts < jobs.c.max_attempts),
+    ))
+    next_id = (select(jobs.c.id).where(jobs.c.status.in_(ACTIVE), ready)
+               .order_by(jobs.c.run_after, jobs.c.id).limit(1).scalar_subquery())
+    with db.engine.begin() as connection:
+        # The status check is repeated on the row itself in case another worker claimed it first
+        row = connection.execute(
+            update(jobs).where(jobs.c.id == next_id, ready)
+            .values(status=RUNNING, attempts=jobs.c.attempts + 1, started_at=now, run_after=_lease_end())
+            .returning(jobs.c.id, jobs.c.kind, jobs.c.payload, jobs.c.attempts, jobs.c.max_attempts)
+        ).first()
+    return JobRun(*row) if row else None
+
+
+def _finish(run, **values):
+    with db.engine.begin() as connection:
+        connection.execute(update(Job.__table__).where(Job.id == run.id).values(**values))
+
+
+def run_next():
+    """Claim and run one job. Returns False if no job was ready."""
+    run = _claim()
+    if run is None:
+        return False
+
+    try:
+        handler = HANDLERS.get(run.kind)
+        if handler is None:
+            raise LookupError(f"No handler for job kind {run.kind!r}")
+        result = handler[0](run)
+    except Exception as error:
+        db.session.rollback()
+        current_app.logger.exception("Job %s (%s) failed on attempt %s", run.id, run.kind, run.attempt)
+        message = f"{type(error).__name__}: {error}"
+        if run.attempt < run.max_attempts:
+            delay = current_app.config["JOB_RETRY_DELAY"] * 2 ** (run.attempt - 1)
+            _finish(run, status=QUEUED, error=message, run_after=datetime.now() + timedelta(seconds=delay))
+        else:
+            _finish(run, status=FAILED, error=message, finished_at=datetime.now())
+            _failed(run.kind, run.payload)
+    else:
+        _finish(run, status=DONE, result=result, error=None, finished_at=datetime.now())
+    finally:
+        db.session.remove()
+    return True
+
+
+def housekeeping():
+    """Fail jobs abandoned on their last attempt and delete finished jobs older than JOB_RETENTION."""
+    jobs = Job.__table__
+    now = datetime.now()
+    with db.engine.begin() as connection:
+        abandoned = connection.execute(
+            update(jobs).where(jobs.c.status == RUNNING, jobs.c.run_after <= now,
+                               jobs.c.attempts >= jobs.c.max_attempts)
+            .values(status=FAILED, error="The worker stopped while running the job.", finished_at=now)
+            .returning(jobs.c.kind, jobs.c.payload)
+        ).all()
+        connection.execute(delete(jobs).where(jobs.c.status.in_((DONE, FAILED)),
+                                              jobs.c.finished_at < now - current_app.config["JOB_RETENTION"]))
+    for kind, payload in abandoned:
+        _failed(kind, payload)
+
+
+def _failed(kind, payload):
+    """Run the on_failure clean-up of a job that won't be tried again (its errors are logged, not raised)."""
+    on_failure = HANDLERS.get(kind, (None, None, None))[2]
+    if on_failure is None:
+        return
+    try:
+        on_failure(payload)
+    except Exception:
+        current_app.logger.exception("Clean-up of a failed %s job failed", kind)
+
+
+# WORKER POOL
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_stop = threading.Event()
+_threads = []
+
+
+def start_workers(app, count):
+    """Start worker threads for the app until there are count of them (no-op once started)."""
+    with _lock:
+        _stop.clear()
+        while len(_threads) < count:
+            thread = threading.Thread(target=_work, args=(app,), name=f"job-worker-{len(_threads) + 1}",
+                                      daemon=True)
+            thread.start()
+            _threads.append(thread)
+
+
+def _work(app):
+    last_housekeeping = 0.0
+    while not _stop.is_set():
+        ran = False
+        try:
+            with app.app_context():
+                ran = run_next()
+                if not ran and time.monotonic() - last_housekeeping > HOUSEKEEPING_EVERY:
+                    last_housekeeping = time.monotonic()
+                    housekeeping()
+        except Exception:
+            # e.g. the database is locked for longer than busy_timeout - try again on the next poll
+            app.logger.exception("Job worker error")
+        if not ran:
+            _wakeup.wait(app.config["JOB_POLL_INTERVAL"])
+            _wakeup.clear()
+
+
+def shutdown():
+    """Stop the worker threads after their current job (used by the worker command and tests)."""
+    with _lock:
+        _stop.set()
+        _wakeup.set()
+        for thread in _threads:
+            thread.join()
+        _threads.clear()
+
+
+# Threads don't survive a fork - a forked child starts its own on its first enqueue
+os.register_at_fork(after_in_child=_threads.clear)
+
+
+# HANDLERS
+# Core statements don't fire the session events, so each handler updates the derived data itself
+@job_handler("delete_restaurant")
+def delete_restaurant(run):
+    """Delete a restaurant with its meals and their photos (a batch per transaction), tag links and statistics."""
+    restaurant_id = run.payload["restaurant_id"]
+    batch_size = current_app.config["JOB_BATCH_SIZE"]
+    deleted = 0
+    while True:
+        with db.engine.begin() as connection:
+            # Found through the (restaurant_id, date) index
+            rows = connection.execute(
+                select(Meal.id, Meal.restaurant_id, Meal.person_id, Meal.date, Meal.price)
+                .where(Meal.restaurant_id == restaurant_id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            meal_ids = [row.id for row in rows]
+            # Photo files stay on disk until the prune_media job finds them unused
+            connection.execute(delete(MealPhoto.__table__).where(MealPhoto.meal_id.in_(meal_ids)))
+            connection.execute(delete(Meal.__table__).where(Meal.id.in_(meal_ids)))
+            stats.apply_meal_deltas(connection, [], [tuple(row)[1:] for row in rows])
+            cache.bump_versions(connection, [restaurant_id])
+        cache.invalidate_restaurants([restaurant_id])
+        deleted += len(rows)
+        run.report(meals_deleted=deleted)
+
+    with db.engine.begin() as connection:
+        tag_ids = connection.execute(
+            select(restaurant_tags.c.tag_id).where(restaurant_tags.c.restaurant_id == restaurant_id)
+        ).scalars().all()
+        connection.execute(delete(restaurant_tags).where(restaurant_tags.c.restaurant_id == restaurant_id))
+        tagging.apply_tag_deltas(connection, {tag_id: -1 for tag_id in tag_ids})
+        cache.bump_versions(connection, [restaurant_id])
+        connection.execute(delete(RestaurantStats.__table__).where(RestaurantStats.restaurant_id == restaurant_id))
+        found = connection.execute(delete(Restaurant.__table__).where(Restaurant.id == restaurant_id)).rowcount
+        # Removes the search document and the location
+        search.reindex_restaurants(connection, [restaurant_id])
+        geo.sync_locations(connection, [restaurant_id])
+    cache.invalidate_restaurants([restaurant_id])
+    return {"restaurant_id": restaurant_id, "deleted": bool(found), "meals_deleted": deleted}
+
+
+def _remove_upload(payload):
+    """Delete an import job's uploaded file (once imported, or when the job fails without reaching the handler)."""
+    path = payload.get("path")
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+# One attempt only: a retry would insert the rows of the first attempt's committed batches again
+@job_handler("import", max_attempts=1, on_failure=_remove_upload)
+def import_file(run):
+    """Import an uploaded file (saved under JOB_UPLOAD_DIR, removed afterwards). The result is the import report."""
+    # Only loaded by the workers that run an import
+    from app.importer import import_rows
+
+    try:
+        with open(run.payload["path"], encoding="utf-8-sig", newline="") as stream:
+            report = import_rows(stream, run.payload["kind"], run.payload["format"])
+    finally:
+        _remove_upload(run.payload)
+    return report.to_dict()
+
+
+@job_handler("rebuild_search")
+def rebuild_search(run):
+    """Re-index every restaurant, a batch per transaction, then drop documents of deleted restaurants."""
+    batch_size = current_app.config["JOB_BATCH_SIZE"]
+    with db.engine.begin() as connection:
+        search.create_search_index(connection)
+
+    last_id, indexed = 0, 0
+    while True:
+        with db.engine.begin() as connection:
+            ids = connection.execute(select(Restaurant.id).where(Restaurant.id > last_id)
+                                     .order_by(Restaurant.id).limit(batch_size)).scalars().all()
+            if not ids:
+                break
+            search.reindex_restaurants(connection, ids)
+        last_id = ids[-1]
+        indexed += len(ids)
+        run.report(restaurants_indexed=indexed)
+
+    with db.engine.begin() as connection:
+        search.prune_search_index(connection)
+    return {"restaurants_indexed": indexed}
+
+
+@job_handler("refresh_stats")
+def refresh_stats(run):
+    """Recompute the statistics tables and tag counts."""
+    # One transaction: the tables are refilled from scratch, readers must never see them half empty. It can't
+    # report progress (SQLite would make the report wait for its own write lock), so the lease is taken up front
+    run.report(lease=current_app.config["JOB_REBUILD_LEASE"], stage="rebuilding statistics")
+    with db.engine.begin() as connection:
+        months = stats.rebuild_stats(connection)
+        tagging.rebuild_tag_counts(connection)
+    return {"person_months": months}
+
+
+# Command line: flask --app run jobs-worker
+@click.command("jobs-worker")
+@with_appcontext
+@click.option("--workers", type=int, default=None, help="Worker threads (default: JOB_WORKERS, at least 1).")
+@click.option("--drain", is_flag=True, help="Run the jobs that are ready one by one, then exit.")
+def jobs_worker_command(workers, drain):
+    """Run background jobs in this process (for web processes started with JOB_WORKERS=0)."""
+    if drain:
+        count = 0
+        while run_next():
+            count += 1
+        click.echo(f"Ran {count} jobs.")
+        return
+
+    count = workers or current_app.config["JOB_WORKERS"] or 1
+    start_workers(current_app._get_current_object(), count)
+    click.echo(f"Running jobs with {count} workers, Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        click.echo("Stopping after the current jobs...")
+        shutdown()
@@ -0,0 +1,277 @@
+# Meal photos - files on disk under content-addressed paths, thumbnails made by background jobs
+# - An upload is copied to a temporary file MEDIA_CHUNK_SIZE bytes at a time while its SHA-256 is computed, then
+#   moved to MEDIA_DIR/originals/ab/cd/<sha256>: the same photo uploaded twice is stored once. When the file is
+#   already stored, the temporary copy is kept until the photo's rows are committed and put back if the prune_media
+#   job removed the file in the meantime
+# - Only JPEG, PNG, GIF and WebP images are accepted (checked from the first bytes, not the file name)
+# - The database keeps a media_files row per distinct file and a meal_photos row per photo of a meal, no blobs
+# - Thumbnails (MEDIA_THUMBNAIL_SIZES, longest side in pixels) are made by the "thumbnails" job on the job workers.
+#   Pillow is optional: without it the thumbnail URLs serve the original
+# - A stored file never changes, so it is served with its hash as ETag, Range support and immutable cache headers
+
+# Standard library imports
+import hashlib
+import os
+import tempfile
+from datetime import datetime
+
+# Third-party imports
+from flask import current_app, send_file, url_for
+from sqlalchemy import delete, exists, select
+from sqlalchemy.exc import IntegrityError
+
+# Pillow is only needed for thumbnails
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+# Local app imports
+from app import db
+from app.jobs import enqueue, job_handler
+from app.models import MediaFile, MealPhoto
+
+
+# Image types by their first bytes (WebP is checked separately: "RIFF", 4 bytes of size, "WEBP")
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+# Stored files never change: browsers keep them for a year without checking again
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+
+# Raised for an upload that can't be stored
+class MediaError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff_type(head):
+    """Content type of an image from its first bytes, None if it isn't a supported image."""
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def is_sha256(value):
+    return len(value) == 64 and all(char in "0123456789abcdef" for char in value)
+
+
+# PATHS
+def original_path(sha256):
+    return os.path.join(current_app.config["MEDIA_DIR"], "originals", sha256[:2], sha256[2:4], sha256)
+
+
+def thumbnail_path(sha256, size):
+    return os.path.join(current_app.config["MEDIA_DIR"], "thumbnails", str(size), sha256[:2], sha256[2:4],
+                        f"{sha256}.jpg")
+
+
+# STORING
+def check_upload_length(content_length):
+    """Raise MediaError (413) if a request body of content_length bytes can't hold an allowed photo."""
+    max_bytes = current_app.config["MEDIA_MAX_BYTES"]
+    if content_length and content_length > max_bytes + current_app.config["UPLOAD_OVERHEAD_BYTES"]:
+        raise MediaError(f"Photos can be at most {max_bytes // (1024 * 1024)} MB.", 413)
+
+
+def store_stream(stream):
+    """
+    Copy an upload stream to content-addressed storage in chunks. Returns (sha256, content type, size, spare path):
+    spare path is the temporary copy of a file that was already stored, None if the upload was moved into place.
+    The caller puts the spare copy back if needed (keep_stored), then removes it. Raises MediaError for an empty,
+    unsupported (415) or too large (413) file.
+    """
+    chunk_size = current_app.config["MEDIA_CHUNK_SIZE"]
+    max_bytes = current_app.config["MEDIA_MAX_BYTES"]
+    tmp_dir = os.path.join(current_app.config["MEDIA_DIR"], "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    content_type = None
+    # Same file system as the final path, so the move below is an atomic rename
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                if content_type is None:
+                    content_type = sniff_type(chunk)
+                    if content_type is None:
+                        raise MediaError("Photos must be JPEG, PNG, GIF or WebP images.", 415)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise MediaError(f"Photos can be at most {max_bytes // (1024 * 1024)} MB.", 413)
+                digest.update(chunk)
+                out.write(chunk)
+        if not size:
+            raise MediaError("The photo is empty.")
+
+        sha256 = digest.hexdigest()
+        path = original_path(sha256)
+        if os.path.exists(path):
+            # Already stored (same content, same name), but prune_media may be removing it: keep the copy
+            return sha256, content_type, size, tmp_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return sha256, content_type, size, None
+
+
+def keep_stored(sha256, spare_path):
+    """
+    After a file's rows are committed, put the spare copy from store_stream back if prune_media removed the file
+    since it was found stored (prune_media moves a file aside before checking its rows, see below).
+    """
+    path = original_path(sha256)
+    if spare_path is not None and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(spare_path, path)
+
+
+def add_meal_photo(meal_id, stream):
+    """Store an upload as a photo of a meal. Returns the MealPhoto (committed) and queues its thumbnails."""
+    sha256, content_type, size, spare_path = store_stream(stream)
+    try:
+        now = datetime.now()
+        media = db.session.get(MediaFile, sha256)
+        if media is None:
+            media = MediaFile(sha256=sha256, content_type=content_type, size=size, created_at=now)
+            db.session.add(media)
+        photo = MealPhoto(meal_id=meal_id, sha256=sha256, created_at=now)
+        db.session.add(photo)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request stored the same file at the same moment - use its row
+            db.session.rollback()
+            media = db.session.get(MediaFile, sha256)
+            photo = MealPhoto(meal_id=meal_id, sha256=sha256, created_at=now)
+            db.session.add(photo)
+            db.session.commit()
+        # prune_media may have deleted the file's row between the lookup above and the commit
+        if db.session.scalar(select(MediaFile.sha256).where(MediaFile.sha256 == sha256)) is None:
+            db.session.expunge(media)
+            media = MediaFile(sha256=sha256, content_type=content_type, size=size, created_at=now)
+            db.session.add(media)
+            db.session.commit()
+        keep_stored(sha256, spare_path)
+    finally:
+        if spare_path is not None and os.path.exists(spare_path):
+            os.remove(spare_path)
+
+    if Image is not None and set(media.thumbnails or ()) != set(current_app.config["MEDIA_THUMBNAIL_SIZES"]):
+        enqueue("thumbnails", {"sha256": sha256}, key=f"thumbnails:{sha256}")
+    return photo
+
+
+def describe_photo(photo):
+    """A meal photo with the URLs of the original and its thumbnails (JSON-able)."""
+    return {
+        "id": photo.id,
+        "meal_id": photo.meal_id,
+        "sha256": photo.sha256,
+        "url": url_for("media.original", sha256=photo.sha256),
+        "thumbnails": {str(size): url_for("media.thumbnail", sha256=photo.sha256, size=size)
+                       for size in current_app.config["MEDIA_THUMBNAIL_SIZES"]},
+    }
+
+
+# SERVING
+def send_stored(path, content_type, sha256):
+    """A stored file with ETag, Range and immutable cache headers (send_file answers 304 / 206 / 416 itself)."""
+    response = send_file(path, mimetype=content_type, conditional=True, etag=sha256)
+    response.headers["Cache-Control"] = IMMUTABLE
+    return response
+
+
+# JOBS
+@job_handler("thumbnails")
+def make_thumbnails(run):
+    """Resize a stored image to every MEDIA_THUMBNAIL_SIZES size (JPEG) and record its dimensions."""
+    sha256 = run.payload["sha256"]
+    if Image is None:
+        return {"skipped": "Pillow is not installed"}
+    media = db.session.get(MediaFile, sha256)
+    if media is None:
+        return {"skipped": "The file was deleted"}
+
+    sizes = list(current_app.config["MEDIA_THUMBNAIL_SIZES"])
+    with Image.open(original_path(sha256)) as image:
+        # Apply the camera's rotation, thumbnails have no EXIF data
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        for size in sizes:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            path = thumbnail_path(sha256, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written next to the final name, then renamed, so a request never reads half a file
+            tmp_path = f"{path}.{run.id}.tmp"
+            thumbnail.save(tmp_path, "JPEG", quality=85, optimize=True)
+            os.replace(tmp_path, path)
+
+    media.width, media.height, media.thumbnails = width, height, sizes
+    db.session.commit()
+    return {"width": width, "height": height, "thumbnails": sizes}
+
+
+@job_handler("prune_media")
+def prune_media(run):
+    """
+    Delete the stored files (and thumbnails) that no meal photo uses any more. Each file is moved aside before
+    the rows are checked again, so an upload committed after the check finds it missing and puts its copy back.
+    """
+    batch_size = current_app.config["JOB_BATCH_SIZE"]
+    unused = ~exists().where(MealPhoto.sha256 == MediaFile.sha256)
+    tmp_dir = os.path.join(current_app.config["MEDIA_DIR"], "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    removed = 0
+    while True:
+        with db.engine.begin() as connection:
+            hashes = connection.execute(select(MediaFile.sha256).where(unused).limit(batch_size)).scalars().all()
+            if not hashes:
+                break
+            connection.execute(delete(MediaFile.__table__).where(MediaFile.sha256.in_(hashes)))
+
+        pruned = {}
+        for sha256 in hashes:
+            path = original_path(sha256)
+            if os.path.exists(path):
+                pruned[sha256] = os.path.join(tmp_dir, f"{sha256}.{run.id}.pruned")
+                os.replace(path, pruned[sha256])
+
+        # Keep the files of any hash uploaded again since the rows were deleted
+        with db.engine.connect() as connection:
+            uploaded_again = set(connection.execute(
+                select(MediaFile.sha256).where(MediaFile.sha256.in_(hashes))
+            ).scalars())
+        for sha256 in hashes:
+            if sha256 in uploaded_again:
+                if sha256 in pruned:
+                    os.replace(pruned[sha256], original_path(sha256))
+                continue
+            paths = [thumbnail_path(sha256, size) for size in current_app.config["MEDIA_THUMBNAIL_SIZES"]]
+            paths += [pruned[sha256]] if sha256 in pruned else []
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+        removed += len(hashes)
+        run.report(files_removed=removed)
+    return {"files_removed": removed}
@@ -0,0 +1,375 @@
+# Request instrumentation
+# - Per endpoint: latency histogram, requests by status, SQL statements per request, DB time and template render time
+# - Slowest SQL statements, normalized (literals and IN lists collapsed) so the same query is counted once
+# - Exposed in Prometheus text format at /metrics (one set per worker process, Prometheus adds them up)
+# - Sampling profiler: 1 in N requests is run under cProfile and dumped to PROFILE_DIR. N is read from
+#   PROFILE_CONTROL_FILE (set with `flask profile-requests`), so it can be switched on and off without a restart.
+
+# Standard library imports
+import cProfile
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+
+# Third-party imports
+import click
+from flask import current_app, request, template_rendered, before_render_template
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+# Local app imports
+from app import db
+
+
+# Histogram buckets (upper bounds) in Prometheus style
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+# Seconds between checks of the profiler control file
+PROFILE_CHECK_INTERVAL = 2.0
+
+
+# Measurements of the request being handled (per thread / task)
+class RequestStats:
+    __slots__ = ("start", "statements", "db_time", "render_time", "render_start", "status", "profiler")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_start = None
+        self.status = 500  # until a response is made
+        self.profiler = None
+
+
+_current = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count (not thread-safe, callers hold the registry lock)."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry:
+    """All the metrics of this worker process."""
+
+    def __init__(self, max_statements=500):
+        self.lock = threading.Lock()
+        self.latency = {}  # endpoint -> Histogram of seconds
+        self.statements = {}  # endpoint -> Histogram of statements per request
+        self.requests = {}  # (endpoint, status) -> count
+        self.db_seconds = {}  # endpoint -> total seconds in SQL
+        self.render_seconds = {}  # endpoint -> total seconds rendering templates
+        self.sql = {}  # normalized statement -> [count, total seconds, max seconds]
+        self.max_statements = max_statements
+        self.profiles = 0
+
+    def record_request(self, endpoint, stats, elapsed):
+        with self.lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self.statements[endpoint] = Histogram(STATEMENT_BUCKETS)
+            self.latency[endpoint].observe(elapsed)
+            self.statements[endpoint].observe(stats.statements)
+            key = (endpoint, stats.status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.db_seconds[endpoint] = self.db_seconds.get(endpoint, 0.0) + stats.db_time
+            self.render_seconds[endpoint] = self.render_seconds.get(endpoint, 0.0) + stats.render_time
+
+    def record_statement(self, statement, elapsed):
+        normalized = normalize_sql(statement)
+        with self.lock:
+            entry = self.sql.get(normalized)
+            if entry is None:
+                if len(self.sql) >= self.max_statements:
+                    # Forget the statement with the least total time to stay bounded
+                    del self.sql[min(self.sql, key=lambda key: self.sql[key][1])]
+                entry = self.sql[normalized] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+    def slowest_statements(self, limit):
+        """[(statement, count, total seconds, max seconds)] with the most total time first."""
+        with self.lock:
+            entries = sorted(self.sql.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [(statement, *values) for statement, values in entries]
+
+    def reset(self):
+        with self.lock:
+            for table in (self.latency, self.statements, self.requests, self.db_seconds, self.render_seconds,
+                          self.sql):
+                table.clear()
+
+
+registry = Registry()
+
+
+# SQL NORMALIZATION
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(statement):
+    """Statement text with literals replaced by ? and IN lists collapsed, so repeats group together."""
+    statement = _SPACES.sub(" ", statement).strip()
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = re.sub(r"__\[POSTCOMPILE_\w+\]", "?", statement)
+    return _IN_LIST.sub("IN (...)", statement)
+
+
+# SQL EVENTS
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_start"] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("metrics_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+    registry.record_statement(statement, elapsed)
+
+
+# TEMPLATE SIGNALS
+def template_started(sender, template, context, **extra):
+    stats = _current.get()
+    if stats is not None:
+        stats.render_start = time.perf_counter()
+
+
+def template_finished(sender, template, context, **extra):
+    stats = _current.get()
+    if stats is not None and stats.render_start is not None:
+        stats.render_time += time.perf_counter() - stats.render_start
+        stats.render_start = None
+
+
+# SAMPLING PROFILER
+class Sampler:
+    """Decides which requests are profiled. The rate comes from the control file, re-read every few seconds."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.every = 0
+        self.counter = 0
+        self.checked_at = 0.0
+        self.mtime = None
+
+    def refresh(self, path):
+        now = time.monotonic()
+        if now - self.checked_at < PROFILE_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self.every, self.mtime = 0, None
+            return
+        if mtime != self.mtime:
+            self.mtime = mtime
+            try:
+                with open(path) as file:
+                    self.every = max(int(file.read().strip() or 0), 0)
+            except (OSError, ValueError):
+                self.every = 0
+
+    def should_profile(self, path):
+        with self.lock:
+            self.refresh(path)
+            if not self.every:
+                return False
+            self.counter += 1
+            return self.counter % self.every == 0
+
+
+sampler = Sampler()
+
+
+def _dump_profile(app, profiler, endpoint, elapsed):
+    """Write a .prof file (open with python -m pstats or snakeviz) and keep only the newest PROFILE_MAX_FILES."""
+    directory = app.config["PROFILE_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    with registry.lock:
+        registry.profiles += 1
+        number = registry.profiles
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{number}-{endpoint}-{elapsed * 1000:.0f}ms.prof"
+    profiler.dump_stats(os.path.join(directory, name))
+
+    files = sorted(entry.path for entry in os.scandir(directory) if entry.name.endswith(".prof"))
+    for path in files[:max(len(files) - app.config["PROFILE_MAX_FILES"], 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# REQUEST HOOKS
+def start_request():
+    stats = RequestStats()
+    _current.set(stats)
+    if sampler.should_profile(current_app.config["PROFILE_CONTROL_FILE"]):
+        stats.profiler = cProfile.Profile()
+        try:
+            stats.profiler.enable()
+        except ValueError:
+            # Another profiler is already running in this thread
+            stats.profiler = None
+
+
+def record_status(response):
+    stats = _current.get()
+    if stats is not None:
+        stats.status = response.status_code
+    return response
+
+
+def finish_request(error):
+    stats = _current.get()
+    if stats is None:
+        return
+    _current.set(None)
+    elapsed = time.perf_counter() - stats.start
+    endpoint = request.endpoint or "unmatched"
+    if stats.profiler is not None:
+        stats.profiler.disable()
+        _dump_profile(current_app, stats.profiler, endpoint, elapsed)
+    registry.record_request(endpoint, stats, elapsed)
+
+
+# PROMETHEUS TEXT FORMAT
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics(slow_statements=20):
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+
+    def header(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def histogram(name, histograms):
+        for endpoint, values in sorted(histograms.items()):
+            label = f'endpoint="{_label(endpoint)}"'
+            for bound, count in values.cumulative():
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{label},le="+Inf"}} {values.count}')
+            lines.append(f"{name}_sum{{{label}}} {_number(values.sum)}")
+            lines.append(f"{name}_count{{{label}}} {values.count}")
+
+    with registry.lock:
+        header("http_request_duration_seconds", "histogram", "Request latency by endpoint.")
+        histogram("http_request_duration_seconds", registry.latency)
+
+        header("http_requests_total", "counter", "Requests by endpoint and status code.")
+        for (endpoint, status), count in sorted(registry.requests.items()):
+            lines.append(f'http_requests_total{{endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+
+        header("db_statements_per_request", "histogram", "SQL statements issued per request by endpoint.")
+        histogram("db_statements_per_request", registry.statements)
+
+        header("db_seconds_total", "counter", "Time spent in SQL statements by endpoint.")
+        for endpoint, seconds in sorted(registry.db_seconds.items()):
+            lines.append(f'db_seconds_total{{endpoint="{_label(endpoint)}"}} {_number(seconds)}')
+
+        header("template_render_seconds_total", "counter", "Time spent rendering templates by endpoint.")
+        for endpoint, seconds in sorted(registry.render_seconds.items()):
+            lines.append(f'template_render_seconds_total{{endpoint="{_label(endpoint)}"}} {_number(seconds)}')
+
+        header("profiles_written_total", "counter", "Request profiles dumped by the sampling profiler.")
+        lines.append(f"profiles_written_total {registry.profiles}")
+
+    slowest = registry.slowest_statements(slow_statements)
+    header("db_statement_seconds_total", "counter", "Time spent in the slowest normalized SQL statements.")
+    for statement, count, total, _ in slowest:
+        lines.append(f'db_statement_seconds_total{{statement="{_label(statement)}"}} {_number(total)}')
+    header("db_statement_calls_total", "counter", "Calls of the slowest normalized SQL statements.")
+    for statement, count, _, _ in slowest:
+        lines.append(f'db_statement_calls_total{{statement="{_label(statement)}"}} {count}')
+    header("db_statement_max_seconds", "gauge", "Longest single call of the slowest normalized SQL statements.")
+    for statement, _, _, longest in slowest:
+        lines.append(f'db_statement_max_seconds{{statement="{_label(statement)}"}} {_number(longest)}')
+
+    return "\n".join(lines) + "\n"
+
+
+# SETUP
+def init_app(app):
+    """Install the request hooks, SQL events and template signals (unless METRICS_ENABLED is off)."""
+    if not app.config["METRICS_ENABLED"]:
+        return
+    registry.max_statements = app.config["METRICS_MAX_STATEMENTS"]
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    before_render_template.connect(template_started, app)
+    template_rendered.connect(template_finished, app)
+
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
+
+
+# Command line: flask --app run profile-requests --every 100 / --off
+@click.command("profile-requests")
+@click.option("--every", type=int, default=None, help="Profile 1 in N requests.")
+@click.option("--off", is_flag=True, help="Stop profiling.")
+@with_appcontext
+def profile_requests_command(every, off):
+    """Switch the sampling profiler on or off in every running worker (no restart needed)."""
+    path = current_app.config["PROFILE_CONTROL_FILE"]
+    if not off and every is None:
+        sampler.refresh(path)
+        click.echo(f"Profiling 1 in {sampler.every} requests." if sampler.every else "Request profiling is off.")
+        return
+    if off or every <= 0:
+        if os.path.exists(path):
+            os.remove(path)
+        click.echo("Request profiling is off.")
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(str(every))
+    click.echo(f"Profiling 1 in {every} requests into {current_app.config['PROFILE_DIR']} "
+               f"(within {PROFILE_CHECK_INTERVAL:.0f}s).")
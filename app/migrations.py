@@ -0,0 +1,217 @@
+# Versioned schema migrations
+# db.create_all() only creates missing tables - it never adds indexes or columns to tables that already exist.
+# Each migration below upgrades an existing database one step and records its version in schema_version.
+# Migrations must be safe to run on a brand new database too (create_all() already built the latest schema).
+
+# Standard library imports
+from datetime import datetime
+
+# Third-party imports
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, DateTime, Integer, String, Table, func, inspect, select, text
+
+# Local app imports
+from app import db
+from app import geo, search, stats, tagging
+from app.models import Tag, restaurant_tags
+
+
+# Table that records which migrations have run
+schema_version = Table(
+    "schema_version",
+    db.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Registered migrations: list of (version, description, function)
+MIGRATIONS = []
+
+
+# Decorator to register a migration function
+def migration(version, description):
+    """Register fn(connection) as schema version `version`."""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return fn
+    return register
+
+
+# HELPERS FOR MIGRATIONS
+def create_indexes(connection, *names):
+    """Create the indexes declared on the models (by name) if they don't exist yet."""
+    indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        indexes[name].create(connection, checkfirst=True)
+
+
+def has_column(connection, table, column):
+    """Check if an existing table already has a column."""
+    return column in {col["name"] for col in inspect(connection).get_columns(table)}
+
+
+# MIGRATIONS
+@migration(1, "Index foreign keys, search facets and meal dates")
+def index_foreign_keys(connection):
+    create_indexes(
+        connection,
+        "ix_users_person_id",
+        "ix_restaurants_cuisine_rating",
+        "ix_restaurants_rating",
+        "ix_meals_restaurant_date",
+        "ix_meals_person_date",
+        "ix_meals_date",
+    )
+    # Give the SQLite query planner statistics about the new indexes
+    if connection.dialect.name == "sqlite":
+        connection.execute(text("ANALYZE"))
+
+
+@migration(2, "Create the restaurant full-text search index")
+def create_search_index(connection):
+    if search.create_search_index(connection):
+        search.rebuild_search_index(connection)
+
+
+@migration(3, "Fill the restaurant and person statistics tables")
+def fill_statistics(connection):
+    stats.rebuild_stats(connection)
+
+
+@migration(4, "Add restaurants.version for page caching")
+def add_restaurant_version(connection):
+    if not has_column(connection, "restaurants", "version"):
+        connection.execute(text("ALTER TABLE restaurants ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+
+@migration(5, "Tag vocabulary and restaurant_tags association, deduplicated")
+def normalize_tags(connection):
+    if has_column(connection, "tags", "restaurant_id"):
+        # Old layout: one tags row per restaurant per name. Keep each (restaurant, normalized name) once,
+        # dropping blank names and tags of restaurants that no longer exist
+        pairs = set()
+        for restaurant_id, name in connection.execute(text(
+            "SELECT tags.restaurant_id, tags.name FROM tags JOIN restaurants ON restaurants.id = tags.restaurant_id"
+        )):
+            name = tagging.normalize_tag(name)
+            if name:
+                pairs.add((restaurant_id, name))
+
+        # Replace the old table (create_all() made an empty restaurant_tags pointing at it)
+        restaurant_tags.drop(connection, checkfirst=True)
+        connection.execute(text("DROP TABLE tags"))
+        Tag.__table__.create(connection)
+        restaurant_tags.create(connection)
+
+        ids = tagging.tag_ids(connection, sorted({name for _, name in pairs}))
+        links = [{"restaurant_id": restaurant_id, "tag_id": ids[name]} for restaurant_id, name in sorted(pairs)]
+        for start in range(0, len(links), 10000):
+            connection.execute(restaurant_tags.insert(), links[start:start + 10000])
+        # Search documents list the normalized names now
+        search.rebuild_search_index(connection)
+
+    tagging.rebuild_tag_counts(connection)
+    if connection.dialect.name == "sqlite":
+        connection.execute(text("ANALYZE"))
+
+
+@migration(6, "Index people by name")
+def index_people_names(connection):
+    create_indexes(connection, "ix_people_name")
+
+
+@migration(7, "Restaurant coordinates and the location index")
+def add_restaurant_locations(connection):
+    for name in ("latitude", "longitude"):
+        if not has_column(connection, "restaurants", name):
+            connection.execute(text(f"ALTER TABLE restaurants ADD COLUMN {name} FLOAT"))
+    create_indexes(connection, "ix_restaurants_location")
+    # Existing restaurants get coordinates from `flask geocode-restaurants`
+    if geo.create_location_index(connection):
+        geo.rebuild_location_index(connection)
+
+
+@migration(8, "Fill the visit day statistics for analytics")
+def fill_visit_days(connection):
+    stats.rebuild_visit_days(connection)
+
+
+@migration(9, "At most one active job per key")
+def unique_active_job_keys(connection):
+    # Duplicates queued before the index existed: keep the oldest active job of each key
+    connection.execute(text(
+        "UPDATE jobs SET status = 'failed', error = 'Duplicate of an earlier job with the same key.' "
+        "WHERE key IS NOT NULL AND status IN ('queued', 'running') AND id > "
+        "(SELECT MIN(other.id) FROM jobs AS other WHERE other.key = jobs.key "
+        "AND other.status IN ('queued', 'running'))"
+    ))
+    create_indexes(connection, "ux_jobs_active_key")
+
+
+# RUN MIGRATIONS
+def current_version(connection):
+    """Highest migration version applied to the database (0 for none)."""
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(target=None):
+    """
+    Apply every pending migration in order.
+    - Each migration runs in its own transaction together with its schema_version row.
+    - Returns the list of versions that were applied.
+    """
+    schema_version.create(db.engine, checkfirst=True)
+    applied = []
+
+    for version, description, fn in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with db.engine.begin() as connection:
+            if version <= current_version(connection):
+                continue
+            fn(connection)
+            connection.execute(schema_version.insert().values(
+                version=version, description=description, applied_at=datetime.now()
+            ))
+        applied.append(version)
+
+    return applied
+
+
+# Build or upgrade the schema - run explicitly (flask db-upgrade, run.py, tests), never on import
+def init_db():
+    """Create missing tables, then apply pending migrations. Returns the versions applied."""
+    db.create_all()
+    return upgrade()
+
+
+# Command line: flask --app run db-upgrade
+@click.command("db-upgrade")
+@with_appcontext
+@click.option("--target", type=int, default=None, help="Stop after this schema version.")
+def upgrade_command(target):
+    """Create missing tables and apply pending schema migrations."""
+    db.create_all()
+    applied = upgrade(target)
+    for version, description, _ in MIGRATIONS:
+        if version in applied:
+            click.echo(f"Applied {version}: {description}")
+    with db.engine.connect() as connection:
+        click.echo(f"Database is at schema version {current_version(connection)}.")
+
+
+# Command line: flask --app run db-version
+@click.command("db-version")
+@with_appcontext
+def version_command():
+    """Show the current schema version and any pending migrations."""
+    schema_version.create(db.engine, checkfirst=True)
+    with db.engine.connect() as connection:
+        version = current_version(connection)
+    click.echo(f"Database is at schema version {version}.")
+    for number, description, _ in MIGRATIONS:
+        if number > version:
+            click.echo(f"Pending {number}: {description}")
@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Float, Index, JSON, text
 from sqlalchemy.orm import relationship
 from flask_login import UserMixin
 
@@ -15,6 +15,10 @@ class People(db.Model):
     # Establish one to one relationship with User table and one to many with Meal table
     user = relationship('User', back_populates='person', uselist=False)
     meals = relationship('Meal', back_populates='person')
+    # Index for finding people by name (adding meals for a visit)
+    __table_args__ = (
+        Index('ix_people_name', 'name', 'id'),
+    )
 
 # User Table
 class User(db.Model, UserMixin):  # UserMixin allows Flask-Login methods to manage sessions
@@ -22,7 +26,7 @@ class User(db.Model, UserMixin):  # UserMixin allows Flask-Login methods to mana
     id = Column(Integer, primary_key=True)
     username = Column(String, unique=True, nullable=False)
     password = Column(String, nullable=False)
-    person_id = Column(Integer, ForeignKey('people.id'), nullable=False)
+    person_id = Column(Integer, ForeignKey('people.id'), nullable=False, index=True)
     # Establish relationship with People
     person = relationship('People', back_populates='user')
 
@@ -35,9 +39,25 @@ class Restaurant(db.Model):
     phone_number = Column(String(15))
     cuisine = Column(String)
     rating = Column(Integer)
-    # Establish many to one relationship with Meal and Tag
-    meals = relationship('Meal', back_populates='restaurant')
-    tags = relationship('Tag', back_populates='restaurant')
+    # Degrees (WGS84), filled in from the address by the offline geocoder (app/geo.py), None if not found
+    latitude = Column(Float)
+    longitude = Column(Float)
+    # Incremented whenever the restaurant, its meals or its tags change (used for page caching and ETags)
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    # Establish one to many relationship with Meal (deleted along with the restaurant)
+    meals = relationship('Meal', back_populates='restaurant', cascade='all, delete-orphan')
+    # Many to many with Tag through restaurant_tags (the links are deleted along with the restaurant)
+    tags = relationship('Tag', secondary='restaurant_tags', back_populates='restaurants', order_by='Tag.name')
+    # Precomputed meal totals (maintained by app/stats.py, read only here)
+    stats = relationship('RestaurantStats', uselist=False, viewonly=True,
+                         primaryjoin='Restaurant.id == foreign(RestaurantStats.restaurant_id)')
+    # Indexes for the search facets (cuisine + rating), sorting by rating, and "near me" lookups on databases
+    # without the SQLite R*Tree (app/geo.py)
+    __table_args__ = (
+        Index('ix_restaurants_cuisine_rating', 'cuisine', 'rating'),
+        Index('ix_restaurants_rating', 'rating', 'id'),
+        Index('ix_restaurants_location', 'latitude', 'longitude'),
+    )
 
 # Meal Table
 class Meal(db.Model):
@@ -53,14 +73,150 @@ class Meal(db.Model):
     # Establish relationship with Restaurant and People
     restaurant = relationship('Restaurant', back_populates='meals')
     person = relationship('People', back_populates='meals')
+    # Indexes for a restaurant's meals newest first, a person's meal history, and date ranges
+    __table_args__ = (
+        Index('ix_meals_restaurant_date', 'restaurant_id', text('date DESC')),
+        Index('ix_meals_person_date', 'person_id', 'date'),
+        Index('ix_meals_date', 'date'),
+    )
+
+    # Photos are files on disk (app/media.py), a meal only has small reference rows (not loaded with the meal)
+    photos = relationship('MealPhoto', back_populates='meal', cascade='all, delete-orphan', order_by='MealPhoto.id')
 
-    # TODO: ADD PHOTO/IMAGE ATTACHMENT - HOW DOES THAT SAVE IN A DB? 
+# Media Files Table - one row per distinct uploaded file, the file itself is stored on disk under its SHA-256
+# (app/media.py), so the same photo uploaded twice is stored once
+class MediaFile(db.Model):
+    __tablename__ = 'media_files'
+    sha256 = Column(String(64), primary_key=True)
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    # Filled in by the thumbnail job (None without Pillow)
+    width = Column(Integer)
+    height = Column(Integer)
+    # Thumbnail sizes generated so far (list of ints)
+    thumbnails = Column(JSON)
+    created_at = Column(DateTime, nullable=False)
 
-# Tags Table
+# Meal Photos Table - which meals have which photos
+class MealPhoto(db.Model):
+    __tablename__ = 'meal_photos'
+    id = Column(Integer, primary_key=True)
+    meal_id = Column(Integer, ForeignKey('meals.id'), nullable=False)
+    sha256 = Column(String(64), ForeignKey('media_files.sha256'), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    # Establish relationship with Meal and MediaFile
+    meal = relationship('Meal', back_populates='photos')
+    media = relationship('MediaFile')
+    # Indexes for a meal's photos and for finding files no meal uses any more
+    __table_args__ = (
+        Index('ix_meal_photos_meal', 'meal_id', 'id'),
+        Index('ix_meal_photos_sha256', 'sha256'),
+    )
+
+# Tags Table - the tag vocabulary, one row per tag name (names are stored normalized, see app/tagging.py)
 class Tag(db.Model):
     __tablename__ = 'tags'
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
-    restaurant_id = Column(Integer, ForeignKey('restaurants.id'), nullable=False)
-    # Establish relationship with Restaurant
-    restaurant = relationship('Restaurant', back_populates='tags')
\ No newline at end of file
+    name = Column(String, unique=True, nullable=False)
+    # Number of restaurants with the tag (maintained by app/tagging.py, for tag clouds and facet counts)
+    restaurant_count = Column(Integer, nullable=False, default=0, server_default='0')
+    # Establish many to many relationship with Restaurant
+    restaurants = relationship('Restaurant', secondary='restaurant_tags', back_populates='tags')
+    # Index for listing the most used tags first
+    __table_args__ = (
+        Index('ix_tags_restaurant_count', 'restaurant_count', 'id'),
+    )
+
+# Restaurant Tags Table - which restaurants have which tags
+# The primary key (restaurant_id, tag_id) finds a restaurant's tags, the index finds a tag's restaurants
+restaurant_tags = db.Table(
+    'restaurant_tags',
+    Column('restaurant_id', Integer, ForeignKey('restaurants.id'), primary_key=True),
+    Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
+    Index('ix_restaurant_tags_tag', 'tag_id', 'restaurant_id'),
+)
+
+# Statistics tables - rollups of the meals table kept up to date on every meal insert, update and delete (app/stats.py)
+
+# Restaurant Stats Table (one row per restaurant)
+class RestaurantStats(db.Model):
+    __tablename__ = 'restaurant_stats'
+    restaurant_id = Column(Integer, primary_key=True)
+    meal_count = Column(Integer, nullable=False, default=0)
+    # Sum and count of meals with a price, average price = price_total / price_count
+    price_total = Column(Float, nullable=False, default=0.0)
+    price_count = Column(Integer, nullable=False, default=0)
+    last_visit = Column(Date)
+    # Index for sorting restaurants by last visit
+    __table_args__ = (
+        Index('ix_restaurant_stats_last_visit', 'last_visit', 'restaurant_id'),
+    )
+
+    @property
+    def average_price(self):
+        return self.price_total / self.price_count if self.price_count else None
+
+# Person Month Stats Table (one row per person per month, month is 'YYYY-MM')
+class PersonMonthStats(db.Model):
+    __tablename__ = 'person_month_stats'
+    person_id = Column(Integer, primary_key=True)
+    month = Column(String(7), primary_key=True)
+    meal_count = Column(Integer, nullable=False, default=0)
+    # A visit is one day at one restaurant, however many meals were logged
+    visit_count = Column(Integer, nullable=False, default=0)
+    price_total = Column(Float, nullable=False, default=0.0)
+
+
+# Visit Day Stats Table (one row per person per restaurant per day with meals, i.e. per visit) for the analytics
+# (app/analytics.py). Maintained by app/stats.py like the tables above
+class VisitDayStats(db.Model):
+    __tablename__ = 'visit_day_stats'
+    person_id = Column(Integer, primary_key=True)
+    date = Column(Date, primary_key=True)
+    restaurant_id = Column(Integer, primary_key=True)
+    meal_count = Column(Integer, nullable=False, default=0)
+    # Meals with a price: how many, their total, the cheapest and the dearest
+    price_count = Column(Integer, nullable=False, default=0)
+    price_total = Column(Float, nullable=False, default=0.0)
+    price_min = Column(Float)
+    price_max = Column(Float)
+
+
+# Data Versions Table - counters incremented on every write to a group of tables (used for page caching and ETags)
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+
+# Jobs Table - background work queue (app/jobs.py): cascading deletes, imports, index and statistics rebuilds
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    # queued -> running -> done, or back to queued for a retry, or failed after the last attempt
+    status = Column(String, nullable=False, default='queued')
+    # Enqueueing a job with the same key while one is queued or running returns that one instead
+    key = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    # Handler's return value when done, progress while running (both JSON), last error message
+    result = Column(JSON)
+    progress = Column(JSON)
+    error = Column(String)
+    created_at = Column(DateTime, nullable=False)
+    # Queued: not picked up before this time (retry back-off). Running: taken over by another worker after this
+    # time (the worker died), pushed back each time the job reports progress
+    run_after = Column(DateTime, nullable=False)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    # Indexes for claiming the next job and finding an active job by key. At most one queued or running job per
+    # key: two requests enqueueing the same key at once can't both insert one
+    __table_args__ = (
+        Index('ix_jobs_status_run_after', 'status', 'run_after'),
+        Index('ix_jobs_key_status', 'key', 'status'),
+        Index('ux_jobs_active_key', 'key', unique=True,
+              sqlite_where=text("status IN ('queued', 'running')"),
+              postgresql_where=text("status IN ('queued', 'running')")),
+    )
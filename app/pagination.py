@@ -0,0 +1,87 @@
+# Keyset (cursor) pagination helpers shared by the listing and search queries
+
+# Standard library imports
+import base64
+import json
+from datetime import date
+
+# Third-party imports
+from sqlalchemy import and_, or_
+
+
+# Turn the sort key values of the last row on a page into an opaque URL-safe token
+def encode_cursor(*values):
+    """Encode the sort key values of the last row on a page."""
+    raw = json.dumps(list(values), separators=(",", ":"), default=str)
+    # Strip base64 padding so the token stays short in the URL
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+# Turn a token from the URL back into the list of sort key values
+def decode_cursor(token):
+    """
+    Decode a cursor created by encode_cursor().
+    - Raises ValueError if the token was tampered with or is malformed.
+    """
+    try:
+        # Add back the padding that was stripped in encode_cursor()
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as error:
+        raise ValueError("Invalid cursor") from error
+
+    # Only scalars (a list or object would reach the database as a bound value and fail there)
+    if not isinstance(values, list) or not all(_is_key(value) for value in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _is_key(value):
+    """
+    Check a value is a sort key the database can compare: str, int, float, date or None (not bool).
+    Cursors decode to JSON scalars only, dates are the keys callers parse from them (e.g. a last visit).
+    """
+    return value is None or (isinstance(value, (str, int, float, date)) and not isinstance(value, bool))
+
+
+def cursor_id(value):
+    """Row id from a decoded cursor, ValueError unless it is an int."""
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError("Invalid cursor")
+    return value
+
+
+# Keep requested page sizes between 1 and the configured maximum
+def clamp_page_size(requested, default, maximum):
+    """Return a safe page size for a user supplied value."""
+    try:
+        size = int(requested) if requested else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+# WHERE clause that continues after the last row of the previous page
+def after_row(sort_key, id_column, last_key, last_id, descending=False):
+    """
+    Rows that come after (last_key, last_id) when ordered by keyset_order().
+    - Descending sorts put NULL keys last, so a restaurant never visited comes after every visited one.
+    - Raises ValueError if the values (from a cursor) aren't a sort key and an int id.
+    """
+    if not _is_key(last_key):
+        raise ValueError("Invalid cursor")
+    last_id = cursor_id(last_id)
+    if not descending:
+        return or_(sort_key > last_key, and_(sort_key == last_key, id_column > last_id))
+    if last_key is None:
+        # Already in the NULL rows at the end
+        return and_(sort_key.is_(None), id_column < last_id)
+    return or_(sort_key < last_key, and_(sort_key == last_key, id_column < last_id), sort_key.is_(None))
+
+
+# ORDER BY that matches after_row()
+def keyset_order(sort_key, id_column, descending=False):
+    """Order by the sort key and then by id so every row has a unique position."""
+    if descending:
+        return sort_key.desc().nulls_last(), id_column.desc()
+    return sort_key, id_column
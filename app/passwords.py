@@ -0,0 +1,103 @@
+# Password hashing service
+# KDF calls (scrypt/pbkdf2) are CPU bound and slow on purpose. Running them inline lets a burst of logins take over
+# every request worker, so they run in a bounded process pool instead:
+# - at most PASSWORD_HASH_WORKERS hashes run at once and PASSWORD_HASH_QUEUE_LIMIT more may wait
+# - when the queue is full the request gets 503 Service Unavailable straight away (back-pressure)
+# Stored hashes made with older settings are rehashed with the configured method on the next successful login.
+
+# Standard library imports
+import threading
+from concurrent.futures import TimeoutError
+
+# Third-party imports
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Raised when the pool is saturated or a hash takes too long
+class HashingBusy(Exception):
+    pass
+
+
+_lock = threading.Lock()
+_executor = None
+_slots = None
+
+
+def _pool():
+    """Create the process pool the first time a password is hashed (not at import)."""
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            workers = current_app.config["PASSWORD_HASH_WORKERS"]
+            # Running + waiting hashes; acquiring a slot never blocks, a full pool means 503
+            _slots = threading.BoundedSemaphore(workers + current_app.config["PASSWORD_HASH_QUEUE_LIMIT"])
+            # Never fork the web process: a child forked while another thread holds a lock (logging, the DB pool)
+            # can deadlock. forkserver forks the children from a clean single-threaded server, spawn (Windows)
+            # starts fresh interpreters; both import the main module once per child, which is guarded by
+            # `if __name__ == '__main__'` in run.py
+            # (imported here: multiprocessing is only loaded by workers that hash a password)
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        return _executor, _slots
+
+
+def _run(fn, *args):
+    """Run fn in the pool and wait for the result, or raise HashingBusy."""
+    # 0 workers runs inline (development and tests)
+    if not current_app.config["PASSWORD_HASH_WORKERS"]:
+        return fn(*args)
+
+    executor, slots = _pool()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy("Password hashing queue is full")
+    try:
+        future = executor.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    # Free the slot when the hash finishes, even if this request stopped waiting for it
+    future.add_done_callback(lambda _: slots.release())
+
+    try:
+        return future.result(timeout=current_app.config["PASSWORD_HASH_TIMEOUT"])
+    except TimeoutError as error:
+        raise HashingBusy("Password hashing timed out") from error
+
+
+# HASHING
+def hash_password(password):
+    """Hash a password with the configured method and salt length."""
+    return _run(generate_password_hash, password, current_app.config["PASSWORD_HASH_METHOD"],
+                current_app.config["PASSWORD_SALT_LENGTH"])
+
+
+def verify_password(stored_hash, password):
+    """Check a password against a stored hash."""
+    return _run(check_password_hash, stored_hash, password)
+
+
+def needs_rehash(stored_hash):
+    """True if a stored hash was made with a different method or cost than the configured one."""
+    # Werkzeug hashes look like "scrypt:32768:8:1$salt$hash" - the part before the first $ is the method and cost
+    return stored_hash.split("$", 1)[0] != current_app.config["PASSWORD_HASH_METHOD"]
+
+
+def shutdown():
+    """Stop the pool (used by benchmarks and at exit)."""
+    global _executor, _slots
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        _executor = _slots = None
+
+
+# Saturated pool -> 503 with a hint to retry shortly
+def hashing_busy(error):
+    return "Too many logins right now, please try again in a moment.", 503, {"Retry-After": "1"}
+
+
+def init_app(app):
+    app.register_error_handler(HashingBusy, hashing_busy)
@@ -0,0 +1,138 @@
+# Query layer for the pages - each function loads everything a page needs in a fixed number of SQL statements
+
+# Standard library imports
+from datetime import date
+
+# Third-party imports
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import contains_eager, joinedload
+
+# Local app imports
+from app import db
+from app.models import Restaurant, Meal, MealPhoto, Tag, restaurant_tags
+from app.pagination import encode_cursor, decode_cursor, cursor_id
+from app.search import search_restaurants
+
+
+# Values shown on the restaurant page
+class RestaurantDetail:
+    def __init__(self, restaurant, meals, next_cursor, meal_count, average_price, last_visit):
+        self.restaurant = restaurant
+        self.tags = restaurant.tags
+        self.meals = meals
+        self.next_cursor = next_cursor
+        self.meal_count = meal_count
+        self.average_price = average_price
+        self.last_visit = last_visit
+
+
+# RESTAURANT LISTINGS
+# Restaurants tagged with this name are the user's favorites
+FAVORITES_TAG = "favorites"
+# Orders a listing can be sorted in, each walks an index (no OFFSET, see search_statement())
+LISTING_SORTS = ("last_visit", "name", "rating")
+
+
+def list_restaurants(sort=None, cursor=None, limit=20, tags=None, tag_mode="all", cuisine=None, min_rating=None):
+    """
+    One page of restaurants for the home page, favorites and the API, with their statistics.
+    - sort: "last_visit" (default), "name" or "rating"
+    - tags: only restaurants with all (tag_mode "all") or any ("any") of these tags
+    - cursor: token from the previous page (keyset pagination)
+    Returns (list of Restaurant, next page cursor or None), raises ValueError on a bad cursor.
+    """
+    if sort not in LISTING_SORTS:
+        sort = "last_visit"
+    return search_restaurants(cuisine=cuisine, min_rating=min_rating, tags=tags, cursor=cursor, limit=limit,
+                              sort=sort, tag_mode=tag_mode)
+
+
+# RESTAURANT PAGE
+def load_restaurant_detail(restaurant_id, cursor=None, limit=20):
+    """
+    Load a restaurant with its tags, one page of meals and its aggregates.
+    - 2 SQL statements no matter how many meals or tags the restaurant has:
+      1. restaurant + tags + precomputed meal count, average price and last visit (joined)
+      2. one page of meals + the person who ate each (joined), newest first
+    - cursor: token from the previous page of meals (keyset pagination)
+    Returns None if the restaurant doesn't exist.
+    """
+    restaurant = db.session.execute(restaurant_detail_statement(restaurant_id)).unique().scalar_one_or_none()
+    if restaurant is None:
+        return None
+
+    meals, next_cursor = load_meal_page(restaurant_id, cursor, limit)
+
+    # Totals come from the precomputed statistics row loaded with the restaurant
+    stats = restaurant.stats
+    if stats is None:
+        return RestaurantDetail(restaurant, meals, next_cursor, 0, None, None)
+    return RestaurantDetail(restaurant, meals, next_cursor, stats.meal_count, stats.average_price, stats.last_visit)
+
+
+def restaurant_detail_statement(restaurant_id):
+    """Restaurant + tags + statistics in one SELECT."""
+    # Tags through two flat outer joins (each an index lookup) - joinedload() nests the association join,
+    # which SQLite evaluates over every restaurant's tags
+    return (select(Restaurant)
+            .outerjoin(restaurant_tags, restaurant_tags.c.restaurant_id == Restaurant.id)
+            .outerjoin(Tag, Tag.id == restaurant_tags.c.tag_id)
+            .options(contains_eager(Restaurant.tags), joinedload(Restaurant.stats))
+            .where(Restaurant.id == restaurant_id)
+            .order_by(Tag.name))
+
+
+def load_meal_page(restaurant_id, cursor=None, limit=20):
+    """
+    One page of a restaurant's meals, newest first, with the person loaded in the same query.
+    Returns (list of Meal, next page cursor or None).
+    """
+    stmt = (select(Meal)
+            .options(joinedload(Meal.person))
+            .where(Meal.restaurant_id == restaurant_id))
+
+    # Continue after the last meal of the previous page (uses the restaurant_id, date DESC index)
+    if cursor:
+        try:
+            last_date, last_id = decode_cursor(cursor)
+            last_date, last_id = date.fromisoformat(last_date), cursor_id(last_id)
+        except (TypeError, ValueError) as error:
+            raise ValueError("Invalid cursor") from error
+        stmt = stmt.where(or_(Meal.date < last_date, and_(Meal.date == last_date, Meal.id < last_id)))
+
+    # Fetch one extra row to know if there is another page
+    meals = db.session.execute(
+        stmt.order_by(Meal.date.desc(), Meal.id.desc()).limit(limit + 1)
+    ).scalars().all()
+
+    next_cursor = None
+    if len(meals) > limit:
+        meals = meals[:limit]
+        next_cursor = encode_cursor(meals[-1].date.isoformat(), meals[-1].id)
+    return meals, next_cursor
+
+
+# RESTAURANTS BY ID
+def load_restaurants(restaurant_ids):
+    """Restaurants with their statistics in 1 SQL statement, in the order of the ids (missing ids are skipped)."""
+    if not restaurant_ids:
+        return []
+    found = {restaurant.id: restaurant for restaurant in db.session.scalars(
+        select(Restaurant).options(joinedload(Restaurant.stats)).where(Restaurant.id.in_(restaurant_ids))
+    )}
+    return [found[restaurant_id] for restaurant_id in restaurant_ids if restaurant_id in found]
+
+
+# MEAL PAGE
+def load_meal(meal_id):
+    """Load a meal with its restaurant, the person who ate it and its photos in 1 SQL statement (None if missing)."""
+    return db.session.execute(meal_detail_statement(meal_id)).unique().scalar_one_or_none()
+
+
+def meal_detail_statement(meal_id):
+    """Meal + restaurant + person + photos in one SELECT."""
+    return (select(Meal)
+            .outerjoin(MealPhoto, MealPhoto.meal_id == Meal.id)
+            .options(joinedload(Meal.restaurant), joinedload(Meal.person), contains_eager(Meal.photos))
+            .where(Meal.id == meal_id)
+            .order_by(MealPhoto.id))
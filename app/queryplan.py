@@ -0,0 +1,275 @@
+# Query plan checks for the SQL the routes issue
+# Every query a route runs is registered below with sample values, and `flask explain-queries`
+# prints its plan and flags full table scans (missing indexes).
+# ADD NEW ROUTE QUERIES HERE WHEN A ROUTE STARTS ISSUING A NEW KIND OF QUERY
+
+# Standard library imports
+import sys
+from datetime import date, datetime
+
+# Third-party imports
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, or_, select, text, tuple_
+from sqlalchemy.orm import joinedload
+
+# Local app imports
+from app import db
+from app import analytics, geo, queries, search, stats
+from app.cache import person_version_name
+from app.models import People, User, Restaurant, Meal, Tag, Job, MealPhoto, VisitDayStats, DataVersion, restaurant_tags
+
+
+# Registered queries: list of (name, function(connection) -> statement)
+ROUTE_QUERIES = []
+
+
+# Decorator to register a query builder
+def route_query(name):
+    """Register fn(connection) that returns a statement a route issues."""
+    def register(fn):
+        ROUTE_QUERIES.append((name, fn))
+        return fn
+    return register
+
+
+# REGISTER / LOGIN / USER LOADER
+@route_query("register, login: user by username")
+def user_by_username(connection):
+    return select(User).where(User.username == "sample")
+
+
+@route_query("load_user: user and person name by id (identity cache miss)")
+def user_by_id(connection):
+    return (select(User.id, User.username, User.person_id, People.name)
+            .join(People, People.id == User.person_id).where(User.id == 1))
+
+
+# RESTAURANTS
+@route_query("restaurant: restaurant by id")
+def restaurant_by_id(connection):
+    return select(Restaurant).where(Restaurant.id == 1)
+
+
+@route_query("restaurant: restaurant with tags and statistics")
+def restaurant_with_tags(connection):
+    return queries.restaurant_detail_statement(1)
+
+
+@route_query("restaurant: meal page with people")
+def restaurant_meal_page(connection):
+    return (select(Meal).options(joinedload(Meal.person)).where(Meal.restaurant_id == 1)
+            .order_by(Meal.date.desc(), Meal.id.desc()).limit(21))
+
+
+@route_query("add_rest: restaurant by name")
+def restaurant_by_name(connection):
+    return select(Restaurant).where(Restaurant.name == "sample")
+
+
+# SEARCH
+@route_query("search: text query")
+def search_text(connection):
+    return search.search_statement(connection, query="pizza")
+
+
+@route_query("search: text query with facets")
+def search_text_facets(connection):
+    return search.search_statement(connection, query="pizza", cuisine="Italian", min_rating=3, tags=["favorites"])
+
+
+@route_query("index, search: browse by last visit, next page")
+def search_browse(connection):
+    return search.search_statement(connection, after=["2024-01-01", 1])
+
+
+@route_query("search: browse by name, next page")
+def search_browse_name(connection):
+    return search.search_statement(connection, after=["sample", 1], sort="name")
+
+
+@route_query("index, api: browse by rating, next page")
+def search_browse_rating(connection):
+    return search.search_statement(connection, after=[3, 1], sort="rating")
+
+
+@route_query("favorites, api: restaurants with a tag, next page")
+def search_browse_tag(connection):
+    return search.search_statement(connection, tags=["favorites"], after=["2024-01-01", 1])
+
+
+@route_query("search, api: restaurants with all of two tags, by name")
+def search_all_tags(connection):
+    return search.search_statement(connection, tags=["favorites", "cheap"], sort="name")
+
+
+@route_query("search, api: restaurants with any of two tags, by rating")
+def search_any_tag(connection):
+    return search.search_statement(connection, tags=["favorites", "cheap"], tag_mode="any", sort="rating")
+
+
+@route_query("search, api: tag cloud, next page")
+def tag_cloud(connection):
+    return (select(Tag).where(Tag.restaurant_count > 0, Tag.restaurant_count < 10)
+            .order_by(Tag.restaurant_count.desc(), Tag.id.desc()).limit(31))
+
+
+@route_query("search: browse by cuisine and rating")
+def search_browse_facets(connection):
+    return search.search_statement(connection, cuisine="Italian", min_rating=3)
+
+
+# SEARCH INDEX SYNC (runs after every flush)
+@route_query("search sync: tags of restaurants")
+def search_sync_tags(connection):
+    return (select(restaurant_tags.c.restaurant_id, Tag.name).join(Tag, Tag.id == restaurant_tags.c.tag_id)
+            .where(restaurant_tags.c.restaurant_id.in_([1, 2, 3])))
+
+
+@route_query("search sync: meal notes of restaurants")
+def search_sync_notes(connection):
+    return select(Meal.restaurant_id, Meal.notes).where(Meal.restaurant_id.in_([1, 2, 3]), Meal.notes.isnot(None))
+
+
+# STATISTICS (runs after every flush that changes meals)
+@route_query("stats sync: last visit of a restaurant")
+def stats_last_visit(connection):
+    return select(func.max(Meal.date)).where(Meal.restaurant_id == 1)
+
+
+@route_query("stats sync, import: meals and prices per visit")
+def stats_visit_meals(connection):
+    columns = (Meal.person_id, Meal.restaurant_id, Meal.date)
+    return (select(*columns, func.count(), func.count(Meal.price), func.sum(Meal.price), func.min(Meal.price),
+                   func.max(Meal.price))
+            .where(*stats.visits_in(*columns, [(1, 1, date(2024, 1, 1)), (2, 1, date(2024, 1, 2))]))
+            .group_by(*columns))
+
+
+@route_query("stats sync, import: replace visit days")
+def stats_replace_visit_days(connection):
+    table = VisitDayStats.__table__
+    return table.delete().where(*stats.visits_in(table.c.person_id, table.c.restaurant_id, table.c.date,
+                                                 [(1, 1, date(2024, 1, 1)), (2, 1, date(2024, 1, 2))]))
+
+
+# ANALYTICS
+@route_query("user, api analytics: version of a person's meals")
+def analytics_person_version(connection):
+    return select(DataVersion.version).where(DataVersion.name == person_version_name(1))
+
+
+@route_query("user, api analytics: visit days of a person")
+def analytics_timeline(connection):
+    return analytics.timeline_statement(1)
+
+
+@route_query("user, api analytics: cuisines of the visited restaurants")
+def analytics_cuisines(connection):
+    return select(Restaurant.id, Restaurant.cuisine).where(Restaurant.id.in_([1, 2, 3]))
+
+
+# MEALS
+@route_query("meal: meal with restaurant, person and photos")
+def meal_detail(connection):
+    return queries.meal_detail_statement(1)
+
+
+@route_query("add_meal, api: people by id or name")
+def people_by_id_or_name(connection):
+    return (select(People.id, People.name)
+            .where(or_(People.id.in_([1, 2]), People.name.in_(["Sample", "Other"]))).order_by(People.id))
+
+
+@route_query("add_meal, api: meals already logged for a visit")
+def logged_visit_meals(connection):
+    return (select(Meal.person_id, Meal.name)
+            .where(Meal.restaurant_id == 1, Meal.date == date(2024, 1, 1),
+                   tuple_(Meal.person_id, Meal.name).in_([(1, "Pizza"), (2, "Salad")])))
+
+
+# MEAL PHOTOS
+@route_query("api: photos of a meal")
+def meal_photos(connection):
+    return select(MealPhoto).where(MealPhoto.meal_id == 1).order_by(MealPhoto.id)
+
+
+# NEAR ME
+@route_query("api nearby: restaurants in a box")
+def nearby_box(connection):
+    return geo.location_statement(connection, *geo.bounding_box(40.72, -74.0, 2))
+
+
+@route_query("api nearby: restaurants in a box with cuisine and rating")
+def nearby_box_facets(connection):
+    return geo.location_statement(connection, *geo.bounding_box(40.72, -74.0, 2), cuisine="Thai", min_rating=4)
+
+
+# BACKGROUND JOBS
+@route_query("jobs: next ready job")
+def next_job(connection):
+    return (select(Job.id).where(Job.status.in_(("queued", "running")), Job.run_after <= datetime(2024, 1, 1))
+            .order_by(Job.run_after, Job.id).limit(1))
+
+
+@route_query("enqueue: active job with a key")
+def active_job_by_key(connection):
+    return select(Job).where(Job.key == "rebuild_search", Job.status.in_(("queued", "running"))).limit(1)
+
+
+@route_query("delete job: batch of a restaurant's meals")
+def restaurant_meal_batch(connection):
+    return select(Meal.id, Meal.person_id, Meal.date, Meal.price).where(Meal.restaurant_id == 1).limit(1000)
+
+
+# EXPLAIN
+def explain(connection, stmt):
+    """Return the plan lines for a statement on the current database."""
+    # Inline the sample values so the statement can be prefixed with EXPLAIN
+    sql = str(stmt.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+
+    if connection.dialect.name == "sqlite":
+        return [row.detail for row in connection.execute(text("EXPLAIN QUERY PLAN " + sql))]
+    return [row[0] for row in connection.execute(text("EXPLAIN " + sql))]
+
+
+def is_full_scan(line):
+    """Check if a plan line reads a whole table without an index."""
+    # SQLite: "SCAN meals" (but not "SCAN meals USING INDEX ..." or FTS "VIRTUAL TABLE" scans)
+    if line.startswith("SCAN ") and "USING" not in line and "VIRTUAL TABLE" not in line and "CONSTANT ROW" not in line:
+        return True
+    # PostgreSQL
+    return "Seq Scan" in line
+
+
+def check_route_queries(connection):
+    """
+    Explain every registered route query.
+    Returns a list of (name, plan lines, flagged lines).
+    """
+    report = []
+    for name, build in ROUTE_QUERIES:
+        plan = explain(connection, build(connection))
+        report.append((name, plan, [line for line in plan if is_full_scan(line)]))
+    return report
+
+
+# Command line: flask --app run explain-queries
+@click.command("explain-queries")
+@with_appcontext
+def explain_queries_command():
+    """Print the query plan of every route query and flag full table scans."""
+    with db.engine.connect() as connection:
+        report = check_route_queries(connection)
+
+    flagged = 0
+    for name, plan, scans in report:
+        click.echo(f"{'FULL SCAN' if scans else 'ok':<10} {name}")
+        for line in plan:
+            click.echo(f"           {'!! ' if line in scans else '   '}{line}")
+        flagged += bool(scans)
+
+    click.echo(f"{len(report)} queries checked, {flagged} with full table scans.")
+    # Non-zero exit code so CI can fail on a missing index
+    if flagged:
+        sys.exit(1)
@@ -0,0 +1,99 @@
+# Rate limiting for the login and register forms
+# Every attempt costs a password hash (app/passwords.py), so a credential stuffing burst could keep the hashing
+# pool full for everyone. Attempts are counted before any database or hashing work, with token buckets:
+# - one bucket per client IP and one per username, each allows a burst of N attempts then refills at a steady rate.
+#   The client IP is request.remote_addr: behind a reverse proxy set TRUSTED_PROXIES (config.py) so it is the
+#   client's address from X-Forwarded-For, not the proxy's
+# - buckets live in memory per worker, in an LRU dict of at most RATE_LIMIT_MAX_KEYS keys (least recently seen
+#   keys are dropped first, a dropped key starts again with a full bucket)
+# - a refused attempt gets 429 Too Many Requests with Retry-After
+
+# Standard library imports
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Third-party imports
+from flask import current_app, request
+
+
+# Raised when a client or username has no attempts left
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+# TOKEN BUCKETS
+class TokenBucketLimiter:
+    """
+    Thread-safe token buckets by key, bounded with LRU eviction.
+    - capacity: attempts allowed in a burst, rate: attempts given back per second
+    """
+
+    def __init__(self, capacity=10, rate=1.0, max_keys=10000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, time of last update)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def acquire(self, key):
+        """Take one token for key. Returns 0 if allowed, else seconds until the next token."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+                self.rejected += 1
+            # Most recently used last, drop the least recently used keys
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# Sized from the RATE_LIMIT_* settings by init_app()
+ip_limiter = TokenBucketLimiter()
+username_limiter = TokenBucketLimiter()
+
+
+def check_auth_attempt(username=None):
+    """Count a login/register attempt from this client (and for this username). Raises RateLimited."""
+    if not current_app.config["RATE_LIMIT_ENABLED"]:
+        return
+    wait = ip_limiter.acquire(request.remote_addr)
+    # A client that is already refused doesn't use up the username's attempts
+    if not wait and username:
+        wait = username_limiter.acquire(username.strip().lower())
+    if wait:
+        raise RateLimited(wait)
+
+
+# Refused attempt -> 429 with the seconds until the next one is allowed
+def rate_limited(error):
+    return ("Too many attempts, please try again later.", 429,
+            {"Retry-After": str(max(1, math.ceil(error.retry_after)))})
+
+
+def init_app(app):
+    """Size the buckets from the config."""
+    for limiter, (capacity, per_seconds) in ((ip_limiter, app.config["RATE_LIMIT_PER_IP"]),
+                                             (username_limiter, app.config["RATE_LIMIT_PER_USERNAME"])):
+        limiter.capacity = capacity
+        limiter.rate = capacity / per_seconds
+        limiter.max_keys = app.config["RATE_LIMIT_MAX_KEYS"]
+    app.register_error_handler(RateLimited, rate_limited)
@@ -0,0 +1,348 @@
+# Restaurant recommendations from the meal history
+# - A person x restaurant matrix (NumPy, float32) holds how much each person likes each restaurant: every meal adds
+#   1 for the visit plus its rating (Pass -0.75 .. Favorite +1, or 1-5 stars), so a visited restaurant is always > 0
+# - Restaurant feature vectors: cuisine (one-hot), rating (0-1) and tags (one column per tag), L2 normalized
+# - "You might like": the RECOMMEND_NEIGHBORS people most like you (cosine over the matrix rows) vote with their
+#   rows, blended with how close each restaurant's features are to the places you go (RECOMMEND_CONTENT_WEIGHT).
+#   Restaurants you've been to are left out. People without meals get the most liked restaurants
+# - "Similar restaurants": cosine over the matrix columns (who eats there and how much they like it), blended with
+#   the feature cosine
+# - Each is a few matrix-vector products over the whole matrix, no per-row Python: milliseconds at 100k meals
+# - The model lives in memory per worker, built on first use and refreshed at most every RECOMMEND_REFRESH_INTERVAL
+#   seconds, only when the listing data version changed (any write to restaurants, meals or tags):
+#   new meals (id above the last one seen) are added in place, missing meals (deleted) or edited ones (the
+#   meal-edits data version: another person, restaurant or rating) rebuild the matrix, and the restaurant features
+#   are reloaded
+# - Top-k lists are kept in a TTL cache, a person's or restaurant's lists are dropped when they get a new meal
+# Memory: people x restaurants x 4 bytes, e.g. 1000 x 2000 = 8 MB for the 100k meal benchmark dataset.
+# NumPy is optional (requirements-recommend.txt): without it available() is False and the pages / API say
+# recommendations are off.
+
+# Standard library imports
+import threading
+import time
+
+# Third-party imports
+from flask import current_app
+from sqlalchemy import func, select
+
+# NumPy is only needed for recommendations
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Local app imports
+from app import db, queries
+from app.cache import TTLCache, LISTING_VERSION, MEAL_EDITS_VERSION
+from app.models import Restaurant, Meal, DataVersion, restaurant_tags
+
+
+# Meal ratings from the forms, and 1-5 stars from imports
+RATING_WEIGHTS = {"favorite": 1.0, "good": 0.5, "try again": 0.0, "pass": -0.75}
+
+
+def available():
+    """True if NumPy is installed."""
+    return np is not None
+
+
+def meal_affinity(rating):
+    """How much one meal says a person likes the restaurant: 1 for the visit plus the rating (0.25 to 2)."""
+    if rating is None:
+        return 1.0
+    text = str(rating).strip().lower()
+    if text in RATING_WEIGHTS:
+        return 1.0 + RATING_WEIGHTS[text]
+    try:
+        stars = float(text)
+    except ValueError:
+        return 1.0
+    return 1.0 + max(-0.75, min(1.0, (stars - 3) / 2))
+
+
+def person_tag(person_id):
+    return f"person:{person_id}"
+
+
+def restaurant_tag(restaurant_id):
+    return f"restaurant:{restaurant_id}"
+
+
+# MODEL
+class RecommendationModel:
+    """Person x restaurant affinity matrix and restaurant features, refreshed from the database."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.cache = TTLCache()
+        self.built = False
+        self.checked_at = 0.0
+        self.data_version = None
+        self.meal_edits = None
+        # Meals in the matrix: every id up to last_meal_id, meal_count of them
+        self.last_meal_id = 0
+        self.meal_count = 0
+        # Row / column of each person / restaurant id, and back
+        self.people = {}
+        self.restaurants = {}
+        self.restaurant_ids = np.zeros(0, dtype=np.int64)
+        # Allocated with spare rows and columns, only [:len(people), :len(restaurants)] is used
+        self.affinity = np.zeros((0, 0), dtype=np.float32)
+        self.person_norms = np.zeros(0, dtype=np.float32)
+        self.restaurant_norms = np.zeros(0, dtype=np.float32)
+        self.features = np.zeros((0, 0), dtype=np.float32)
+        self.active = np.zeros(0, dtype=bool)
+
+    # LOADING
+    def refresh(self, force=False):
+        """Bring the model up to date if the data changed (checked at most every RECOMMEND_REFRESH_INTERVAL s)."""
+        if not force and self.built and time.monotonic() - self.checked_at < current_app.config[
+                "RECOMMEND_REFRESH_INTERVAL"]:
+            return
+        with self.lock:
+            self.checked_at = time.monotonic()
+            with db.engine.connect() as connection:
+                versions = dict(connection.execute(
+                    select(DataVersion.name, DataVersion.version)
+                    .where(DataVersion.name.in_([LISTING_VERSION, MEAL_EDITS_VERSION]))
+                ).all())
+                version, meal_edits = versions.get(LISTING_VERSION, 0), versions.get(MEAL_EDITS_VERSION, 0)
+                if self.built and version == self.data_version and not force:
+                    return
+                columns = (Meal.id, Meal.person_id, Meal.restaurant_id, Meal.rating)
+                # Edited meals can't be patched in place (their old values are gone): rebuild below
+                if self.built and meal_edits == self.meal_edits:
+                    # New meals first: a meal deleted after this query makes the count below disagree (rebuild)
+                    new_meals = connection.execute(
+                        select(*columns).where(Meal.id > self.last_meal_id).order_by(Meal.id)
+                    ).all()
+                    kept = connection.execute(select(func.count()).where(Meal.id <= self.last_meal_id)).scalar()
+                if not self.built or meal_edits != self.meal_edits or kept != self.meal_count:
+                    # First build, meals were edited, or meals were deleted
+                    self._reset()
+                    new_meals = connection.execute(select(*columns).order_by(Meal.id)).all()
+                    kept = 0
+                self._add_meals(new_meals)
+                # After the meals: every column gets a feature row (zeros for a restaurant deleted meanwhile)
+                self._load_features(connection)
+            self.meal_count = kept + len(new_meals)
+            self.data_version = version
+            self.meal_edits = meal_edits
+            self.built = True
+
+    def _reset(self):
+        self.people.clear()
+        self.restaurants.clear()
+        self.restaurant_ids = np.zeros(0, dtype=np.int64)
+        self.affinity = np.zeros((0, 0), dtype=np.float32)
+        self.person_norms = np.zeros(0, dtype=np.float32)
+        self.restaurant_norms = np.zeros(0, dtype=np.float32)
+        self.last_meal_id = 0
+        self.meal_count = 0
+        self.cache.clear()
+
+    def _index(self, ids, index):
+        """Rows / columns of ids, adding the new ones. Returns an int array."""
+        for value in ids:
+            if value not in index:
+                index[value] = len(index)
+        return np.fromiter((index[value] for value in ids), dtype=np.int64, count=len(ids))
+
+    def _grow(self):
+        """Make room for every indexed person and restaurant (x1.5 so adding one doesn't copy the matrix)."""
+        people, restaurants = len(self.people), len(self.restaurants)
+        rows, columns = self.affinity.shape
+        if people > rows or restaurants > columns:
+            shape = (max(people, int(rows * 1.5) + 16), max(restaurants, int(columns * 1.5) + 16))
+            affinity = np.zeros(shape, dtype=np.float32)
+            affinity[:rows, :columns] = self.affinity
+            self.affinity = affinity
+            self.person_norms = np.resize(self.person_norms, shape[0])
+            self.person_norms[rows:] = 0
+            self.restaurant_norms = np.resize(self.restaurant_norms, shape[1])
+            self.restaurant_norms[columns:] = 0
+        if restaurants > len(self.restaurant_ids):
+            ids = np.zeros(restaurants, dtype=np.int64)
+            for restaurant_id, column in self.restaurants.items():
+                ids[column] = restaurant_id
+            self.restaurant_ids = ids
+
+    def _add_meals(self, meals):
+        """Add meals (id, person_id, restaurant_id, rating) to the matrix and update the touched norms."""
+        if not meals:
+            return
+        ids, person_ids, restaurant_ids, ratings = zip(*meals)
+        rows = self._index(person_ids, self.people)
+        columns = self._index(restaurant_ids, self.restaurants)
+        self._grow()
+        weights = np.fromiter(map(meal_affinity, ratings), dtype=np.float32, count=len(ratings))
+        # Unbuffered add: the same (person, restaurant) can appear many times
+        np.add.at(self.affinity, (rows, columns), weights)
+
+        touched_rows, touched_columns = np.unique(rows), np.unique(columns)
+        self.person_norms[touched_rows] = np.linalg.norm(self.affinity[touched_rows], axis=1)
+        self.restaurant_norms[touched_columns] = np.linalg.norm(self.affinity[:, touched_columns], axis=0)
+        self.last_meal_id = max(self.last_meal_id, max(ids))
+
+        # Lists that depend on the changed rows and columns
+        self.cache.invalidate(*(person_tag(person_id) for person_id in set(person_ids)),
+                              *(restaurant_tag(restaurant_id) for restaurant_id in set(restaurant_ids)))
+
+    def _load_features(self, connection):
+        """Restaurant feature matrix: cuisine one-hot, rating / 5, tags (rows L2 normalized)."""
+        restaurants = connection.execute(select(Restaurant.id, Restaurant.cuisine, Restaurant.rating)).all()
+        links = connection.execute(select(restaurant_tags.c.restaurant_id, restaurant_tags.c.tag_id)).all()
+
+        columns = self._index([row.id for row in restaurants], self.restaurants)
+        self._grow()
+        cuisines = {name: number for number, name in enumerate(sorted({row.cuisine or "" for row in restaurants}))}
+        tags = {tag_id: len(cuisines) + 1 + number for number, tag_id in enumerate(sorted({tag for _, tag in links}))}
+
+        features = np.zeros((len(self.restaurants), len(cuisines) + 1 + len(tags)), dtype=np.float32)
+        features[columns, [cuisines[row.cuisine or ""] for row in restaurants]] = 1.0
+        features[columns, len(cuisines)] = [(row.rating or 0) / 5 for row in restaurants]
+        tagged = [(self.restaurants[restaurant_id], tags[tag_id]) for restaurant_id, tag_id in links
+                  if restaurant_id in self.restaurants]
+        if tagged:
+            features[tuple(np.array(tagged).T)] = 1.0
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        features /= np.where(norms > 0, norms, 1)
+
+        # Restaurants that still exist (deleted ones keep their column until the next rebuild)
+        active = np.zeros(len(self.restaurants), dtype=bool)
+        active[columns] = True
+        # Most writes are meals: only a change to the restaurants or their tags drops every cached list
+        if not (np.array_equal(features, self.features) and np.array_equal(active, self.active)):
+            self.features, self.active = features, active
+            self.cache.clear()
+
+    # SCORING
+    def _top(self, scores, limit):
+        """(restaurant id, score) of the highest finite scores, best first."""
+        candidates = np.flatnonzero(np.isfinite(scores))
+        if not len(candidates):
+            return []
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(self.restaurant_ids[column]), round(float(scores[column]), 4)) for column in candidates]
+
+    def for_person(self, person_id, limit):
+        """Restaurants a person hasn't been to, best match first: [(restaurant id, score)]."""
+        config = current_app.config
+        people, restaurants = len(self.people), len(self.restaurants)
+        if not restaurants:
+            return []
+        affinity = self.affinity[:people, :restaurants]
+        row = self.people.get(person_id)
+
+        if row is None:
+            # No meals yet: the restaurants people like most
+            scores = affinity.sum(axis=0)
+            scores = scores / scores.max() if scores.max() > 0 else scores
+        else:
+            liked = affinity[row]
+            # Cosine between this person's row and everyone's
+            norms = self.person_norms[:people] * self.person_norms[row]
+            similarity = np.divide(affinity @ liked, norms, out=np.zeros(people, dtype=np.float32),
+                                   where=norms > 0)
+            similarity[row] = 0
+            neighbors = min(config["RECOMMEND_NEIGHBORS"], people - 1)
+            if neighbors > 0:
+                nearest = np.argpartition(-similarity, neighbors - 1)[:neighbors]
+                collaborative = similarity[nearest] @ affinity[nearest]
+            else:
+                collaborative = np.zeros(restaurants, dtype=np.float32)
+            if collaborative.max() > 0:
+                collaborative /= collaborative.max()
+
+            # Features of the places this person goes, weighted by how much they like them
+            profile = liked @ self.features
+            norm = np.linalg.norm(profile)
+            content = self.features @ (profile / norm) if norm > 0 else np.zeros(restaurants, dtype=np.float32)
+
+            weight = config["RECOMMEND_CONTENT_WEIGHT"]
+            scores = (1 - weight) * collaborative + weight * content
+            scores[liked > 0] = -np.inf
+
+        scores = scores.astype(np.float32, copy=True)
+        scores[~self.active] = -np.inf
+        return self._top(scores, limit)
+
+    def similar_to(self, restaurant_id, limit):
+        """Restaurants most like one restaurant: [(restaurant id, score)], [] if it isn't known."""
+        column = self.restaurants.get(restaurant_id)
+        if column is None:
+            return []
+        people, restaurants = len(self.people), len(self.restaurants)
+        affinity = self.affinity[:people, :restaurants]
+
+        # Cosine between this restaurant's column and every column
+        eaters = affinity[:, column]
+        norms = self.restaurant_norms[:restaurants] * self.restaurant_norms[column]
+        collaborative = np.divide(eaters @ affinity, norms, out=np.zeros(restaurants, dtype=np.float32),
+                                  where=norms > 0)
+        content = self.features @ self.features[column]
+
+        weight = current_app.config["RECOMMEND_CONTENT_WEIGHT"]
+        scores = (1 - weight) * collaborative + weight * content
+        scores[column] = -np.inf
+        scores[~self.active] = -np.inf
+        return self._top(scores, limit)
+
+    def cached(self, key, tags, compute):
+        """Top-k list from the cache, or computed and kept."""
+        with self.lock:
+            result = self.cache.get(key)
+            if result is None:
+                result = compute()
+                self.cache.set(key, result, tags)
+            return result
+
+
+# Built on first use in each worker
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """The worker's model, up to date."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = RecommendationModel()
+            _model.cache.max_entries = current_app.config["RECOMMEND_CACHE_SIZE"]
+            _model.cache.ttl = current_app.config["RECOMMEND_CACHE_TTL"]
+    _model.refresh()
+    return _model
+
+
+def reset_model():
+    """Forget the worker's model (rebuilt on next use)."""
+    global _model
+    with _model_lock:
+        _model = None
+
+
+def load_restaurants(scored):
+    """Restaurants (with statistics, one query) for [(id, score)], in order: [(Restaurant, score)]."""
+    restaurants = {restaurant.id: restaurant for restaurant in queries.load_restaurants([id for id, _ in scored])}
+    return [(restaurants[restaurant_id], score) for restaurant_id, score in scored if restaurant_id in restaurants]
+
+
+# PAGES AND API
+def recommended_restaurants(person_id, limit=10):
+    """Restaurants a person might like: [(Restaurant, score)], best first."""
+    model = get_model()
+    scored = model.cached(("person", person_id, limit), [person_tag(person_id)],
+                          lambda: model.for_person(person_id, limit))
+    return load_restaurants(scored)
+
+
+def similar_restaurants(restaurant_id, limit=10):
+    """Restaurants like this one: [(Restaurant, score)], best first."""
+    model = get_model()
+    scored = model.cached(("restaurant", restaurant_id, limit), [restaurant_tag(restaurant_id)],
+                          lambda: model.similar_to(restaurant_id, limit))
+    return load_restaurants(scored)
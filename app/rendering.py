@@ -0,0 +1,73 @@
+# Template rendering for the listing pages
+# - Templates are compiled at start-up (precompile_templates) and their compiled code is kept in a bytecode cache
+#   on disk (TEMPLATE_CACHE_DIR): a new worker loads it instead of parsing and compiling every template again
+# - Rows repeated on listings (restaurants, meals) are macros in rows.html. cached_row() renders a row once per
+#   (macro, id, version) and keeps the HTML in fragment_cache, so a page of 100 rows mostly joins cached strings.
+#   The version is restaurants.version, bumped by every write to the restaurant, its meals or its tags (app/cache.py)
+# - Listings with many rows are streamed (stream_template): the first rows go out while the rest are rendered
+
+# Standard library imports
+import os
+
+# Third-party imports
+from flask import current_app, render_template, session, stream_template
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+# Local app imports
+from app.cache import TTLCache
+
+
+# Template with the row macros
+ROW_TEMPLATE = "rows.html"
+
+# Sized from FRAGMENT_CACHE_SIZE / FRAGMENT_CACHE_TTL by init_app()
+fragment_cache = TTLCache()
+
+
+# ROW FRAGMENTS
+def cached_row(macro, item, version):
+    """HTML of a rows.html macro for an item (with an id) at a version, rendered once per version."""
+    key = (macro, item.id, version)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = Markup(getattr(current_app.jinja_env.get_template(ROW_TEMPLATE).module, macro)(item))
+        if fragment_cache.max_entries:
+            fragment_cache.set(key, html)
+    return html
+
+
+def fragment_stats():
+    """Hit/miss counters for the row fragment cache."""
+    return fragment_cache.stats()
+
+
+# PAGES
+def render_listing(template, restaurants, **context):
+    """Render a listing page, streamed when it has at least TEMPLATE_STREAM_MIN_ROWS restaurants."""
+    # Flashed messages are removed from the session while the page renders, too late once streaming has started
+    if len(restaurants) >= current_app.config["TEMPLATE_STREAM_MIN_ROWS"] and not session.get("_flashes"):
+        return stream_template(template, restaurants=restaurants, **context)
+    return render_template(template, restaurants=restaurants, **context)
+
+
+# START-UP
+def precompile_templates(app):
+    """Compile every template now (loaded from the bytecode cache when it is up to date). Returns how many."""
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith(".html"))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def init_app(app):
+    """Install the bytecode cache, size the fragment cache and compile the templates."""
+    cache_dir = app.config["TEMPLATE_CACHE_DIR"]
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    app.jinja_env.globals["cached_row"] = cached_row
+    fragment_cache.max_entries = app.config["FRAGMENT_CACHE_SIZE"]
+    fragment_cache.ttl = app.config["FRAGMENT_CACHE_TTL"]
+    if app.config["TEMPLATE_PRECOMPILE"]:
+        precompile_templates(app)
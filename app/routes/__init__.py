@@ -0,0 +1,15 @@
+# Route blueprints, registered on the app by create_app()
+# - auth: register, log in, log out
+# - restaurants: home page, restaurant records, bulk import and export
+# - meals: meal records
+# - search: restaurant search
+# - media: meal photos and thumbnails
+# - main: profile, about and diagnostics
+# - api: JSON listings under /api
+
+
+def register_blueprints(app):
+    """Register every route blueprint on the app."""
+    from app.routes import auth, restaurants, meals, search, media, main, api
+    for module in (auth, restaurants, meals, search, media, main, api):
+        app.register_blueprint(module.bp)
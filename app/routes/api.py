@@ -0,0 +1,384 @@
+# JSON API - restaurant listings, a restaurant's meals, favorites and tags, for scripts and the front end
+# - Keyset pagination: every response has "next_cursor", pass it back as ?cursor= for the next page (no OFFSET)
+# - ?limit= page size, bounded by the config (SEARCH_MAX_PAGE_SIZE, MEALS_MAX_PAGE_SIZE)
+# - ?fields=id,name only sends those fields
+# - Compact JSON (no whitespace), ?compact=1 sends {"fields": [...], "rows": [[...], ...]} instead of objects
+# - Responses go through the page cache and ETags like the HTML listings
+# - Long-running work (deleting a restaurant, rebuilds) answers 202 with a background job, poll /api/jobs/<id>
+# - The meals of a visit are added together: POST /api/restaurants/<id>/meals {"date": ..., "meals": [...]}
+# - Near me: /api/restaurants/nearby?lat=&lon=&radius_km= or ?bbox=south,west,north,east, closest first
+# - Recommendations (needs NumPy, 503 without): /api/recommendations for the user, /api/restaurants/<id>/similar
+# - Spending and visits of the user: /api/analytics?start=&end= (dates, this year by default, ANALYTICS_MAX_YEARS at most)
+# - Meal photos are uploaded to /api/meals/<id>/photos (multipart "photo" field, or the image as the body)
+# Errors are JSON too: {"error": "..."} with the HTTP status (401 when not logged in).
+
+# Standard library imports
+import json
+
+# Third-party imports
+from flask import Blueprint, Response, abort, current_app, request, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import HTTPException
+
+# Local app imports
+from app import analytics, db, geo, jobs
+from app.media import MediaError, add_meal_photo, check_upload_length, describe_photo
+from app.models import Restaurant, Meal, MealPhoto, Job
+from app.pagination import clamp_page_size
+from app.queries import FAVORITES_TAG, LISTING_SORTS, list_restaurants, load_meal_page
+from app.visits import VisitError, add_visit
+from app.tagging import MAX_FILTER_TAGS, TAG_MODES, parse_tags, popular_tags
+from app.cache import cached_page, restaurant_version, listing_version, restaurant_tag, LISTING_VERSION
+
+
+bp = Blueprint("api", __name__, url_prefix="/api")
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+# Fields a client can ask for, and how to read each one
+RESTAURANT_FIELDS = {
+    "id": lambda restaurant: restaurant.id,
+    "name": lambda restaurant: restaurant.name,
+    "address": lambda restaurant: restaurant.address,
+    "phone_number": lambda restaurant: restaurant.phone_number,
+    "cuisine": lambda restaurant: restaurant.cuisine,
+    "rating": lambda restaurant: restaurant.rating,
+    "latitude": lambda restaurant: restaurant.latitude,
+    "longitude": lambda restaurant: restaurant.longitude,
+    # Precomputed statistics, loaded with the restaurant
+    "meal_count": lambda restaurant: restaurant.stats.meal_count if restaurant.stats else 0,
+    "average_price": lambda restaurant: restaurant.stats.average_price if restaurant.stats else None,
+    "last_visit": lambda restaurant: _iso(restaurant.stats.last_visit) if restaurant.stats else None,
+}
+
+MEAL_FIELDS = {
+    "id": lambda meal: meal.id,
+    "name": lambda meal: meal.name,
+    "date": lambda meal: _iso(meal.date),
+    "price": lambda meal: meal.price,
+    "rating": lambda meal: meal.rating,
+    "notes": lambda meal: meal.notes,
+    "person_id": lambda meal: meal.person_id,
+    # Loaded with the meal (same query)
+    "person": lambda meal: meal.person.name,
+}
+
+TAG_FIELDS = {
+    "id": lambda tag: tag.id,
+    "name": lambda tag: tag.name,
+    # Precomputed, maintained on every change to a restaurant's tags
+    "restaurant_count": lambda tag: tag.restaurant_count,
+}
+
+
+# RESPONSES
+def requested_fields(available):
+    """Field names from ?fields=, all of them by default. 400 on an unknown field."""
+    value = request.args.get("fields")
+    if not value:
+        return list(available)
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown or not names:
+        abort(400, f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}")
+    return names
+
+
+def json_response(payload, status=200):
+    """JSON without whitespace between tokens."""
+    return Response(json.dumps(payload, separators=(",", ":")), status=status, mimetype="application/json")
+
+
+def page_response(items, available, next_cursor):
+    """One page of items with the requested fields, as objects or (compact=1) as rows."""
+    fields = requested_fields(available)
+    readers = [available[name] for name in fields]
+    if request.args.get("compact") in ("1", "true"):
+        rows = [[read(item) for read in readers] for item in items]
+        return json_response({"fields": fields, "rows": rows, "next_cursor": next_cursor})
+    return json_response({"items": [{name: read(item) for name, read in zip(fields, readers)} for item in items],
+                          "next_cursor": next_cursor})
+
+
+def scored_response(scored, key):
+    """Restaurants with the requested fields, each with its value from [(Restaurant, value)] under key."""
+    fields = requested_fields(RESTAURANT_FIELDS)
+    return json_response({"items": [{**{name: RESTAURANT_FIELDS[name](restaurant) for name in fields}, key: value}
+                                    for restaurant, value in scored]})
+
+
+def restaurant_page(tags=None):
+    """
+    A page of restaurants in the ?sort= order (last_visit, name or rating).
+    - tags: only restaurants with all of these tags, by default ?tags=a,b with ?tag_mode=all|any
+    """
+    sort = request.args.get("sort") or "last_visit"
+    if sort not in LISTING_SORTS:
+        abort(400, f"Unknown sort {sort!r}, expected one of {', '.join(LISTING_SORTS)}")
+    tag_mode = "all"
+    if tags is None:
+        tags = parse_tags(request.args.get("tags"))
+        tag_mode = request.args.get("tag_mode") or "all"
+        if tag_mode not in TAG_MODES:
+            abort(400, f"Unknown tag_mode {tag_mode!r}, expected one of {', '.join(TAG_MODES)}")
+        if len(tags) > MAX_FILTER_TAGS:
+            abort(400, f"At most {MAX_FILTER_TAGS} tags")
+    limit = clamp_page_size(request.args.get("limit"), current_app.config["SEARCH_PAGE_SIZE"],
+                            current_app.config["SEARCH_MAX_PAGE_SIZE"])
+    try:
+        restaurants, next_cursor = list_restaurants(sort=sort, cursor=request.args.get("cursor"), limit=limit,
+                                                    tags=tags, tag_mode=tag_mode)
+    except ValueError:
+        abort(400, "Invalid cursor")
+    return page_response(restaurants, RESTAURANT_FIELDS, next_cursor)
+
+
+# RESTAURANTS
+@bp.route("/restaurants")
+@login_required
+@cached_page(version=listing_version, tags=lambda: [LISTING_VERSION])
+def restaurants():
+    """All restaurants, one page at a time."""
+    return restaurant_page()
+
+
+@bp.route("/favorites")
+@login_required
+@cached_page(version=listing_version, tags=lambda: [LISTING_VERSION])
+def favorites():
+    """Restaurants with the favorites tag, one page at a time."""
+    return restaurant_page(tags=[FAVORITES_TAG])
+
+
+@bp.route("/restaurants/nearby")
+@login_required
+def nearby():
+    """
+    Restaurants closest first, each with distance_km (not cached, every user asks from somewhere else).
+    - ?lat=&lon= within ?radius_km= (GEO_DEFAULT_RADIUS_KM by default), or inside ?bbox=south,west,north,east
+      (distance from the box centre) - both at most GEO_MAX_RADIUS_KM around the centre
+    - Optional ?cuisine= and ?min_rating= filters, ?limit=
+    """
+    config = current_app.config
+    args = request.args
+    cuisine = args.get("cuisine") or None
+    limit = clamp_page_size(args.get("limit"), config["GEO_PAGE_SIZE"], config["GEO_MAX_PAGE_SIZE"])
+    try:
+        min_rating = int(args["min_rating"]) if args.get("min_rating") else None
+        radius_km = float(args.get("radius_km") or config["GEO_DEFAULT_RADIUS_KM"])
+        box = [float(value) for value in args["bbox"].split(",")] if args.get("bbox") else None
+    except ValueError:
+        abort(400, "min_rating, radius_km and bbox must be numbers")
+
+    try:
+        if box:
+            if len(box) != 4:
+                abort(400, "bbox must be south,west,north,east")
+            found = geo.restaurants_in_box(*box, cuisine=cuisine, min_rating=min_rating, limit=limit,
+                                           max_radius_km=config["GEO_MAX_RADIUS_KM"])
+        else:
+            point = geo.parse_point(args.get("lat"), args.get("lon"))
+            if point is None:
+                abort(400, "Pass lat and lon, or bbox")
+            if not 0 < radius_km <= config["GEO_MAX_RADIUS_KM"]:
+                abort(400, f"radius_km must be more than 0 and at most {config['GEO_MAX_RADIUS_KM']}")
+            found = geo.restaurants_near(*point, radius_km, cuisine=cuisine, min_rating=min_rating, limit=limit)
+    except ValueError as error:
+        abort(400, str(error))
+    return scored_response(found, "distance_km")
+
+
+# TAGS
+@bp.route("/tags")
+@login_required
+@cached_page(version=listing_version, tags=lambda: [LISTING_VERSION])
+def tags():
+    """Tags in use, most used first, with their restaurant counts (for tag clouds and facets)."""
+    limit = clamp_page_size(request.args.get("limit"), current_app.config["TAG_CLOUD_SIZE"],
+                            current_app.config["SEARCH_MAX_PAGE_SIZE"])
+    try:
+        tag_list, next_cursor = popular_tags(limit, request.args.get("cursor"))
+    except ValueError:
+        abort(400, "Invalid cursor")
+    return page_response(tag_list, TAG_FIELDS, next_cursor)
+
+
+# MEALS OF A RESTAURANT
+@bp.route("/restaurants/<int:restaurant_id>/meals")
+@login_required
+@cached_page(version=restaurant_version, tags=lambda restaurant_id: [restaurant_tag(restaurant_id)])
+def restaurant_meals(restaurant_id):
+    """A restaurant's meals, newest first, one page at a time (404 if the restaurant doesn't exist)."""
+    limit = clamp_page_size(request.args.get("limit"), current_app.config["MEALS_PAGE_SIZE"],
+                            current_app.config["MEALS_MAX_PAGE_SIZE"])
+    try:
+        meals, next_cursor = load_meal_page(restaurant_id, request.args.get("cursor"), limit)
+    except ValueError:
+        abort(400, "Invalid cursor")
+    # An empty page is either a restaurant without meals or no restaurant at all
+    if not meals and db.session.get(Restaurant, restaurant_id) is None:
+        abort(404, "Restaurant not found")
+    return page_response(meals, MEAL_FIELDS, next_cursor)
+
+
+@bp.route("/restaurants/<int:restaurant_id>/meals", methods=["POST"])
+@login_required
+def add_restaurant_meals(restaurant_id):
+    """
+    Add the meals of one visit, all of them or none: {"date": "YYYY-MM-DD", "meals": [{"name", "price", "rating",
+    "notes", and "person_id" or "person" (a name) - the logged-in user by default}, ...]}.
+    201 with the new meals, 400 with {"error", "errors": [{"index", "message"}]} (index from 0, None for the date).
+    """
+    if db.session.get(Restaurant, restaurant_id) is None:
+        abort(404, "Restaurant not found")
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("meals"), list) \
+            or not all(isinstance(meal, dict) for meal in body["meals"]):
+        abort(400, 'Expected {"date": ..., "meals": [{...}, ...]}')
+
+    try:
+        meal_ids = add_visit(restaurant_id, body.get("date"), body["meals"], default_person_id=current_user.person_id)
+    except VisitError as error:
+        errors = [{"index": number - 1 if number else None, "message": message} for number, message in error.errors]
+        return json_response({"error": str(error), "errors": errors}, 400)
+
+    # Read back with the people in one query (the commit expired them)
+    meals = db.session.scalars(select(Meal).options(joinedload(Meal.person))
+                               .where(Meal.id.in_(meal_ids)).order_by(Meal.id)).all()
+    return json_response({"items": [{name: read(meal) for name, read in MEAL_FIELDS.items()} for meal in meals]}, 201)
+
+
+# RECOMMENDATIONS
+
+
+def recommendation_limit():
+    return clamp_page_size(request.args.get("limit"), current_app.config["RECOMMEND_PAGE_SIZE"],
+                           current_app.config["RECOMMEND_MAX_PAGE_SIZE"])
+
+
+@bp.route("/recommendations")
+@login_required
+def recommendations():
+    """Restaurants the logged-in user hasn't been to and might like, best first."""
+    # Only loaded by the workers that serve recommendations (NumPy)
+    from app import recommend
+
+    if not recommend.available():
+        abort(503, "Recommendations need NumPy")
+    return scored_response(recommend.recommended_restaurants(current_user.person_id, recommendation_limit()), "score")
+
+
+@bp.route("/restaurants/<int:restaurant_id>/similar")
+@login_required
+def similar(restaurant_id):
+    """Restaurants most like this one (same people, cuisine, rating and tags), best first."""
+    from app import recommend
+
+    if not recommend.available():
+        abort(503, "Recommendations need NumPy")
+    if db.session.get(Restaurant, restaurant_id) is None:
+        abort(404, "Restaurant not found")
+    return scored_response(recommend.similar_restaurants(restaurant_id, recommendation_limit()), "score")
+
+
+# ANALYTICS
+@bp.route("/analytics")
+@login_required
+def user_analytics():
+    """
+    Spending and visits of the logged-in user from ?start= to ?end= (YYYY-MM-DD, both included, this year by
+    default, at most ANALYTICS_MAX_YEARS apart): summary, by_month, by_cuisine and the ?limit= most visited
+    restaurants. Not cached (per user).
+    """
+    try:
+        start, end = analytics.parse_range(request.args.get("start"), request.args.get("end"),
+                                           current_app.config["ANALYTICS_MAX_YEARS"])
+    except ValueError as error:
+        abort(400, f"Invalid date range: {error}")
+    limit = clamp_page_size(request.args.get("limit"), current_app.config["ANALYTICS_TOP_RESTAURANTS"],
+                            current_app.config["ANALYTICS_MAX_TOP_RESTAURANTS"])
+    report = analytics.person_report(current_user.person_id, start, end, limit)
+    report["top_restaurants"] = [{"id": restaurant.id, "name": restaurant.name, "cuisine": restaurant.cuisine,
+                                  **totals} for restaurant, totals in report["top_restaurants"]]
+    return json_response(report)
+
+
+# MEAL PHOTOS
+@bp.route("/meals/<int:meal_id>/photos", methods=["GET", "POST"])
+@login_required
+def meal_photos(meal_id):
+    """
+    A meal's photos (GET), or add one (POST): a multipart form with a "photo" file, or the image as the body.
+    The upload is written to disk in chunks as it is read, thumbnails are made in the background.
+    """
+    if db.session.get(Meal, meal_id) is None:
+        abort(404, "Meal not found")
+
+    if request.method == "POST":
+        try:
+            # Checked before the form is parsed: werkzeug spools big multipart files to disk
+            check_upload_length(request.content_length)
+            upload = request.files.get("photo")
+            photo = add_meal_photo(meal_id, upload.stream if upload is not None else request.stream)
+        except MediaError as error:
+            abort(error.status, str(error))
+        response = json_response(describe_photo(photo), 201)
+        response.headers["Location"] = url_for("media.original", sha256=photo.sha256)
+        return response
+
+    photos = db.session.scalars(select(MealPhoto).where(MealPhoto.meal_id == meal_id).order_by(MealPhoto.id)).all()
+    return json_response({"items": [describe_photo(photo) for photo in photos]})
+
+
+# BACKGROUND JOBS
+# Maintenance jobs a client may start (the CLI commands rebuild-search / rebuild-stats do the same inline)
+MAINTENANCE_JOBS = ("rebuild_search", "refresh_stats", "prune_media")
+
+
+def job_accepted(job):
+    """202 with the job's status and its polling URL."""
+    response = json_response(jobs.describe(job), 202)
+    response.headers["Location"] = url_for("api.job_status", job_id=job.id)
+    return response
+
+
+@bp.route("/restaurants/<int:restaurant_id>", methods=["DELETE"])
+@login_required
+def delete_restaurant(restaurant_id):
+    """Delete a restaurant with its meals and tags in the background."""
+    if db.session.get(Restaurant, restaurant_id) is None:
+        abort(404, "Restaurant not found")
+    return job_accepted(jobs.enqueue("delete_restaurant", {"restaurant_id": restaurant_id},
+                                     key=f"delete_restaurant:{restaurant_id}"))
+
+
+@bp.route("/jobs", methods=["POST"])
+@login_required
+def start_job():
+    """Start a maintenance job: ?kind=rebuild_search, refresh_stats or prune_media (one of each kind at a time)."""
+    kind = request.args.get("kind") or (request.get_json(silent=True) or {}).get("kind")
+    if kind not in MAINTENANCE_JOBS:
+        abort(400, f"Unknown job kind {kind!r}, expected one of {', '.join(MAINTENANCE_JOBS)}")
+    return job_accepted(jobs.enqueue(kind, key=kind))
+
+
+@bp.route("/jobs/<int:job_id>")
+@login_required
+def job_status(job_id):
+    """Status, progress and result of a background job."""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        abort(404, "Job not found")
+    return json_response(jobs.describe(job))
+
+
+# ERRORS
+@bp.errorhandler(HTTPException)
+def api_error(error):
+    """Errors in the API as JSON."""
+    return json_response({"error": error.description}, error.code)
@@ -0,0 +1,151 @@
+# Authentication routes - register, log in, log out
+
+# Third-party imports
+from flask import Blueprint, render_template, request, redirect, flash, url_for
+from flask_login import current_user, login_user, logout_user
+from sqlalchemy.exc import IntegrityError
+
+# Local app imports
+from app import db
+from app.models import People, User
+from app.identity import UserSnapshot, forget_user
+from app.passwords import hash_password, verify_password, needs_rehash, HashingBusy
+from app.ratelimit import check_auth_attempt
+
+
+bp = Blueprint("auth", __name__)
+
+
+# REGISTER NEW USER
+@bp.route("/register", methods=["GET", "POST"])
+def register():
+    """
+    Register a new user. 
+    - Ensures username is unique (by the unique constraint on users.username).
+    - Requires password confirmation.
+    - Hashes the password before saving.
+    - Attempts are rate limited per client and per username (429).
+    """
+    if request.method == 'POST':
+        name = request.form.get('name')
+        username = request.form.get('username')
+        password = request.form.get('password')
+        confirmation = request.form.get('confirmation')
+
+        # Before any database or hashing work
+        check_auth_attempt(username)
+        
+        # Check if name, username, and password fields were entered
+        # url_for function looks to the url for def register() instead of any hard coded /route
+        if not name: 
+            flash("Please enter name.", "error")
+            return redirect(url_for("auth.register"))
+        if not username:
+            flash("Please enter username.", "error")
+            return redirect(url_for("auth.register"))   
+        if not password or not confirmation:
+            flash("Please enter password twice.", "error")
+            return redirect(url_for("auth.register")) 
+        
+        # Check if password confirmation matches
+        if password != confirmation:
+            flash("Passwords must match.", "error")
+            return redirect(url_for("auth.register")) 
+
+        # Hash the password (in the hashing pool, 503 if it is saturated)
+        hashed_password = hash_password(password)
+        # Add user to user table in db with a new record in people table - one flush inserts both (person first)
+        new_user = User(username=username, password=hashed_password, person=People(name=name))
+        db.session.add(new_user)
+        # No lookup first: the unique constraint refuses a taken username, even from two signups at the same time
+        try:
+            db.session.flush()
+            snapshot = UserSnapshot(new_user.id, username, new_user.person_id, name)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash("Username already exists. Please log in or try different username", "error")
+            return redirect(url_for("auth.register"))
+            # TODO: ADD EASY BUTTON TO LINK TO LOGIN PAGE
+
+        # Flash message for success in registering
+        flash("Success! You can now log in!", "success")
+
+        # Log user in using flask_login feature (ids read before the commit, no query to reload the user)
+        login_user(snapshot)
+
+        return redirect(url_for("restaurants.index"))
+
+    # Method == GET
+    else: 
+        return render_template("register.html")
+
+
+# LOG IN
+@bp.route("/login", methods=["GET", "POST"])
+def login():
+    """
+    Log in an existing user. 
+    - Ensure username exists and password is correct.
+    - Attempts are rate limited per client and per username (429).
+    """
+    if request.method == "POST":
+        username = request.form.get("username")
+        password = request.form.get("password")
+
+        # Before any database or hashing work
+        check_auth_attempt(username)
+
+        # Ensure username was entered
+        if not username:
+            flash("Please enter username.", "error")
+            return render_template("login.html")
+        
+        # Ensure password was entered
+        if not password:
+            flash("Please enter password.", "error")
+            return render_template("login.html")
+        
+        # Query for user record by username
+        user_record = User.query.filter_by(username=username).first()
+
+        # Check if username exists
+        if not user_record:
+            flash("Username does not exist.", "error")
+            # TODO: ADD OPTION OR BUTTON FOR THEM TO REGISTER EASILY
+            return render_template("login.html")
+
+        # Check if password is correct (in the hashing pool, 503 if it is saturated)
+        if not verify_password(user_record.password, password):
+            flash("Password is incorrect.", "error")
+            return render_template("login.html")
+
+        # Upgrade hashes made with older settings now that we have the plain password
+        if needs_rehash(user_record.password):
+            try:
+                user_record.password = hash_password(password)
+                db.session.commit()
+            except HashingBusy:
+                # Not worth failing the login for, try again next time
+                pass
+
+        # Login in user using flask_login feature
+        login_user(user_record)
+        flash("Login successful!", "success")
+        
+        return redirect(url_for("restaurants.index"))
+    
+    else:
+        return render_template("login.html")
+
+
+# LOG OUT
+@bp.route("/logout", methods=["GET", "POST"])
+def logout():
+    """
+    Log out the user. 
+    """
+    # Drop the cached identity so the next login loads a fresh copy
+    forget_user(current_user.get_id())
+    logout_user()
+    return redirect(url_for("auth.login"))
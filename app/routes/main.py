@@ -0,0 +1,68 @@
+# Other pages - profile, about, and diagnostics
+
+# Third-party imports
+from flask import Blueprint, Response, abort, current_app, flash, jsonify, render_template, request
+from flask_login import current_user, login_required
+
+# Local app imports
+from app import analytics
+from app.database import pool_stats
+from app.metrics import render_metrics
+
+
+bp = Blueprint("main", __name__)
+
+
+# USER PROFILE
+@bp.route("/user", methods=["GET", "POST"])
+@login_required
+def user():
+    """
+    Display user information: spending and visits over a date range (?start=&end=, this year by default).
+    Allow user to change password.
+    """
+    max_years = current_app.config["ANALYTICS_MAX_YEARS"]
+    try:
+        start, end = analytics.parse_range(request.args.get("start"), request.args.get("end"), max_years)
+    except ValueError:
+        flash(f"Dates must be YYYY-MM-DD, the start before the end and at most {max_years} years apart.", "error")
+        start, end = analytics.default_range()
+    report = analytics.person_report(current_user.person_id, start, end,
+                                     current_app.config["ANALYTICS_TOP_RESTAURANTS"])
+    return render_template("user.html", report=report)
+
+
+# ABOUT PAGE
+@bp.route("/about", methods=["GET", "POST"])
+def about():
+    """Information about the project. Like to repo?"""
+
+    return "about"
+
+
+# DATABASE POOL USAGE
+@bp.route("/stats/pool")
+@login_required
+def pool_usage():
+    """
+    Connection pool size and usage of the worker process that answers (JSON).
+    """
+    return jsonify(pool_stats())
+
+
+# METRICS FOR PROMETHEUS
+@bp.route("/metrics")
+def metrics():
+    """
+    Request latency, SQL and template metrics of the worker process that answers (Prometheus text format).
+    - Protected by METRICS_TOKEN (scrapers send it as a bearer token).
+    - Without a token it is only served in debug or testing, a deployed app answers 404 (SQL and timings leak).
+    """
+    token = current_app.config["METRICS_TOKEN"]
+    if not token:
+        if not (current_app.debug or current_app.testing):
+            abort(404)
+    elif request.headers.get("Authorization") != f"Bearer {token}":
+        abort(401)
+    return Response(render_metrics(current_app.config["METRICS_SLOW_STATEMENTS"]),
+                    mimetype="text/plain; version=0.0.4")
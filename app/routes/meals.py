@@ -0,0 +1,119 @@
+# Meal routes - meal records and adding the meals of a visit
+
+# Standard library imports
+from datetime import date
+
+# Third-party imports
+from flask import Blueprint, abort, flash, redirect, render_template, request, url_for
+from flask_login import current_user, login_required
+
+# Local app imports
+from app import db
+from app.media import MediaError, add_meal_photo, describe_photo
+from app.models import Restaurant
+from app.queries import load_meal
+from app.visits import VisitError, add_visit
+
+
+bp = Blueprint("meals", __name__)
+
+# Meal rows on the Add Meals form
+VISIT_FORM_ROWS = 6
+# Text fields of a meal row (a row with all of them blank is skipped)
+ROW_FIELDS = ("person", "meal_name", "price", "rating", "notes")
+
+
+def form_rows():
+    """Meal rows of the submitted Add Meals form as dicts of ROW_FIELDS (blank rows up to VISIT_FORM_ROWS)."""
+    columns = {field: request.form.getlist(field) for field in ROW_FIELDS}
+    count = max(VISIT_FORM_ROWS, *map(len, columns.values()))
+    return [{field: values[index] if index < len(values) else "" for field, values in columns.items()}
+            for index in range(count)]
+
+
+# MEAL RECORD
+@bp.route("/meal/<int:meal_id>", methods=["GET", "POST"])
+@login_required
+def meal(meal_id):
+    """
+    Display meal record.
+    - Restaurant, person and photos are loaded with the meal in one query.
+    - Option to delete.
+    """
+    meal_record = load_meal(meal_id)
+    if meal_record is None:
+        abort(404)
+
+    if request.method == "POST":
+        if request.form.get("action") == "delete_meal":
+            # TODO: VERIFY THAT USER WANTS TO DELETE
+            # Photo rows go with the meal (unused files are removed by the prune_media job), statistics and
+            # cached pages are updated by the session events
+            restaurant_id = meal_record.restaurant_id
+            db.session.delete(meal_record)
+            db.session.commit()
+            flash("Meal deleted.", "success")
+
+            # Go back to the restaurant record
+            return redirect(url_for("restaurants.restaurant", restaurant_id=restaurant_id))
+
+        return redirect(url_for("meals.meal", meal_id=meal_id))
+
+    photos = [describe_photo(photo) for photo in meal_record.photos]
+    return render_template("meal.html", meal=meal_record, photos=photos)
+
+
+# ADD MEALS
+@bp.route("/add_meal/<int:restaurant_id>", methods=["GET", "POST"])
+@login_required
+def add_meal(restaurant_id):
+    """
+    Add the meals of one visit to an existing restaurant - a row per meal, all saved together or none.
+    - Date of the visit (today by default)
+    - Per meal: who had it (you by default), menu item name, price, rating, notes and a photo
+    """
+    restaurant = db.session.get(Restaurant, restaurant_id)
+    if restaurant is None:
+        abort(404)
+
+    if request.method == "POST":
+        day = request.form.get("date")
+        rows = form_rows()
+        uploads = request.files.getlist("photo")
+
+        # Rows the user filled in, with the photo picked on the same row
+        meals, photos, row_numbers = [], [], []
+        for index, row in enumerate(rows):
+            if not any(value.strip() for value in row.values()):
+                continue
+            meals.append({"person": row["person"], "name": row["meal_name"], "price": row["price"],
+                          "rating": row["rating"], "notes": row["notes"]})
+            upload = uploads[index] if index < len(uploads) else None
+            photos.append(upload if upload and upload.filename else None)
+            row_numbers.append(index + 1)
+
+        try:
+            meal_ids = add_visit(restaurant_id, day, meals, default_person_id=current_user.person_id)
+        except VisitError as error:
+            for number, message in error.errors:
+                flash(f"Row {row_numbers[number - 1]}: {message}" if number else message, "error")
+            # Show the form again with what was entered (photos have to be picked again)
+            return render_template("mealAdd.html", restaurant=restaurant, day=day, rows=rows)
+
+        # Photos are stored after the meals are saved - a rejected photo doesn't lose the meals
+        for meal_id, new_meal, upload in zip(meal_ids, meals, photos):
+            if upload is not None:
+                try:
+                    add_meal_photo(meal_id, upload.stream)
+                except MediaError as error:
+                    flash(f"Photo for {new_meal['name'].strip()} was not saved: {error}", "error")
+
+        # Flash message for success in adding
+        flash(f"Success! You added {len(meal_ids)} meal{'s' if len(meal_ids) != 1 else ''}!", "success")
+
+        # SEND USER TO THE RESTAURANT RECORD
+        return redirect(url_for("restaurants.restaurant", restaurant_id=restaurant_id))
+
+    else:
+        return render_template("mealAdd.html", restaurant=restaurant, day=date.today().isoformat(),
+                               rows=form_rows())
@@ -0,0 +1,51 @@
+# Media routes - stored meal photos and their thumbnails
+# URLs contain the file's SHA-256, so a URL always serves the same bytes and browsers may cache it for good
+
+# Standard library imports
+import os
+
+# Third-party imports
+from flask import Blueprint, abort, current_app
+from flask_login import login_required
+
+# Local app imports
+from app import db
+from app.media import original_path, thumbnail_path, send_stored, is_sha256
+from app.models import MediaFile
+
+
+bp = Blueprint("media", __name__, url_prefix="/media")
+
+
+# ORIGINAL FILE
+@bp.route("/<sha256>")
+@login_required
+def original(sha256):
+    """A stored photo as uploaded (conditional and Range requests supported)."""
+    if not is_sha256(sha256):
+        abort(404)
+    media = db.session.get(MediaFile, sha256)
+    if media is None or not os.path.exists(original_path(sha256)):
+        abort(404)
+    return send_stored(original_path(sha256), media.content_type, sha256)
+
+
+# THUMBNAIL
+@bp.route("/<sha256>/<int:size>.jpg")
+@login_required
+def thumbnail(sha256, size):
+    """A photo resized to fit size x size pixels (JPEG), the original until the thumbnail job has made it."""
+    if not is_sha256(sha256) or size not in current_app.config["MEDIA_THUMBNAIL_SIZES"]:
+        abort(404)
+    path = thumbnail_path(sha256, size)
+    if os.path.exists(path):
+        # Served without a database query
+        return send_stored(path, "image/jpeg", f"{sha256}-{size}")
+
+    media = db.session.get(MediaFile, sha256)
+    if media is None or not os.path.exists(original_path(sha256)):
+        abort(404)
+    response = send_stored(original_path(sha256), media.content_type, sha256)
+    # Stand-in only: check again next time, the thumbnail may be ready by then
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
@@ -0,0 +1,275 @@
+# Restaurant routes - home page, restaurant records, bulk import and export
+
+# Standard library import
+import os
+import uuid
+from datetime import datetime
+
+# Third-party imports
+from flask import Blueprint, Response, abort, current_app, jsonify, render_template, request, redirect, flash, url_for
+from flask_login import current_user, login_required
+
+# Local app imports
+from app import db, jobs
+from app.models import Restaurant
+from app.validation import restaurant_error
+from app.tagging import parse_tags, tags_named
+from app.queries import FAVORITES_TAG, list_restaurants, load_restaurant_detail
+from app.pagination import clamp_page_size
+from app.rendering import render_listing
+from app.cache import cached_page, restaurant_version, listing_version, restaurant_tag, LISTING_VERSION
+
+
+bp = Blueprint("restaurants", __name__)
+
+
+def listing_page_size():
+    """Restaurants per listing page, ?limit= up to SEARCH_MAX_PAGE_SIZE."""
+    return clamp_page_size(request.args.get("limit"), current_app.config["SEARCH_PAGE_SIZE"],
+                           current_app.config["SEARCH_MAX_PAGE_SIZE"])
+
+
+# IDEX PAGE
+@bp.route("/")
+@login_required
+@cached_page(version=listing_version, tags=lambda: [LISTING_VERSION])
+def index():
+    """Show home page"""
+    if request.method == "POST":
+        # If the add restaurant button is clicked
+        if request.form.get("action") == "add_rest":
+            return redirect(url_for("restaurants.add_rest"))
+
+    else:
+        # Most recently visited restaurants (or by name / rating), a page at a time, from the precomputed statistics
+        sort = request.args.get("sort") or None
+        try:
+            restaurants, next_cursor = list_restaurants(sort=sort, cursor=request.args.get("cursor"),
+                                                        limit=listing_page_size())
+        except ValueError:
+            # Cursor in the URL was not one we created
+            flash("Invalid page link, showing first page.", "error")
+            return redirect(url_for("restaurants.index", sort=sort))
+        return render_listing("index.html", restaurants, next_cursor=next_cursor, sort=sort)
+
+
+# RESTAURANT RECORD 
+    # Track the id of selected restaurant in the URL
+@bp.route("/restaurant/<int:restaurant_id>", methods=["GET", "POST"])
+@login_required
+@cached_page(version=restaurant_version, tags=lambda restaurant_id: [restaurant_tag(restaurant_id)])
+def restaurant(restaurant_id):
+    """
+    Display restaurant records.
+    - Tags, meals (newest first, paged) and meal totals.
+    - Option to delete.
+    """
+
+    if request.method == "POST":
+
+        # Get the restaurant record based on id
+        restaurant_record = db.session.get(Restaurant, restaurant_id)
+        if restaurant_record is None:
+            abort(404)
+
+        if request.form.get("action") == "delete_rest":
+            # TODO: VERIFY THAT USER WANTS TO DELETE
+            # Meals, tags and statistics go with the restaurant - in the background, a batch of meals at a time
+            job = jobs.enqueue("delete_restaurant", {"restaurant_id": restaurant_id},
+                               key=f"delete_restaurant:{restaurant_id}")
+
+            # Page that follows the job, then links back to the home page
+            return render_template("job.html", job=job, title=f"Deleting {restaurant_record.name}",
+                                   next_url=url_for("restaurants.index")), 202
+
+        # If user clicks Add Meal, then send them to the Add Meals form
+        if request.form.get("action") == "add_meal":
+
+            return redirect(url_for("meals.add_meal", restaurant_id=restaurant_id))
+
+        return redirect(url_for("restaurants.restaurant", restaurant_id=restaurant_id))
+
+    else: # If GET method, just load the page with the restaurant data
+
+        # Load the restaurant, its tags, one page of meals and the meal totals in a fixed number of queries
+        try:
+            detail = load_restaurant_detail(restaurant_id, cursor=request.args.get("cursor"),
+                                            limit=current_app.config["MEALS_PAGE_SIZE"])
+        except ValueError:
+            # Cursor in the URL was not one we created
+            flash("Invalid page link, showing newest meals.", "error")
+            return redirect(url_for("restaurants.restaurant", restaurant_id=restaurant_id))
+
+        if detail is None:
+            abort(404)
+
+        # Pass in values into template (use jinja template)
+        return render_template("restaurant.html", detail=detail, restaurant=detail.restaurant)
+
+
+
+# ADD NEW RESTAURANT
+@bp.route("/add_rest", methods=["GET", "POST"])
+@login_required
+def add_rest():
+    """
+    Create new restaurant record.
+    - Name
+    - Address
+    - Phone number
+    - Hours
+    - Cuisine type
+    - Ratings
+    - Standard tags
+    - Customizable tags
+    """
+
+    if request.method == "POST":
+        # Capture name of new restaurant
+        restaurant = request.form.get("restaurant_name")
+        address = request.form.get("address")
+        phone = request.form.get("phone")
+        cuisine = request.form.get("cuisine")
+        rating = request.form.get("rating")
+        tags = parse_tags(request.form.get("tags"))
+
+        # Verify the fields (same rules as the bulk importer)
+        error = restaurant_error(restaurant, phone, cuisine, rating)
+        if error:
+            flash(error, "error")
+            return render_template("restaurantAdd.html")
+
+        # Check if restaurant name is already in db
+        restaurant_exists = Restaurant.query.filter_by(name=restaurant).first()
+        if restaurant_exists:
+            flash("Restaurant already exists.", "error")
+            return render_template("restaurantAdd.html")
+        # TODO: ADD BUTTON THAT REDIRECTS TO THE RESTAURANT RECORD
+
+        # ADD RESTAURANT TO DB
+        new_restaurant = Restaurant(name=restaurant, address=address, phone_number=phone, cuisine=cuisine, rating=rating)
+        # Existing tags are reused, new names are added to the vocabulary
+        new_restaurant.tags = tags_named(db.session, tags)
+
+        db.session.add(new_restaurant)
+        db.session.commit()
+        
+        # Flash message for success in registering
+        flash("Success! You added a new restaurant!", "success")
+
+        # Get id of newly created restaurant record
+        restaurant_id = new_restaurant.id
+
+        # SEND USER TO RESTAURANT HTML OF THE NEWLY CREATED RECORD
+        return redirect(url_for("restaurants.restaurant", restaurant_id=restaurant_id))
+
+    else:
+        return render_template("restaurantAdd.html")
+
+
+# BULK IMPORT
+@bp.route("/import", methods=["GET", "POST"])
+@login_required
+def import_data():
+    """
+    Import restaurants, meals or tags from an uploaded CSV or JSON Lines file.
+    - The upload is saved and imported by a background job, valid rows are inserted in batches.
+    - Answers 202 with the job status, its result is the report with the per-row errors and throughput.
+    """
+    if request.method == "POST":
+        # Only loaded by the workers that handle an import
+        from app.importer import format_for, KINDS, FORMATS
+
+        # Checked before the form is parsed: werkzeug spools big multipart files to disk
+        max_bytes = current_app.config["IMPORT_MAX_BYTES"]
+        if (request.content_length or 0) > max_bytes + current_app.config["UPLOAD_OVERHEAD_BYTES"]:
+            return jsonify(error=f"Imports can be at most {max_bytes // (1024 * 1024)} MB."), 413
+        upload = request.files.get("file")
+        kind = request.form.get("kind")
+        fmt = request.form.get("format") or None
+
+        if upload is None or not upload.filename:
+            return jsonify(error="Please choose a file to import."), 400
+        if kind not in KINDS:
+            return jsonify(error=f"Please choose what to import: {', '.join(KINDS)}."), 400
+        if fmt is not None and fmt not in FORMATS:
+            return jsonify(error=f"Format must be one of: {', '.join(FORMATS)}."), 400
+
+        # Copied to disk in chunks (never loaded into memory), the job removes it when the import is done
+        upload_dir = current_app.config["JOB_UPLOAD_DIR"]
+        os.makedirs(upload_dir, exist_ok=True)
+        path = os.path.join(upload_dir, f"{uuid.uuid4().hex}.{kind}")
+        upload.save(path)
+
+        job = jobs.enqueue("import", {"path": path, "kind": kind, "format": fmt or format_for(upload.filename)})
+        response = jsonify(jobs.describe(job))
+        response.headers["Location"] = url_for("api.job_status", job_id=job.id)
+        return response, 202
+
+    else:
+        return render_template("import.html")
+
+
+# EXPORT
+@bp.route("/export/<table>")
+@login_required
+def export_data(table):
+    """
+    Download a whole table (restaurants, meals, tags, restaurant_tags or people) as CSV or JSON Lines.
+    - ?format=csv|jsonl, ?gzip=1 to compress
+    - ?since_id=N for rows added after the last export (restaurant_tags is always exported in full),
+      ?since_date=YYYY-MM-DD for meals since a date
+    Rows are streamed in id order as they are read, the last id in the file is the next since_id.
+    """
+    # Only loaded by the workers that handle an export
+    from app.exporter import export_chunks, export_filename, MIMETYPES, TABLES
+
+    if table not in TABLES:
+        abort(404)
+    fmt = request.args.get("format", "csv")
+    compress = request.args.get("gzip") in ("1", "true")
+    try:
+        since_id = request.args.get("since_id")
+        since_id = int(since_id) if since_id else None
+        since_date = request.args.get("since_date")
+        since_date = datetime.strptime(since_date, "%Y-%m-%d").date() if since_date else None
+        chunks = export_chunks(table, fmt, compress, since_id, since_date)
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    filename = export_filename(table, fmt, compress)
+    return Response(chunks,
+                    mimetype="application/gzip" if compress else MIMETYPES[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+# LIST OF RESTAURANTS TAGGED FAVORITES
+@bp.route("/favorites", methods=["GET", "POST"])
+@login_required
+@cached_page(version=listing_version, tags=lambda: [LISTING_VERSION])
+def favorites():
+    """Show list of restaurants with the favorites tag, a page at a time"""
+    sort = request.args.get("sort") or None
+    try:
+        restaurants, next_cursor = list_restaurants(sort=sort, cursor=request.args.get("cursor"),
+                                                    limit=listing_page_size(), tags=[FAVORITES_TAG])
+    except ValueError:
+        # Cursor in the URL was not one we created
+        flash("Invalid page link, showing first page.", "error")
+        return redirect(url_for("restaurants.favorites", sort=sort))
+    return render_listing("favorites.html", restaurants, next_cursor=next_cursor, sort=sort)
+
+
+# RESTAURANTS THE USER MIGHT LIKE
+@bp.route("/recommendations")
+@login_required
+def recommendations():
+    """Show restaurants the user hasn't been to, picked from what people with similar meals liked"""
+    # Only loaded by the workers that serve recommendations (NumPy)
+    from app import recommend
+
+    if not recommend.available():
+        flash("Recommendations need NumPy (pip install -r requirements-recommend.txt).", "error")
+        return render_template("recommendations.html", restaurants=[])
+    picks = recommend.recommended_restaurants(current_user.person_id, limit=listing_page_size())
+    return render_template("recommendations.html", restaurants=[restaurant for restaurant, _ in picks])
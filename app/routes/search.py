@@ -0,0 +1,72 @@
+# Search routes
+
+# Third-party imports
+from flask import Blueprint, current_app, flash, render_template, request
+from flask_login import login_required
+
+# Local app imports
+from app.pagination import clamp_page_size
+from app.rendering import render_listing
+from app.search import search_restaurants
+from app.tagging import MAX_FILTER_TAGS, TAG_MODES, parse_tags, popular_tags
+from app.cache import cached_page, listing_version, LISTING_VERSION
+
+
+bp = Blueprint("search", __name__)
+
+
+# SEARCH FOR A RESTAURANT
+@bp.route("/search", methods=["GET", "POST"])
+@login_required
+@cached_page(version=listing_version, tags=lambda: [LISTING_VERSION])
+def search():
+    """
+    Dynamic search for restaurants.
+    Based on: 
+    - Name
+    - Cuisine
+    - Hours
+    - Ratings
+    - Tags
+    Sort by last visited date
+    """
+    # GET from the search box or POST from a form both read the same fields
+    query = request.values.get("q", "").strip()
+    cuisine = request.values.get("cuisine") or None
+    # Comma separated tag names (?tag= from older links is one name), matched all or any
+    tags = parse_tags(request.values.get("tags") or request.values.get("tag"))[:MAX_FILTER_TAGS]
+    tag_mode = request.values.get("tag_mode") if request.values.get("tag_mode") in TAG_MODES else "all"
+    min_rating = request.values.get("min_rating") or None
+    sort = request.values.get("sort") or None
+    cursor = request.values.get("cursor") or None
+    limit = clamp_page_size(request.values.get("limit"), current_app.config["SEARCH_PAGE_SIZE"], current_app.config["SEARCH_MAX_PAGE_SIZE"])
+
+    # Rating filter must be a number
+    if min_rating is not None:
+        try:
+            min_rating = int(min_rating)
+        except ValueError:
+            flash("Please select a valid minimum rating.", "error")
+            return render_template("search.html", restaurants=[], next_cursor=None, query=query, sort=sort)
+
+    try:
+        restaurants, next_cursor = search_restaurants(query=query, cuisine=cuisine, min_rating=min_rating,
+                                                      tags=tags, cursor=cursor, limit=limit, sort=sort,
+                                                      tag_mode=tag_mode)
+    except ValueError:
+        # Cursor in the URL was not one we created
+        flash("Invalid page link, showing first page.", "error")
+        restaurants, next_cursor = search_restaurants(query=query, cuisine=cuisine, min_rating=min_rating,
+                                                      tags=tags, limit=limit, sort=sort, tag_mode=tag_mode)
+
+    return render_listing("search.html",
+                          restaurants,
+                          next_cursor=next_cursor,
+                          query=query,
+                          cuisine=cuisine,
+                          min_rating=min_rating,
+                          tags=", ".join(tags),
+                          tag_mode=tag_mode,
+                          # Most used tags with their precomputed restaurant counts
+                          tag_cloud=popular_tags(current_app.config["TAG_CLOUD_SIZE"])[0],
+                          sort=sort)
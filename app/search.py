@@ -0,0 +1,353 @@
+# Full-text search over restaurants
+# - SQLite: FTS5 virtual table ranked with bm25()
+# - Other databases: token table with a (token, restaurant_id) index as a fallback
+# The index holds one document per restaurant and is kept in sync from SQLAlchemy session events
+
+# Standard library imports
+import difflib
+import re
+from datetime import date
+
+# Third-party imports
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, Float, Index, Integer, String, Table, event, func, or_, select, text
+from sqlalchemy.orm import contains_eager, joinedload
+
+# Local app imports
+from app import db
+from app.models import Restaurant, Meal, Tag, RestaurantStats, restaurant_tags
+from app.pagination import encode_cursor, decode_cursor, after_row, keyset_order
+from app.changes import touched_restaurants
+from app.tagging import parse_tags, tag_filter
+
+
+# FTS5 table, one row per restaurant with rowid = restaurants.id
+FTS_TABLE = "restaurant_search"
+# fts5vocab table listing every indexed term (used for typo correction)
+VOCAB_TABLE = "restaurant_search_vocab"
+
+# Column weights for ranking - a hit in the name counts more than a hit in a meal note
+WEIGHTS = {"name": 10.0, "address": 2.0, "cuisine": 4.0, "tags": 4.0, "notes": 1.0}
+
+# Restaurants are re-indexed in chunks so IN lists stay small
+REINDEX_CHUNK = 500
+
+# Only suggest corrections for terms at least this long, and only this many candidates per term
+MIN_TYPO_LENGTH = 3
+MAX_VOCAB_CANDIDATES = 5000
+
+# Fallback index for databases without FTS5
+search_tokens = Table(
+    "search_tokens",
+    db.metadata,
+    Column("token", String, nullable=False),
+    Column("restaurant_id", Integer, nullable=False),
+    Column("weight", Float, nullable=False),
+    Index("ix_search_tokens_token_restaurant", "token", "restaurant_id"),
+    Index("ix_search_tokens_restaurant", "restaurant_id"),
+)
+
+
+# Check which search backend the configured database supports
+def uses_fts(connection):
+    """True when the database is SQLite (FTS5), False for the token table fallback."""
+    return connection.dialect.name == "sqlite"
+
+
+# Split text into lowercase search terms
+def tokenize(value):
+    """Return the lowercase word tokens in a string."""
+    return re.findall(r"\w+", (value or "").lower())
+
+
+# CREATE INDEX TABLES
+def create_search_index(connection):
+    """
+    Create the search index tables if they are missing.
+    - Returns True if the index was just created and needs to be filled.
+    """
+    if not uses_fts(connection):
+        # search_tokens is created by db.create_all() - fill it if it is empty
+        return connection.execute(select(search_tokens.c.token).limit(1)).first() is None
+
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}
+    ).first()
+    if exists:
+        return False
+
+    # prefix='2 3' adds prefix indexes so "piz*" style queries don't scan the whole term list
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        "name, address, cuisine, tags, notes, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    connection.execute(text(f"CREATE VIRTUAL TABLE {VOCAB_TABLE} USING fts5vocab({FTS_TABLE}, 'row')"))
+    return True
+
+
+# BUILD INDEX DOCUMENTS
+def _load_documents(connection, restaurant_ids):
+    """Load the text that is indexed for each restaurant (restaurant_id -> dict)."""
+    docs = {}
+    rows = connection.execute(
+        select(Restaurant.id, Restaurant.name, Restaurant.address, Restaurant.cuisine)
+        .where(Restaurant.id.in_(restaurant_ids))
+    )
+    for row in rows:
+        docs[row.id] = {"name": row.name, "address": row.address or "", "cuisine": row.cuisine or "",
+                        "tags": [], "notes": []}
+
+    # Tag names and meal notes are gathered with one query each instead of one per restaurant
+    for restaurant_id, name in connection.execute(
+        select(restaurant_tags.c.restaurant_id, Tag.name).join(Tag, Tag.id == restaurant_tags.c.tag_id)
+        .where(restaurant_tags.c.restaurant_id.in_(restaurant_ids))
+    ):
+        if restaurant_id in docs:
+            docs[restaurant_id]["tags"].append(name)
+
+    for restaurant_id, notes in connection.execute(
+        select(Meal.restaurant_id, Meal.notes)
+        .where(Meal.restaurant_id.in_(restaurant_ids), Meal.notes.isnot(None))
+    ):
+        if restaurant_id in docs:
+            docs[restaurant_id]["notes"].append(notes)
+
+    for doc in docs.values():
+        doc["tags"] = " ".join(doc["tags"])
+        doc["notes"] = " ".join(doc["notes"])
+    return docs
+
+
+# KEEP INDEX IN SYNC
+def reindex_restaurants(connection, restaurant_ids):
+    """
+    Rebuild the index documents for the given restaurants.
+    - Restaurants that no longer exist are removed from the index.
+    """
+    restaurant_ids = sorted({rid for rid in restaurant_ids if rid is not None})
+    fts = uses_fts(connection)
+
+    for start in range(0, len(restaurant_ids), REINDEX_CHUNK):
+        chunk = restaurant_ids[start:start + REINDEX_CHUNK]
+        docs = _load_documents(connection, chunk)
+
+        if fts:
+            connection.execute(
+                text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({','.join(str(rid) for rid in chunk)})")
+            )
+            if docs:
+                connection.execute(
+                    text(f"INSERT INTO {FTS_TABLE} (rowid, name, address, cuisine, tags, notes) "
+                         "VALUES (:id, :name, :address, :cuisine, :tags, :notes)"),
+                    [dict(doc, id=rid) for rid, doc in docs.items()],
+                )
+        else:
+            connection.execute(search_tokens.delete().where(search_tokens.c.restaurant_id.in_(chunk)))
+            token_rows = []
+            for rid, doc in docs.items():
+                # Keep the best weight for each distinct token in the document
+                weights = {}
+                for field, weight in WEIGHTS.items():
+                    for token in tokenize(doc[field]):
+                        weights[token] = max(weights.get(token, 0.0), weight)
+                token_rows.extend({"token": tok, "restaurant_id": rid, "weight": w} for tok, w in weights.items())
+            if token_rows:
+                connection.execute(search_tokens.insert(), token_rows)
+
+
+# Rebuild the whole index, e.g. after creating it or to repair drift
+def rebuild_search_index(connection):
+    """Re-index every restaurant. Returns the number of restaurants indexed."""
+    if uses_fts(connection):
+        connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    else:
+        connection.execute(search_tokens.delete())
+    restaurant_ids = connection.execute(select(Restaurant.id)).scalars().all()
+    reindex_restaurants(connection, restaurant_ids)
+    return len(restaurant_ids)
+
+
+def prune_search_index(connection):
+    """Remove the documents of restaurants that no longer exist."""
+    if uses_fts(connection):
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid NOT IN (SELECT id FROM restaurants)"))
+    else:
+        connection.execute(search_tokens.delete().where(search_tokens.c.restaurant_id.not_in(select(Restaurant.id))))
+
+
+# Runs after every flush, inside the same transaction, so the index commits or rolls back with the data
+@event.listens_for(db.session, "after_flush")
+def sync_search_index(session, flush_context):
+    touched = touched_restaurants(session)
+    if touched:
+        reindex_restaurants(session.connection(), touched)
+
+
+# TYPO TOLERANCE
+def _vocabulary(connection, prefix, limit):
+    """Return indexed terms starting with prefix."""
+    # Terms between prefix and prefix + highest character all start with prefix
+    upper = prefix + "\uffff"
+    if uses_fts(connection):
+        stmt = text(f"SELECT term FROM {VOCAB_TABLE} WHERE term >= :lo AND term < :hi LIMIT :limit")
+        return connection.execute(stmt, {"lo": prefix, "hi": upper, "limit": limit}).scalars().all()
+    stmt = (select(search_tokens.c.token).distinct()
+            .where(search_tokens.c.token >= prefix, search_tokens.c.token < upper).limit(limit))
+    return connection.execute(stmt).scalars().all()
+
+
+def expand_terms(connection, query):
+    """
+    Turn a search string into a list of term groups.
+    - Every term is matched as a prefix ("piz" finds "pizza").
+    - A term with no prefix match is replaced by the closest indexed terms ("piza" finds "pizza").
+    """
+    groups = []
+    for term in tokenize(query):
+        if len(term) < MIN_TYPO_LENGTH or _vocabulary(connection, term, 1):
+            groups.append([term])
+            continue
+        # Misspelled terms usually keep their first letter
+        candidates = _vocabulary(connection, term[0], MAX_VOCAB_CANDIDATES)
+        close = difflib.get_close_matches(term, candidates, n=3, cutoff=0.75)
+        groups.append(close or [term])
+    return groups
+
+
+# RANKED MATCHES
+def _ranked_fts(groups):
+    """Subquery of (id, rank) from the FTS5 table, lower rank is better."""
+    # Every group must match (AND), any term inside a group may match (OR)
+    match = " AND ".join(
+        "(" + " OR ".join(f'"{term}"*' for term in group) + ")" for group in groups
+    )
+    weights = ", ".join(str(weight) for weight in WEIGHTS.values())
+    stmt = text(
+        f"SELECT rowid AS id, bm25({FTS_TABLE}, {weights}) AS rank "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+    ).bindparams(match=match)
+    return stmt.columns(id=Integer, rank=Float).subquery("ranked")
+
+
+def _ranked_tokens(groups):
+    """Subquery of (id, rank) from the token table, lower rank is better."""
+    def matches(group):
+        return or_(*(search_tokens.c.token.like(term + "%") for term in group))
+
+    stmt = (select(search_tokens.c.restaurant_id.label("id"),
+                   (-func.sum(search_tokens.c.weight)).label("rank"))
+            .where(or_(*(matches(group) for group in groups)))
+            .group_by(search_tokens.c.restaurant_id))
+    # Every group must match (AND)
+    for group in groups:
+        stmt = stmt.where(search_tokens.c.restaurant_id.in_(
+            select(search_tokens.c.restaurant_id).where(matches(group))
+        ))
+    return stmt.subquery("ranked")
+
+
+# SEARCH
+# Sort orders: best match first, most recently visited first, alphabetical, or best rated first
+SORTS = ("relevance", "last_visit", "name", "rating")
+
+
+def search_statement(connection, query=None, cuisine=None, min_rating=None, tags=None, after=None, limit=20,
+                     sort=None, tag_mode="all"):
+    """
+    Build the search SELECT of (Restaurant, sort key).
+    - Text matches default to best match first, browsing without text defaults to last visit.
+    - tags: normalized tag names, restaurants must have all of them (tag_mode "all") or one of them ("any")
+    - after: decoded cursor [sort key, restaurant id] of the previous page's last row
+    """
+    groups = expand_terms(connection, query) if query else []
+    if sort not in SORTS or (sort == "relevance" and not groups):
+        sort = "relevance" if groups else "last_visit"
+
+    stmt = select(Restaurant)
+    if groups:
+        ranked = _ranked_fts(groups) if uses_fts(connection) else _ranked_tokens(groups)
+        stmt = stmt.join(ranked, ranked.c.id == Restaurant.id)
+
+    descending = False
+    id_column = Restaurant.id
+    if sort == "relevance":
+        sort_key = ranked.c.rank
+    elif sort == "name":
+        sort_key = Restaurant.name
+    elif sort == "rating":
+        # Walks the (rating, id) index backwards, unrated restaurants last
+        sort_key = Restaurant.rating
+        descending = True
+    else:
+        # Last visit comes from the precomputed statistics (every restaurant has a row)
+        # Ordering by the statistics' own columns lets the database walk the (last_visit, restaurant_id) index
+        sort_key = RestaurantStats.last_visit
+        id_column = RestaurantStats.restaurant_id
+        descending = True
+        stmt = stmt.join(Restaurant.stats)
+
+    # Load the precomputed statistics with each restaurant instead of one query per row
+    if sort == "last_visit":
+        stmt = stmt.options(contains_eager(Restaurant.stats))
+    else:
+        stmt = stmt.options(joinedload(Restaurant.stats))
+    stmt = stmt.add_columns(sort_key)
+
+    # Facet filters
+    if cuisine:
+        stmt = stmt.where(Restaurant.cuisine == cuisine)
+    if min_rating is not None:
+        stmt = stmt.where(Restaurant.rating >= min_rating)
+    if tags:
+        stmt = stmt.where(tag_filter(tags, tag_mode))
+
+    # Continue after the last row of the previous page
+    if after:
+        last_key, last_id = after
+        if sort == "last_visit" and last_key is not None:
+            last_key = date.fromisoformat(last_key)
+        stmt = stmt.where(after_row(sort_key, id_column, last_key, last_id, descending))
+
+    # Fetch one extra row to know if there is another page
+    return stmt.order_by(*keyset_order(sort_key, id_column, descending)).limit(limit + 1)
+
+
+def search_restaurants(query=None, cuisine=None, min_rating=None, tags=None, cursor=None, limit=20, sort=None,
+                       tag_mode="all"):
+    """
+    Search restaurants by text and facet filters.
+    - query: words matched against name, address, cuisine, tags and meal notes
+    - cuisine, min_rating, tags: optional filters combined with AND
+    - tags: tag names (a list or comma separated), all of them or any of them (tag_mode "all" / "any")
+    - sort: "relevance", "last_visit", "name" or "rating"
+    - cursor: token from a previous page (keyset pagination, no OFFSET)
+    Returns (list of Restaurant, next page cursor or None).
+    """
+    try:
+        after = decode_cursor(cursor) if cursor else None
+        stmt = search_statement(db.session.connection(), query, cuisine, min_rating, parse_tags(tags), after, limit,
+                                sort, tag_mode)
+    except (TypeError, ValueError) as error:
+        raise ValueError("Invalid cursor") from error
+
+    rows = db.session.execute(stmt).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_restaurant, last_key = rows[-1]
+        next_cursor = encode_cursor(last_key, last_restaurant.id)
+
+    return [row[0] for row in rows], next_cursor
+
+
+# Command line: flask --app run rebuild-search
+@click.command("rebuild-search")
+@with_appcontext
+def rebuild_search_command():
+    """Rebuild the restaurant search index."""
+    with db.engine.begin() as connection:
+        create_search_index(connection)
+        count = rebuild_search_index(connection)
+    click.echo(f"Indexed {count} restaurants.")
@@ -0,0 +1,302 @@
+# Precomputed statistics - per restaurant (meal count, average price, last visit), per person per month
+# (meals, visits, spend) and per visit (person, restaurant and day: meals, spend, cheapest and dearest meal, read by
+# app/analytics.py). Kept up to date incrementally from SQLAlchemy session events instead of running GROUP BY
+# over the whole meals table on every request.
+
+# Standard library imports
+from collections import defaultdict
+
+# Third-party imports
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, case, event, func, insert, literal, select, tuple_, update
+
+# Local app imports
+from app import db
+from app import cache
+from app.models import Restaurant, Meal, RestaurantStats, PersonMonthStats, VisitDayStats, DataVersion
+
+
+# Keys per IN query when reading existing statistics rows and meal counts
+STATS_CHUNK = 300
+
+
+# Month key used by PersonMonthStats ('YYYY-MM')
+def month_of(day):
+    return day.strftime("%Y-%m")
+
+
+def _month_expr(connection):
+    """SQL expression for the 'YYYY-MM' month of Meal.date on the current database."""
+    if connection.dialect.name == "sqlite":
+        return func.strftime("%Y-%m", Meal.date)
+    return func.to_char(Meal.date, "YYYY-MM")
+
+
+# Values of a meal that the statistics depend on
+def _meal_values(meal):
+    """(restaurant_id, person_id, date, price) of a meal."""
+    return meal.restaurant_id, meal.person_id, meal.date, meal.price
+
+
+# SESSION EVENTS
+# before_flush: remember the stored values of meals that are about to be deleted or changed
+@event.listens_for(db.session, "before_flush")
+def capture_removed_meals(session, flush_context, instances):
+    removed_ids = [obj.id for obj in session.deleted if isinstance(obj, Meal)]
+    changed = [obj for obj in session.dirty if isinstance(obj, Meal) and session.is_modified(obj)]
+    if not removed_ids and not changed:
+        return
+
+    # Read the old values from the database in one query (they haven't been overwritten yet)
+    ids = removed_ids + [obj.id for obj in changed]
+    removed = session.info.setdefault("stats_removed", [])
+    for start in range(0, len(ids), 500):
+        removed.extend(tuple(row) for row in session.execute(
+            select(Meal.restaurant_id, Meal.person_id, Meal.date, Meal.price)
+            .where(Meal.id.in_(ids[start:start + 500]))
+        ))
+    session.info.setdefault("stats_changed", []).extend(changed)
+
+
+# after_flush: ids and new values are known, apply the changes to the statistics in the same transaction
+@event.listens_for(db.session, "after_flush")
+def apply_meal_changes(session, flush_context):
+    removed = session.info.pop("stats_removed", [])
+    changed = session.info.pop("stats_changed", [])
+    added = [_meal_values(obj) for obj in session.new if isinstance(obj, Meal)]
+    added += [_meal_values(obj) for obj in changed if obj not in session.deleted]
+
+    connection = session.connection()
+    new_restaurants = [obj.id for obj in session.new if isinstance(obj, Restaurant)]
+    if new_restaurants:
+        create_restaurant_rows(connection, new_restaurants)
+    if added or removed:
+        apply_meal_deltas(connection, added, removed)
+
+    # Remove the statistics of deleted restaurants (after their meals were subtracted above)
+    deleted_restaurants = [obj.id for obj in session.deleted if isinstance(obj, Restaurant)]
+    if deleted_restaurants:
+        connection.execute(RestaurantStats.__table__.delete()
+                           .where(RestaurantStats.restaurant_id.in_(deleted_restaurants)))
+
+
+# Forget captured values if the flush failed and the transaction is rolled back
+@event.listens_for(db.session, "after_rollback")
+def discard_captured_meals(session):
+    session.info.pop("stats_removed", None)
+    session.info.pop("stats_changed", None)
+
+
+# INCREMENTAL UPDATES
+def create_restaurant_rows(connection, restaurant_ids):
+    """Add empty statistics rows for new restaurants."""
+    connection.execute(insert(RestaurantStats.__table__),
+                       [{"restaurant_id": rid, "meal_count": 0, "price_total": 0.0, "price_count": 0}
+                        for rid in restaurant_ids])
+
+
+def _add_deltas(connection, table, key_columns, deltas):
+    """
+    Add deltas to statistics rows, inserting the rows that don't exist yet.
+    - deltas: {key tuple: {column: delta}}, every entry has the same columns
+    One IN query finds the existing rows per chunk and one executemany updates them all.
+    """
+    keys = list(deltas)
+    if not keys:
+        return
+    columns = [table.c[name] for name in key_columns]
+    existing = set()
+    for start in range(0, len(keys), STATS_CHUNK):
+        chunk = keys[start:start + STATS_CHUNK]
+        where = tuple_(*columns).in_(chunk) if len(columns) > 1 else columns[0].in_([key[0] for key in chunk])
+        existing.update(tuple(row) for row in connection.execute(select(*columns).where(where)))
+
+    missing = [key for key in keys if key not in existing]
+    if missing:
+        connection.execute(insert(table), [dict(zip(key_columns, key), **deltas[key]) for key in missing])
+
+    present = [key for key in keys if key in existing]
+    if present:
+        names = list(deltas[present[0]])
+        # Bound parameter names must differ from the column names in an UPDATE
+        connection.execute(
+            update(table)
+            .where(*(column == bindparam(f"key_{column.name}") for column in columns))
+            .values({name: table.c[name] + bindparam(f"delta_{name}") for name in names}),
+            [{**{f"key_{name}": value for name, value in zip(key_columns, key)},
+              **{f"delta_{name}": deltas[key][name] for name in names}} for key in present]
+        )
+
+
+# Columns of a visit day row computed from the meals of one (person, restaurant, day)
+def _visit_day_columns():
+    return (func.count(), func.count(Meal.price), func.coalesce(func.sum(Meal.price), literal(0.0)),
+            func.min(Meal.price), func.max(Meal.price))
+
+
+VISIT_DAY_FIELDS = ("meal_count", "price_count", "price_total", "price_min", "price_max")
+
+
+def visits_in(person_id, restaurant_id, day, visits):
+    """
+    WHERE clause for the (person, restaurant, date) keys in visits.
+    - The IN lists on person and date let SQLite search the (person_id, date, ...) indexes, it doesn't for a row
+      value IN on its own (it walks the whole index)
+    """
+    return (person_id.in_({visit[0] for visit in visits}), day.in_({visit[2] for visit in visits}),
+            tuple_(person_id, restaurant_id, day).in_(visits))
+
+
+def _visit_days(connection, visits):
+    """Visit day values per (person, restaurant, date) for the given keys after the flush, None without meals."""
+    days = dict.fromkeys(visits)
+    columns = (Meal.person_id, Meal.restaurant_id, Meal.date)
+    for start in range(0, len(visits), STATS_CHUNK):
+        chunk = visits[start:start + STATS_CHUNK]
+        for row in connection.execute(
+            select(*columns, *_visit_day_columns()).where(*visits_in(*columns, chunk)).group_by(*columns)
+        ):
+            days[tuple(row[:3])] = dict(zip(VISIT_DAY_FIELDS, row[3:]))
+    return days
+
+
+def _replace_visit_days(connection, days):
+    """Write the recomputed visit day rows, removing the days left without meals."""
+    table = VisitDayStats.__table__
+    keys = list(days)
+    for start in range(0, len(keys), STATS_CHUNK):
+        chunk = keys[start:start + STATS_CHUNK]
+        connection.execute(table.delete().where(
+            *visits_in(table.c.person_id, table.c.restaurant_id, table.c.date, chunk)
+        ))
+        rows = [dict(zip(("person_id", "restaurant_id", "date"), key), **days[key]) for key in chunk if days[key]]
+        if rows:
+            connection.execute(insert(table), rows)
+
+
+def apply_meal_deltas(connection, added, removed):
+    """
+    Update the statistics for meals added and removed by a flush or a bulk import.
+    - added / removed: lists of (restaurant_id, person_id, date, price)
+    - An updated meal is one removal (old values) plus one addition (new values).
+    The number of statements doesn't grow with the number of meals (executemany and chunked IN queries).
+    """
+    restaurants = defaultdict(lambda: {"meal_count": 0, "price_total": 0.0, "price_count": 0})
+    months = defaultdict(lambda: {"meal_count": 0, "price_total": 0.0, "visit_count": 0})
+    visits = defaultdict(int)  # (person, restaurant, date) -> meals added minus meals removed
+    latest = {}  # restaurant -> newest date added
+    recheck_latest = set()  # restaurants whose last visit may have been removed
+
+    for sign, meals in ((1, added), (-1, removed)):
+        for restaurant_id, person_id, day, price in meals:
+            totals = restaurants[(restaurant_id,)]
+            totals["meal_count"] += sign
+            if price is not None:
+                totals["price_total"] += sign * price
+                totals["price_count"] += sign
+            month = months[(person_id, month_of(day))]
+            month["meal_count"] += sign
+            month["price_total"] += sign * (price or 0.0)
+            visits[(person_id, restaurant_id, day)] += sign
+            if sign > 0:
+                latest[restaurant_id] = max(day, latest.get(restaurant_id, day))
+            else:
+                recheck_latest.add(restaurant_id)
+
+    stats = RestaurantStats.__table__
+    _add_deltas(connection, stats, ("restaurant_id",), restaurants)
+
+    if recheck_latest:
+        # A removed meal may have been the latest one - look it up again (uses the restaurant_id, date index)
+        newest = select(func.max(Meal.date)).where(Meal.restaurant_id == bindparam("rid")).scalar_subquery()
+        connection.execute(update(stats).where(stats.c.restaurant_id == bindparam("rid")).values(last_visit=newest),
+                           [{"rid": rid} for rid in recheck_latest])
+    moved_forward = [{"rid": rid, "day": day} for rid, day in latest.items() if rid not in recheck_latest]
+    if moved_forward:
+        day = bindparam("day", type_=Meal.date.type)
+        connection.execute(
+            update(stats).where(stats.c.restaurant_id == bindparam("rid"))
+            .values(last_visit=case((stats.c.last_visit.is_(None), day),
+                                    (stats.c.last_visit < day, day),
+                                    else_=stats.c.last_visit)),
+            moved_forward
+        )
+
+    # Visit days with a meal added, removed or changed are recomputed from their meals (a handful each).
+    # A visit starts when a day at a restaurant gets its first meal, and ends when it loses its last
+    days = _visit_days(connection, list(visits))
+    for key, net in visits.items():
+        if net:
+            after = days[key]["meal_count"] if days[key] else 0
+            before = after - net
+            person_id, _, day = key
+            months[(person_id, month_of(day))]["visit_count"] += (after > 0) - (before > 0)
+
+    _add_deltas(connection, PersonMonthStats.__table__, ("person_id", "month"), months)
+    _replace_visit_days(connection, days)
+    # Cached analytics of these people are out of date (in every worker)
+    cache.bump_person_versions(connection, [person_id for person_id, _, _ in visits])
+
+
+# FULL REBUILD
+def rebuild_stats(connection):
+    """Recompute both statistics tables from the meals table (repairs any drift)."""
+    connection.execute(RestaurantStats.__table__.delete())
+    connection.execute(PersonMonthStats.__table__.delete())
+
+    # Every restaurant gets a row, restaurants without meals get zeros
+    connection.execute(insert(RestaurantStats.__table__).from_select(
+        ["restaurant_id", "meal_count", "price_total", "price_count", "last_visit"],
+        select(Restaurant.id, func.count(Meal.id), func.coalesce(func.sum(Meal.price), literal(0.0)),
+               func.count(Meal.price), func.max(Meal.date))
+        .outerjoin(Meal, Meal.restaurant_id == Restaurant.id)
+        .group_by(Restaurant.id)
+    ))
+
+    month = _month_expr(connection)
+    rows = {}
+    for person_id, month_key, meal_count, price_total in connection.execute(
+        select(Meal.person_id, month, func.count(), func.coalesce(func.sum(Meal.price), literal(0.0)))
+        .group_by(Meal.person_id, month)
+    ):
+        rows[(person_id, month_key)] = {"person_id": person_id, "month": month_key, "meal_count": meal_count,
+                                        "price_total": price_total, "visit_count": 0}
+
+    # Visits are distinct (person, restaurant, day) combinations
+    days = (select(Meal.person_id, Meal.restaurant_id, Meal.date, month.label("month"))
+            .distinct().subquery())
+    for person_id, month_key, visit_count in connection.execute(
+        select(days.c.person_id, days.c.month, func.count()).group_by(days.c.person_id, days.c.month)
+    ):
+        rows[(person_id, month_key)]["visit_count"] = visit_count
+
+    if rows:
+        connection.execute(insert(PersonMonthStats.__table__), list(rows.values()))
+    rebuild_visit_days(connection)
+    return len(rows)
+
+
+def rebuild_visit_days(connection):
+    """Recompute the visit day table from the meals table."""
+    table = VisitDayStats.__table__
+    connection.execute(table.delete())
+    columns = (Meal.person_id, Meal.restaurant_id, Meal.date)
+    connection.execute(insert(table).from_select(
+        ["person_id", "restaurant_id", "date", *VISIT_DAY_FIELDS],
+        select(*columns, *_visit_day_columns()).group_by(*columns)
+    ))
+    # Every person's cached analytics are out of date
+    versions = DataVersion.__table__
+    connection.execute(update(versions).where(versions.c.name.like(cache.person_version_name("%")))
+                       .values(version=versions.c.version + 1))
+
+
+# Command line: flask --app run rebuild-stats
+@click.command("rebuild-stats")
+@with_appcontext
+def rebuild_stats_command():
+    """Recompute the restaurant and person statistics tables."""
+    with db.engine.begin() as connection:
+        months = rebuild_stats(connection)
+    click.echo(f"Rebuilt restaurant statistics and {months} person-month rows.")
@@ -0,0 +1,167 @@
+# Tags - a vocabulary of tag names (tags) linked to restaurants through restaurant_tags
+# - Names are normalized (trimmed, single spaces, lower case): "Date Night " and "date night" are one tag
+# - tags.restaurant_count is kept up to date on every change - by session events for ORM writes and by
+#   apply_tag_deltas() for Core bulk writes - so tag clouds and facet counts never GROUP BY at request time
+# - Multi-tag filters (all of / any of) are EXISTS lookups on the restaurant_tags primary key
+
+# Standard library imports
+from collections import Counter
+from itertools import chain
+
+# Third-party imports
+from sqlalchemy import and_, bindparam, event, exists, func, insert, select, update
+
+# Local app imports
+from app import db
+from app.models import Restaurant, Tag, restaurant_tags
+from app.pagination import after_row, encode_cursor, decode_cursor, keyset_order
+
+
+# Filter modes: restaurants with all of the tags, or with any of them
+TAG_MODES = ("all", "any")
+# Most tags a filter can combine (each one is a lookup per candidate restaurant)
+MAX_FILTER_TAGS = 10
+
+
+# NAMES
+def normalize_tag(name):
+    """Stored form of a tag name ('' for a blank name)."""
+    return " ".join(str(name).split()).lower() if name is not None else ""
+
+
+def parse_tags(value):
+    """Normalized tag names from a comma separated string or a list, without duplicates or blanks."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    names = []
+    for name in map(normalize_tag, value):
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def tags_named(session, names):
+    """Tag objects for the names (normalized), creating and adding the ones that don't exist yet."""
+    names = parse_tags(names)
+    if not names:
+        return []
+    # Tags created earlier in this unit of work, then the stored ones. No autoflush: a half-built object
+    # (e.g. the new restaurant getting these tags) must not be flushed by the lookup
+    existing = {obj.name: obj for obj in session.new if isinstance(obj, Tag) and obj.name in names}
+    with session.no_autoflush:
+        existing.update((tag.name, tag) for tag in session.scalars(select(Tag).where(Tag.name.in_(names))))
+    for name in names:
+        if name not in existing:
+            existing[name] = Tag(name=name)
+            session.add(existing[name])
+    return [existing[name] for name in names]
+
+
+def tag_ids(connection, names):
+    """{name: id} for the (normalized) names, inserting the missing names into the vocabulary (Core)."""
+    names = parse_tags(names)
+    if not names:
+        return {}
+    ids = dict(connection.execute(select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+    missing = [name for name in names if name not in ids]
+    if missing:
+        connection.execute(insert(Tag.__table__), [{"name": name, "restaurant_count": 0} for name in missing])
+        ids.update(connection.execute(select(Tag.name, Tag.id).where(Tag.name.in_(missing))).all())
+    return ids
+
+
+# FILTERS
+def tag_filter(names, mode="all"):
+    """
+    WHERE clause for restaurants that have all (or any) of the tag names.
+    - all: one EXISTS per tag, each a primary key lookup in restaurant_tags
+    - any: one EXISTS over the tags' ids
+    """
+    links = restaurant_tags.c
+    if mode == "any":
+        return exists().where(links.restaurant_id == Restaurant.id,
+                              links.tag_id.in_(select(Tag.id).where(Tag.name.in_(names))))
+    return and_(*(
+        exists().where(links.restaurant_id == Restaurant.id,
+                       links.tag_id == select(Tag.id).where(Tag.name == name).scalar_subquery())
+        for name in names
+    ))
+
+
+# TAG CLOUD
+def popular_tags(limit=20, cursor=None):
+    """
+    Tags used by at least one restaurant, most used first, with their precomputed restaurant counts.
+    - cursor: token from the previous page (keyset pagination on (restaurant_count, id))
+    Returns (list of Tag, next page cursor or None), raises ValueError on a bad cursor.
+    """
+    stmt = select(Tag).where(Tag.restaurant_count > 0)
+    if cursor:
+        try:
+            last_count, last_id = decode_cursor(cursor)
+        except (TypeError, ValueError) as error:
+            raise ValueError("Invalid cursor") from error
+        stmt = stmt.where(after_row(Tag.restaurant_count, Tag.id, last_count, last_id, descending=True))
+    tags = db.session.scalars(
+        stmt.order_by(*keyset_order(Tag.restaurant_count, Tag.id, descending=True)).limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(tags) > limit:
+        tags = tags[:limit]
+        next_cursor = encode_cursor(tags[-1].restaurant_count, tags[-1].id)
+    return tags, next_cursor
+
+
+# COUNTS
+def apply_tag_deltas(connection, deltas):
+    """Add {tag_id: change in number of restaurants} to tags.restaurant_count."""
+    deltas = {tag_id: delta for tag_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    connection.execute(
+        update(Tag.__table__).where(Tag.id == bindparam("tag_id"))
+        .values(restaurant_count=Tag.restaurant_count + bindparam("delta")),
+        [{"tag_id": tag_id, "delta": delta} for tag_id, delta in deltas.items()],
+    )
+
+
+def rebuild_tag_counts(connection):
+    """Recount the restaurants of every tag (repairs any drift)."""
+    connection.execute(update(Tag.__table__).values(restaurant_count=(
+        select(func.count()).where(restaurant_tags.c.tag_id == Tag.id).scalar_subquery()
+    )))
+
+
+# SESSION EVENTS
+# before_flush: remember the tags of restaurants that are about to be deleted (their links go with them)
+@event.listens_for(db.session, "before_flush")
+def capture_removed_links(session, flush_context, instances):
+    removed = [tag.id for obj in session.deleted if isinstance(obj, Restaurant) for tag in obj.tags
+               if tag.id is not None]
+    if removed:
+        session.info.setdefault("tags_removed", []).extend(removed)
+
+
+# after_flush: links are written and new tags have ids, update the counts in the same transaction
+@event.listens_for(db.session, "after_flush")
+def count_tag_changes(session, flush_context):
+    deltas = Counter()
+    for tag_id in session.info.pop("tags_removed", []):
+        deltas[tag_id] -= 1
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Restaurant) and obj not in session.deleted:
+            history = db.inspect(obj).attrs.tags.history
+            for tag in history.added or ():
+                deltas[tag.id] += 1
+            for tag in history.deleted or ():
+                if tag not in session.deleted:
+                    deltas[tag.id] -= 1
+    apply_tag_deltas(session.connection(), deltas)
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard_removed_links(session):
+    session.info.pop("tags_removed", None)
@@ -0,0 +1,74 @@
+# Validation rules shared by the forms and the bulk importer
+# Each function returns an error message for the user, or None if the values are valid
+
+# Standard library imports
+import math
+from datetime import date
+
+
+def clean_text(value):
+    """Field value as a stripped string, None when missing or empty (forms and CSV give '' and JSON may give numbers)."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+# Restaurant fields (same rules as the Add Restaurant form)
+def restaurant_error(name, phone, cuisine, rating):
+    """Check a new restaurant's fields."""
+    # Name is required
+    if not name:
+        return "Please enter name of restaurant"
+    # Phone number is optional, but if entered, ensure phone number is string between 11 and 14 chars
+    if phone:
+        if len(phone) < 11 or len(phone) > 14:
+            return "Please enter a valid phone number."
+    # Address is optional
+    # Ensure cuisine is selected
+    if not cuisine:
+        return "Please select cuisne type for restaurant."
+    # Ensure rating is selected
+    if not rating:
+        return "Please select a rating for this restaurant"
+    # Rating is stored as a number of stars
+    try:
+        int(rating)
+    except (TypeError, ValueError):
+        return "Rating must be a whole number of stars."
+    return None
+
+
+# Meal price: optional, a finite amount of zero or more
+def parse_price(price):
+    """Price as a float, None when not entered. ValueError if it isn't a number, is negative, nan or infinite."""
+    if price in (None, ""):
+        return None
+    try:
+        value = float(price)
+    except TypeError:
+        raise ValueError(f"Not a price: {price!r}") from None
+    # float() accepts "nan" and "inf", and every comparison with nan is False
+    if not (math.isfinite(value) and value >= 0):
+        raise ValueError(f"Not a price: {price!r}")
+    return value
+
+
+# Meal fields
+def meal_error(name, day, price):
+    """Check a new meal's fields (day as an ISO date string or date, price optional)."""
+    if not name:
+        return "Please enter a name for the meal."
+    if not day:
+        return "Please enter the date of the meal."
+    if isinstance(day, str):
+        try:
+            date.fromisoformat(day)
+        except ValueError:
+            return "Please enter the date as YYYY-MM-DD."
+    # Price is optional, but must be a positive number if entered
+    try:
+        parse_price(price)
+    except ValueError:
+        return "Please enter a valid price for the meal"
+    return None
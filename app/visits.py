@@ -0,0 +1,141 @@
+# Logging a visit - the meals several people ate at one restaurant on one day, entered together
+# - Every meal is checked before anything is written (same rules as the importer, app/validation.py)
+# - People are found by id or name with one IN query, meals already logged for the visit with one more
+# - All the meals (and any new people) are inserted in one transaction, with one flush: the statistics, search
+#   index and page versions are updated by the session events in the same transaction
+
+# Standard library imports
+from datetime import date
+
+# Third-party imports
+from sqlalchemy import or_, select, tuple_
+
+# Local app imports
+from app import db
+from app.models import People, Meal
+from app.validation import meal_error, clean_text, parse_price
+
+
+# Most meals in one visit
+MAX_VISIT_MEALS = 50
+
+
+# Raised when any meal of a visit is invalid (nothing was saved)
+class VisitError(Exception):
+    """errors: list of (meal number from 1, or 0 for the whole visit, message)."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(message for _, message in errors))
+        self.errors = errors
+
+
+def _person_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def add_visit(restaurant_id, day, meals, default_person_id=None):
+    """
+    Add the meals of one visit to a restaurant in one transaction. Returns the ids of the new meals, in order.
+    - day: date or 'YYYY-MM-DD' shared by every meal (today if empty)
+    - meals: dicts with name, price, rating, notes and who ate it: person_id, or person (a name - names not in
+      people yet are added), or nobody for default_person_id
+    Raises VisitError listing every invalid meal, or a meal that is already logged for that day.
+    """
+    if not meals:
+        raise VisitError([(0, "Please enter at least one meal.")])
+    if len(meals) > MAX_VISIT_MEALS:
+        raise VisitError([(0, f"A visit can have at most {MAX_VISIT_MEALS} meals.")])
+
+    day = day or date.today()
+    if isinstance(day, str):
+        error = meal_error("-", day, None)
+        if error:
+            raise VisitError([(0, error)])
+        day = date.fromisoformat(day)
+
+    errors = []
+    rows = []
+    for number, meal in enumerate(meals, start=1):
+        name = clean_text(meal.get("name"))
+        price = clean_text(meal.get("price"))
+        error = meal_error(name, day, price)
+        if error:
+            errors.append((number, error))
+            continue
+        person_id = meal.get("person_id")
+        person_name = clean_text(meal.get("person"))
+        if person_id not in (None, ""):
+            person_id = _person_id(person_id)
+            if person_id is None:
+                errors.append((number, "Person id must be a number."))
+                continue
+        elif person_name is None:
+            person_id = default_person_id
+            if person_id is None:
+                errors.append((number, "Please enter who had this meal."))
+                continue
+        else:
+            person_id = None
+        rows.append((number, {"name": name, "price": parse_price(price),
+                              "rating": clean_text(meal.get("rating")), "notes": clean_text(meal.get("notes")),
+                              "person_id": person_id, "person": person_name}))
+
+    # People by id or name, one query. Names aren't unique in people - the oldest person with a name wins
+    ids = {row["person_id"] for _, row in rows if row["person_id"] is not None}
+    names = {row["person"] for _, row in rows if row["person_id"] is None}
+    known_ids, people_by_name = set(), {}
+    if ids or names:
+        for person_id, name in db.session.execute(
+            select(People.id, People.name).where(or_(People.id.in_(ids), People.name.in_(names))).order_by(People.id)
+        ):
+            known_ids.add(person_id)
+            people_by_name.setdefault(name, person_id)
+
+    seen = set()
+    for number, row in rows:
+        if row["person_id"] is None:
+            row["person_id"] = people_by_name.get(row["person"])
+        elif row["person_id"] not in known_ids:
+            errors.append((number, f"Unknown person id {row['person_id']}."))
+            continue
+        # A new person has no id yet, their name stands in for it
+        key = (row["person_id"] or row["person"], row["name"])
+        if key in seen:
+            errors.append((number, "This meal is listed twice."))
+        seen.add(key)
+
+    # Meals already logged for the visit, one query (uses the restaurant_id, date index)
+    keys = [(row["person_id"], row["name"]) for _, row in rows if row["person_id"] is not None]
+    if keys:
+        logged = set(db.session.execute(
+            select(Meal.person_id, Meal.name)
+            .where(Meal.restaurant_id == restaurant_id, Meal.date == day, tuple_(Meal.person_id, Meal.name).in_(keys))
+        ).all())
+        errors += [(number, "This meal is already logged for that day.") for number, row in rows
+                   if (row["person_id"], row["name"]) in logged]
+
+    if errors:
+        raise VisitError(sorted(errors))
+
+    new_people = {}
+    new_meals = []
+    for _, row in rows:
+        meal = Meal(restaurant_id=restaurant_id, date=day, name=row["name"], price=row["price"],
+                    rating=row["rating"], notes=row["notes"])
+        if row["person_id"] is not None:
+            meal.person_id = row["person_id"]
+        else:
+            if row["person"] not in new_people:
+                new_people[row["person"]] = People(name=row["person"])
+            meal.person = new_people[row["person"]]
+        new_meals.append(meal)
+
+    db.session.add_all(new_meals)
+    db.session.flush()
+    # Read before the commit expires the objects
+    meal_ids = [meal.id for meal in new_meals]
+    db.session.commit()
+    return meal_ids
@@ -0,0 +1,159 @@
+# Benchmark: "near me" lookups (app/geo.py) at 1M restaurants
+# Run from the project folder:  python -m benchmarks.bench_geo [--restaurants 1000000] [--seconds 1]
+#                                   [--output results.json] [--baseline baseline.json]
+# - Its own database of restaurants only (no meals), generated on first use and reused: CITIES metro areas with
+#   most restaurants near the centre, plus some spread over the whole map
+# - Lookups are around random points near the city centres (where the restaurants are densest)
+# - rtree: the R*Tree the app uses on SQLite, latlon_index: the (latitude, longitude) index used on other
+#   databases, full_scan: the same box without any index (the cost of not having one, fewer runs)
+# Each lookup returns the closest 20 restaurants loaded with their statistics, like GET /api/restaurants/nearby
+
+# Standard library imports
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Third-party imports
+from sqlalchemy import func, insert, select, text
+
+# Local app imports
+from app import create_app, db, geo, queries
+from app.migrations import init_db
+from app.models import Restaurant
+from app.stats import rebuild_stats
+from benchmarks import report
+from benchmarks.bench_queries import Benchmark, measure
+from benchmarks.datagen import BATCH_SIZE, CUISINES, DEFAULT_SEED, STREETS, restaurant_name
+
+# (latitude, longitude) of the metro areas, and how far restaurants spread from the centre (km, one sigma)
+CITIES = [(40.7128, -74.0060), (34.0522, -118.2437), (41.8781, -87.6298), (29.7604, -95.3698),
+          (33.4484, -112.0740), (39.9526, -75.1652), (29.4241, -98.4936), (32.7157, -117.1611),
+          (32.7767, -96.7970), (37.7749, -122.4194), (47.6062, -122.3321), (25.7617, -80.1918),
+          (42.3601, -71.0589), (39.7392, -104.9903), (45.5152, -122.6784), (36.1627, -86.7816)]
+CITY_SPREAD_KM = 8
+# Share of restaurants anywhere on the map (continental US box)
+RURAL_SHARE = 0.1
+MAP = (25.0, -125.0, 49.0, -67.0)
+
+
+def _restaurant_rows(rng, restaurants):
+    for number in range(1, restaurants + 1):
+        if rng.random() < RURAL_SHARE:
+            latitude, longitude = rng.uniform(MAP[0], MAP[2]), rng.uniform(MAP[1], MAP[3])
+        else:
+            latitude, longitude = rng.choice(CITIES)
+            latitude += rng.gauss(0, CITY_SPREAD_KM) / geo.KM_PER_DEGREE
+            longitude += rng.gauss(0, CITY_SPREAD_KM) / (geo.KM_PER_DEGREE * math.cos(math.radians(latitude)))
+        yield {"id": number, "name": restaurant_name(number),
+               "address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}", "cuisine": rng.choice(CUISINES),
+               "rating": rng.randint(1, 5), "latitude": round(latitude, 6), "longitude": round(longitude, 6)}
+
+
+def location_app(restaurants, seed, path=None):
+    """App bound to the location benchmark database, generated first if it is missing."""
+    path = path or os.path.join(tempfile.gettempdir(), f"restaurants-geo-{restaurants}-{seed}.db")
+    app = create_app(overrides={"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.abspath(path),
+                                "SQLALCHEMY_ENGINE_OPTIONS": {}})
+    with app.app_context():
+        init_db()
+        with db.engine.connect() as connection:
+            count = connection.execute(select(func.count()).select_from(Restaurant.__table__)).scalar()
+        if count != restaurants:
+            if count:
+                raise SystemExit(f"{path} holds {count} restaurants, not {restaurants} - delete it first")
+            start = time.perf_counter()
+            rng = random.Random(seed)
+            with db.engine.begin() as connection:
+                rows = _restaurant_rows(rng, restaurants)
+                while batch := [row for _, row in zip(range(BATCH_SIZE), rows)]:
+                    connection.execute(insert(Restaurant.__table__), batch)
+                rebuild_stats(connection)
+                geo.rebuild_location_index(connection)
+                connection.execute(text("ANALYZE"))
+            print(f"Generated {restaurants} restaurants in {time.perf_counter() - start:.1f} s: {path}")
+    return app
+
+
+def closest(statement, latitude, longitude, radius_km, limit=20):
+    """The app's lookup with another candidate query: distances, the closest `limit` loaded with statistics."""
+    found = []
+    for restaurant_id, lat, lon in db.session.execute(statement):
+        distance = geo.distance_km(latitude, longitude, lat, lon)
+        if distance <= radius_km:
+            found.append((distance, restaurant_id))
+    found.sort()
+    return queries.load_restaurants([restaurant_id for _, restaurant_id in found[:limit]])
+
+
+def geo_benchmarks(rng, radius_km):
+    points = []
+    for _ in range(100):
+        latitude, longitude = rng.choice(CITIES)
+        points.append((latitude + rng.gauss(0, CITY_SPREAD_KM / 2) / geo.KM_PER_DEGREE,
+                       longitude + rng.gauss(0, CITY_SPREAD_KM / 2) / geo.KM_PER_DEGREE))
+    picks = iter(points * 10000)
+
+    def latlon_index():
+        latitude, longitude = next(picks)
+        south, west, north, east = geo.bounding_box(latitude, longitude, radius_km)
+        statement = select(Restaurant.id, Restaurant.latitude, Restaurant.longitude).where(
+            Restaurant.latitude.between(south, north), Restaurant.longitude.between(west, east))
+        return closest(statement, latitude, longitude, radius_km)
+
+    def full_scan():
+        latitude, longitude = next(picks)
+        south, west, north, east = geo.bounding_box(latitude, longitude, radius_km)
+        statement = text("SELECT id, latitude, longitude FROM restaurants NOT INDEXED "
+                         "WHERE latitude BETWEEN :south AND :north AND longitude BETWEEN :west AND :east")
+        return closest(statement.bindparams(south=south, north=north, west=west, east=east), latitude, longitude,
+                       radius_km)
+
+    def box():
+        latitude, longitude = next(picks)
+        return geo.restaurants_in_box(*geo.bounding_box(latitude, longitude, radius_km))
+
+    return [
+        Benchmark("rtree_radius", lambda: geo.restaurants_near(*next(picks), radius_km)),
+        Benchmark("rtree_radius_facets", lambda: geo.restaurants_near(*next(picks), radius_km, cuisine="Thai",
+                                                                      min_rating=4)),
+        Benchmark("rtree_box", box),
+        Benchmark("latlon_index_radius", latlon_index),
+        Benchmark("full_scan_radius", full_scan),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near me lookup benchmarks.")
+    parser.add_argument("--restaurants", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--database", help="Benchmark SQLite file (default: in the temp folder).")
+    parser.add_argument("--radius", type=float, default=2.0, help="Lookup radius in km.")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Minimum time per benchmark.")
+    parser.add_argument("--min-runs", type=int, default=20)
+    report.add_arguments(parser)
+    args = parser.parse_args()
+
+    app = location_app(args.restaurants, args.seed, args.database)
+    rng = random.Random(args.seed)
+
+    results = {}
+    print(f"{'benchmark':<22} {'runs':>6} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>9}")
+    for benchmark in geo_benchmarks(rng, args.radius):
+        # A full scan is slow, a few runs are enough
+        seconds, min_runs = (0, 5) if benchmark.name == "full_scan_radius" else (args.seconds, args.min_runs)
+        result = report.summarize(measure(app, benchmark, seconds, min_runs))
+        results[benchmark.name] = result
+        print(f"{benchmark.name:<22} {result['runs']:>6} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+              f"{result['ops_per_sec']:>9.1f}")
+
+    document = report.results_document("geo", results, restaurants=args.restaurants, radius_km=args.radius,
+                                       seed=args.seed)
+    sys.exit(report.finish(document, args))
+
+
+if __name__ == "__main__":
+    main()
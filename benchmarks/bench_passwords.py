@@ -0,0 +1,91 @@
+# Benchmark: logins per second against the number of password hashing processes
+# Run from the project folder:  python -m benchmarks.bench_passwords [--seconds 5] [--clients 64]
+# Each run verifies a password from many client threads at once (like a login burst) and counts
+# successful logins per second and requests turned away with 503 (queue full).
+
+# Standard library imports
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Third-party imports
+from werkzeug.security import generate_password_hash
+
+# Local app imports
+from app import create_app
+from app import passwords
+
+
+app = create_app()
+
+
+def run(workers, clients, seconds, stored_hash):
+    """Verify passwords from `clients` threads for `seconds`. Returns (logins/sec, rejected/sec)."""
+    passwords.shutdown()
+    app.config["PASSWORD_HASH_WORKERS"] = workers
+    # Warm up the pool so process start-up isn't measured
+    with app.app_context():
+        passwords.verify_password(stored_hash, "correct horse")
+
+    done = rejected = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        # The password functions read the app config (like a request would)
+        with app.app_context():
+            client_loop()
+
+    def client_loop():
+        nonlocal done, rejected
+        while time.perf_counter() < deadline:
+            try:
+                assert passwords.verify_password(stored_hash, "correct horse")
+                with lock:
+                    done += 1
+            except passwords.HashingBusy:
+                with lock:
+                    rejected += 1
+                # A real client would back off after a 503
+                time.sleep(0.01)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for _ in range(clients):
+            pool.submit(client)
+    elapsed = time.perf_counter() - start
+    return done / elapsed, rejected / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--clients", type=int, default=64)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    stored_hash = generate_password_hash("correct horse", app.config["PASSWORD_HASH_METHOD"])
+
+    # Baseline: hashing inline in the request thread
+    app.config["PASSWORD_HASH_WORKERS"] = 0
+    start = time.perf_counter()
+    with app.app_context():
+        passwords.verify_password(stored_hash, "correct horse")
+    print(f"method {app.config['PASSWORD_HASH_METHOD']}, one verify inline: {time.perf_counter() - start:.3f}s")
+    print(f"{'workers':>8} {'logins/sec':>12} {'503/sec':>10}")
+
+    workers = 1
+    while True:
+        logins, rejected = run(workers, args.clients, args.seconds, stored_hash)
+        print(f"{workers:>8} {logins:>12.1f} {rejected:>10.1f}")
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+    passwords.shutdown()
+
+
+if __name__ == "__main__":
+    main()
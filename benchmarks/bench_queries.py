@@ -0,0 +1,228 @@
+# Micro-benchmarks for the query paths behind the restaurant page, add_rest, login, search, recommendations and
+# the /user analytics
+# Run from the project folder:  python -m benchmarks.bench_queries [--size 1k|100k|1m] [--seconds 1]
+#                                   [--only search] [--output results.json] [--baseline baseline.json]
+# - Runs against the deterministic dataset from benchmarks/datagen.py (generated on first use)
+# - Each benchmark runs the same functions the route calls, in an app context, with a fresh session per call
+#   (like a request), for at least --seconds and --min-runs calls after a short warm-up
+# - Results are latency percentiles per benchmark, see benchmarks/report.py for the JSON and baseline check
+
+# Standard library imports
+import argparse
+import random
+import sys
+import time
+from datetime import date
+
+# Third-party imports
+from sqlalchemy import func, select
+
+# Local app imports
+from app import analytics, db, recommend
+from app.models import Meal, Restaurant, User
+from app.passwords import verify_password
+from app.queries import load_restaurant_detail
+from app.search import search_restaurants
+from app.validation import restaurant_error
+from benchmarks import report
+from benchmarks.datagen import DEFAULT_SEED, PASSWORD, SIZES, counts, dataset_app, NOTE_WORDS, TAG_NAMES
+
+WARMUP_RUNS = 3
+
+
+class Benchmark:
+    """A named function called once per run, with an optional cleanup after all the runs (not timed)."""
+
+    def __init__(self, name, run, cleanup=None):
+        self.name = name
+        self.run = run
+        self.cleanup = cleanup
+
+
+def restaurant_benchmarks(app, sizes, rng):
+    page_size = app.config["MEALS_PAGE_SIZE"]
+    restaurant_ids = [rng.randint(1, sizes["restaurants"]) for _ in range(100)]
+    picks = iter(restaurant_ids * 1000)
+
+    # Restaurant 1 has the most meals (the generator favours low ids), start 10 pages in
+    cursor = None
+    with app.app_context():
+        for _ in range(10):
+            cursor = load_restaurant_detail(1, cursor, page_size).next_cursor or cursor
+        db.session.remove()
+
+    return [
+        Benchmark("restaurant_page", lambda: load_restaurant_detail(next(picks), None, page_size)),
+        Benchmark("restaurant_page_deep", lambda: load_restaurant_detail(1, cursor, page_size)),
+    ]
+
+
+def add_rest_benchmarks(app, sizes, rng):
+    created = []
+    numbers = iter(range(1, 10 ** 9))
+
+    def add_rest():
+        # Same steps as the add_rest route: validate, check the name, insert (stats, search and cache events)
+        name = f"Benchmark Bistro {rng.random():.12f} {next(numbers)}"
+        assert restaurant_error(name, "555-123-4567", "Thai", "4") is None
+        assert Restaurant.query.filter_by(name=name).first() is None
+        restaurant = Restaurant(name=name, address="1 Test St", phone_number="555-123-4567", cuisine="Thai",
+                                rating=4)
+        db.session.add(restaurant)
+        db.session.commit()
+        created.append(restaurant.id)
+
+    def cleanup():
+        # Leave the dataset as generated
+        for restaurant_id in created:
+            db.session.delete(db.session.get(Restaurant, restaurant_id))
+        db.session.commit()
+        created.clear()
+
+    return [Benchmark("add_rest", add_rest, cleanup)]
+
+
+def login_benchmarks(app, sizes, rng):
+    usernames = iter([f"user{rng.randint(1, sizes['people'])}" for _ in range(100)] * 1000)
+
+    def lookup():
+        return User.query.filter_by(username=next(usernames)).first()
+
+    def login():
+        # Hashing runs inline (PASSWORD_HASH_WORKERS=0), this is the cost of the configured hash method
+        assert verify_password(lookup().password, PASSWORD)
+
+    return [Benchmark("login_lookup", lookup), Benchmark("login", login)]
+
+
+def search_benchmarks(app, sizes, rng):
+    page_size = app.config["SEARCH_PAGE_SIZE"]
+    words = iter([rng.choice(NOTE_WORDS) for _ in range(100)] * 1000)
+    # One letter swapped: goes through the typo expansion
+    typos = iter([word[:1] + word[2] + word[1] + word[3:] for word in NOTE_WORDS if len(word) > 4] * 1000)
+
+    with app.app_context():
+        _, second_page = search_restaurants(sort="last_visit", limit=page_size)
+        db.session.remove()
+
+    return [
+        Benchmark("search_text", lambda: search_restaurants(query=next(words), limit=page_size)),
+        Benchmark("search_typo", lambda: search_restaurants(query=next(typos), limit=page_size)),
+        Benchmark("search_name", lambda: search_restaurants(query="golden garden", limit=page_size)),
+        Benchmark("search_facets", lambda: search_restaurants(cuisine="Thai", min_rating=3, tags=TAG_NAMES[:1],
+                                                              limit=page_size)),
+        Benchmark("search_tags_all", lambda: search_restaurants(tags=TAG_NAMES[:2], sort="name", limit=page_size)),
+        Benchmark("search_tags_any", lambda: search_restaurants(tags=TAG_NAMES[:3], tag_mode="any", sort="rating",
+                                                                limit=page_size)),
+        Benchmark("browse_last_visit", lambda: search_restaurants(sort="last_visit", cursor=second_page,
+                                                                  limit=page_size)),
+    ]
+
+
+def recommend_benchmarks(app, sizes, rng):
+    if not recommend.available():
+        print("recommend: skipped, NumPy is not installed")
+        return []
+    person_ids = iter([rng.randint(1, sizes["people"]) for _ in range(100)] * 1000)
+    restaurant_ids = iter([rng.randint(1, sizes["restaurants"]) for _ in range(100)] * 1000)
+
+    def build():
+        # Whole matrix and features from the database, like a new worker's first request
+        recommend.reset_model()
+        recommend.get_model()
+
+    with app.app_context():
+        model = recommend.get_model()
+        db.session.remove()
+
+    return [
+        Benchmark("recommend_build", build),
+        # Scoring only (the top-k cache is skipped), then the page's path: cache + loading the restaurants
+        Benchmark("recommend_person", lambda: model.for_person(next(person_ids), 10)),
+        Benchmark("recommend_similar", lambda: model.similar_to(next(restaurant_ids), 10)),
+        Benchmark("recommend_cached", lambda: recommend.recommended_restaurants(next(person_ids), 10)),
+    ]
+
+
+def analytics_benchmarks(app, sizes, rng):
+    person_ids = iter([rng.randint(1, sizes["people"]) for _ in range(100)] * 1000)
+    start, end = date(2023, 1, 1), date(2023, 12, 31)
+
+    def cold():
+        # A person whose timeline isn't cached: load their visit days, then the report
+        analytics.timeline_cache.clear()
+        analytics.person_report(next(person_ids), start, end)
+
+    def meals_group_by():
+        # What the summary and months would cost straight from the meals table (no visit_day_stats)
+        month = func.strftime("%Y-%m", Meal.date)
+        db.session.execute(select(month, func.count(), func.count(func.distinct(Meal.restaurant_id)),
+                                  func.sum(Meal.price), func.min(Meal.price), func.max(Meal.price))
+                           .where(Meal.person_id == next(person_ids), Meal.date.between(start, end))
+                           .group_by(month)).all()
+
+    return [
+        Benchmark("analytics_report", cold),
+        Benchmark("analytics_cached", lambda: analytics.person_report(next(person_ids), start, end)),
+        Benchmark("analytics_meals_group_by", meals_group_by),
+    ]
+
+
+GROUPS = {"restaurant": restaurant_benchmarks, "add_rest": add_rest_benchmarks, "login": login_benchmarks,
+          "search": search_benchmarks, "recommend": recommend_benchmarks, "analytics": analytics_benchmarks}
+
+
+def measure(app, benchmark, seconds, min_runs):
+    """Durations in seconds of each run after the warm-up."""
+    samples = []
+    with app.app_context():
+        runs = 0
+        deadline = None
+        while runs < WARMUP_RUNS + min_runs or time.perf_counter() < deadline:
+            start = time.perf_counter()
+            benchmark.run()
+            elapsed = time.perf_counter() - start
+            # A request ends with the session removed, the next one starts with an empty identity map
+            db.session.remove()
+            runs += 1
+            if runs == WARMUP_RUNS:
+                deadline = time.perf_counter() + seconds
+            elif runs > WARMUP_RUNS:
+                samples.append(elapsed)
+        if benchmark.cleanup:
+            benchmark.cleanup()
+            db.session.remove()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query path micro-benchmarks.")
+    parser.add_argument("--size", choices=list(SIZES), default="1k")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--database", help="Benchmark SQLite file (default: in the temp folder).")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Minimum time per benchmark.")
+    parser.add_argument("--min-runs", type=int, default=20)
+    parser.add_argument("--only", action="append", choices=list(GROUPS), help="Groups to run, repeatable.")
+    report.add_arguments(parser)
+    args = parser.parse_args()
+
+    app = dataset_app(args.size, args.seed, args.database, overrides={"PASSWORD_HASH_WORKERS": 0})
+    sizes = counts(args.size)
+    # Same inputs on every run
+    rng = random.Random(args.seed)
+
+    results = {}
+    print(f"{'benchmark':<22} {'runs':>6} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>9}")
+    for group in args.only or list(GROUPS):
+        for benchmark in GROUPS[group](app, sizes, rng):
+            result = report.summarize(measure(app, benchmark, args.seconds, args.min_runs))
+            results[benchmark.name] = result
+            print(f"{benchmark.name:<22} {result['runs']:>6} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+                  f"{result['ops_per_sec']:>9.1f}")
+
+    document = report.results_document("queries", results, size=args.size, seed=args.seed)
+    sys.exit(report.finish(document, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# Benchmark: listing page renders per second, before and after the rendering layer (app/rendering.py)
+# Run from the project folder:  python -m benchmarks.bench_render [--rows 20 --rows 100 --rows 500] [--seconds 2]
+#                                   [--output results.json] [--baseline baseline.json]
+# - No database: the home page template is rendered with in-memory restaurants (like a loaded listing page)
+# - inline: every row rendered in the page template each time (the template before rows.html)
+# - fragments_cold: rows from the rows.html macro, fragment cache cleared before each render (all misses)
+# - fragments_warm: rows from the fragment cache (repeat views of the same restaurant versions)
+# - streamed: fragments_warm sent with stream_template, consumed to the last chunk
+# - compile: all templates compiled from source, then loaded from the bytecode cache by a fresh environment
+# Compare renders/sec with --metric ops_per_sec (higher is better), latency with the default p50_ms
+
+# Standard library imports
+import argparse
+import sys
+import tempfile
+import time
+from datetime import date
+from types import SimpleNamespace
+
+# Third-party imports
+from flask import render_template, render_template_string, stream_template
+from jinja2 import FileSystemBytecodeCache
+
+# Local app imports
+from app import create_app, rendering
+from benchmarks import report
+
+
+# The home page as it was before the rows were fragments: each row rendered inline
+INLINE_TEMPLATE = """{% extends "layout.html" %}
+{% block content %}
+        <table>
+            <tbody>
+                {% for restaurant in restaurants %}
+                <tr>
+                    <td><a href="{{ url_for('restaurants.restaurant', restaurant_id=restaurant.id) }}">{{  restaurant.name  }}</a></td>
+                    <td>{{  restaurant.cuisine  }}</td>
+                    <td>{{  restaurant.rating  }}</td>
+                    <td>{{  restaurant.stats.meal_count  }}</td>
+                    <td>{% if restaurant.stats.average_price is not none %}${{  "%.2f" | format(restaurant.stats.average_price)  }}{% endif %}</td>
+                    <td>{{  restaurant.stats.last_visit or ""  }}</td>
+                </tr>
+                {% endfor %}
+            </tbody>
+        </table>
+{% endblock %}"""
+
+
+def make_restaurants(count):
+    """Restaurants with statistics, shaped like the listing query's results."""
+    return [SimpleNamespace(id=number, name=f"Restaurant {number}", cuisine="Thai", rating=number % 5 + 1, version=1,
+                            stats=SimpleNamespace(meal_count=number * 3, average_price=12.5 + number % 7,
+                                                  last_visit=date(2024, 1, 1 + number % 28)))
+            for number in range(1, count + 1)]
+
+
+def measure(render, seconds):
+    """Call render() for `seconds` after a warm-up. Returns the report summary (ops_per_sec = renders/sec)."""
+    for _ in range(3):
+        render()
+    samples = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        render()
+        samples.append(time.perf_counter() - start)
+    return report.summarize(samples)
+
+
+def render_benchmarks(app, rows, seconds):
+    restaurants = make_restaurants(rows)
+    context = {"restaurants": restaurants, "next_cursor": None, "sort": None}
+    inline = app.jinja_env.from_string(INLINE_TEMPLATE)
+
+    def fragments_cold():
+        rendering.fragment_cache.clear()
+        return render_template("index.html", **context)
+
+    def streamed():
+        return "".join(stream_template("index.html", **context))
+
+    runs = {
+        "inline": lambda: render_template(inline, **context),
+        "fragments_cold": fragments_cold,
+        "fragments_warm": lambda: render_template("index.html", **context),
+        "streamed": streamed,
+    }
+    # Same HTML rows either way
+    assert render_template(inline, **context).count("<tr>") == render_template("index.html", **context).count("<tr>")
+    return {f"{name}_{rows}": measure(run, seconds) for name, run in runs.items()}
+
+
+def compile_benchmarks(app):
+    """Seconds to compile every template from source, and to load them from a warm bytecode cache."""
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith(".html"))
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name in ("compile_source", "compile_bytecode"):
+            # A fresh environment, like a new worker (the second one finds the code the first one saved)
+            env = app.create_jinja_environment()
+            env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+            start = time.perf_counter()
+            for template in names:
+                env.get_template(template)
+            results[name] = report.summarize([time.perf_counter() - start])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, action="append", help="Rows per page, repeatable (default 20, 100, 500).")
+    parser.add_argument("--seconds", type=float, default=2.0, help="Time per benchmark.")
+    report.add_arguments(parser)
+    args = parser.parse_args()
+    sizes = args.rows or [20, 100, 500]
+
+    app = create_app(overrides={"TEMPLATE_CACHE_DIR": None, "FRAGMENT_CACHE_SIZE": max(sizes) * 2})
+    results = {}
+    with app.test_request_context("/"):
+        for rows in sizes:
+            results.update(render_benchmarks(app, rows, args.seconds))
+    results.update(compile_benchmarks(app))
+
+    print(f"{'benchmark':<24} {'renders/sec':>12} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, result in results.items():
+        print(f"{name:<24} {result['ops_per_sec'] or 0:>12.1f} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f}")
+
+    document = report.results_document("render", results, rows=sizes, seconds=args.seconds)
+    sys.exit(report.finish(document, args))
+
+
+if __name__ == "__main__":
+    main()
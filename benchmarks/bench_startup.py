@@ -0,0 +1,119 @@
+# Benchmark: worker start-up time - importing the app, creating it, and serving the first request
+# Run from the project folder:  python -m benchmarks.bench_startup [--runs 5] [--top 15] [--no-save]
+# Each run starts a fresh Python process (like a gunicorn worker or a CLI call) and measures:
+# - import: `import run` (package imports + create_app), from `python -X importtime`
+# - first request / second request: GET /login through the test client (template compile, routing warm-up)
+# - process: wall time of the whole process including interpreter start-up
+# Results (medians) are appended to benchmarks/results/startup.jsonl with the git commit, so start-up time can be
+# tracked over time, and compared with the previous entry.
+
+# Standard library imports
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+RESULTS = os.path.join(os.path.dirname(__file__), "results", "startup.jsonl")
+
+# Runs in the child process, prints its timings as JSON
+CHILD = """
+import json, time
+start = time.perf_counter()
+import run
+imported = time.perf_counter()
+client = run.app.test_client()
+response = client.get("/login")
+first = time.perf_counter()
+client.get("/login")
+second = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_request_ms": (first - imported) * 1000,
+                  "second_request_ms": (second - first) * 1000}))
+"""
+
+
+def run_child(env):
+    """One fresh process. Returns its timings in milliseconds."""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD], env=env, check=True, capture_output=True, text=True)
+    timings = json.loads(output.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def import_profile(env):
+    """(self, cumulative) import time per module in microseconds, from python -X importtime."""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import run"], env=env, check=True,
+                            capture_output=True, text=True)
+    modules = {}
+    for line in output.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_result():
+    if not os.path.exists(RESULTS):
+        return None
+    with open(RESULTS) as file:
+        lines = [line for line in file if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list.")
+    parser.add_argument("--no-save", action="store_true", help="Don't append the results to the history file.")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # The first request doesn't touch the database, any SQLite file will do
+    env.setdefault("DATABASE_URL", "sqlite:////tmp/bench_startup.db")
+
+    runs = [run_child(env) for _ in range(args.runs)]
+    result = {name: round(statistics.median(run[name] for run in runs), 1) for name in runs[0]}
+
+    modules = import_profile(env)
+    print("Slowest imports (cumulative ms) of `import run`:")
+    top = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+    for name, (_, cumulative) in top:
+        print(f"  {cumulative / 1000:>8.1f}  {name}")
+    # Time spent running the app's own modules (create_app included), without the libraries they import
+    own = [micros for name, (micros, _) in modules.items() if name in ("run", "app") or name.startswith("app.")]
+    print(f"App code: {sum(own) / 1000:.1f} ms in {len(own)} modules")
+
+    previous = last_result()
+    print(f"\nMedian of {args.runs} runs:")
+    for name, value in result.items():
+        change = ""
+        if previous and name in previous.get("results", {}):
+            change = f"   (was {previous['results'][name]:.1f})"
+        print(f"  {name:<18} {value:>8.1f} ms{change}")
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(RESULTS), exist_ok=True)
+        entry = {"date": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+                 "python": sys.version.split()[0], "runs": args.runs, "results": result}
+        with open(RESULTS, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+        print(f"\nSaved to {os.path.relpath(RESULTS)}")
+
+
+if __name__ == "__main__":
+    main()
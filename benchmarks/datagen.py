@@ -0,0 +1,201 @@
+# Deterministic synthetic data for the benchmarks: people, users, restaurants, tags and meals
+# Run from the project folder:  python -m benchmarks.datagen --size 100k [--seed 42] [--database PATH]
+# - Sizes are named by the number of meals: 1k, 100k and 1m
+# - The same size and seed always give the same rows (ids included), so runs on different commits compare
+# - Rows are written with Core executemany in batches, then the statistics and search index are rebuilt once
+# - Every user logs in as user<N> (N from 1) with the password PASSWORD
+# The benchmarks create the database on first use and reuse it afterwards (see dataset_app()).
+
+# Standard library imports
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Third-party imports
+from sqlalchemy import func, insert, select
+from werkzeug.security import generate_password_hash
+
+# Local app imports
+from app import create_app, db
+from app.migrations import init_db
+from app.models import People, User, Restaurant, Meal, Tag, restaurant_tags
+from app.search import rebuild_search_index
+from app.stats import rebuild_stats
+from app.tagging import rebuild_tag_counts
+
+
+# Meals per size
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+DEFAULT_SEED = 42
+PASSWORD = "benchmark"
+# Rows per executemany
+BATCH_SIZE = 10_000
+
+CUISINES = ["Italian", "Mexican", "Thai", "Japanese", "Indian", "French", "Greek", "Korean", "Vietnamese",
+            "American", "Chinese", "Lebanese", "Ethiopian", "Spanish", "Turkish"]
+TAG_NAMES = ["cheap", "date night", "outdoor seating", "vegan options", "takeout", "brunch", "late night",
+             "family", "quiet", "spicy", "wine bar", "counter service", "kid friendly", "live music", "favorites"]
+ADJECTIVES = ["Golden", "Blue", "Little", "Happy", "Old", "Red", "Green", "Lucky", "Silver", "Rustic", "Sunny",
+              "Hidden", "Corner", "Royal", "Urban", "Wild"]
+NOUNS = ["Spoon", "Fork", "Lantern", "Garden", "Kitchen", "Table", "Oven", "Bowl", "Harbor", "Market", "Bistro",
+         "Grill", "Noodle", "Dragon", "Olive", "Pepper"]
+STREETS = ["Main St", "Oak Ave", "Pine St", "Maple Ave", "Cedar Rd", "Elm St", "Lake Dr", "Hill Rd", "Park Ave",
+           "River Rd"]
+DISHES = ["pad thai", "margherita pizza", "ramen", "tacos al pastor", "butter chicken", "pho", "gyro",
+          "bibimbap", "burger", "dumplings", "paella", "falafel plate", "carbonara", "green curry", "sushi set",
+          "enchiladas", "moussaka", "kung pao chicken", "injera platter", "croque monsieur"]
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Casey", "Robin", "Jamie", "Morgan", "Riley", "Avery",
+               "Quinn", "Drew", "Kai", "Noor", "Ari", "Sasha"]
+NOTE_WORDS = ["crispy", "smoky", "tangy", "salty", "sweet", "tender", "creamy", "bland", "fresh", "huge",
+              "portion", "service", "slow", "friendly", "noisy", "cozy", "sauce", "broth", "noodles", "rice",
+              "dessert", "again", "overpriced", "bargain", "authentic", "garlic", "herbs", "spicy", "perfect"]
+
+FIRST_DAY = date(2022, 1, 1)
+DAYS = 3 * 365
+
+
+def counts(size):
+    """Rows per table for a size name: {"meals", "restaurants", "people"}."""
+    meals = SIZES[size]
+    return {"meals": meals, "restaurants": max(20, meals // 50), "people": max(10, meals // 100)}
+
+
+def restaurant_name(number):
+    """Name of restaurant number (1-based), unique."""
+    index = number - 1
+    adjective = ADJECTIVES[index % len(ADJECTIVES)]
+    noun = NOUNS[(index // len(ADJECTIVES)) % len(NOUNS)]
+    return f"{adjective} {noun} {number}"
+
+
+# ROWS
+def _people_rows(people):
+    for number in range(1, people + 1):
+        yield {"id": number, "name": f"{FIRST_NAMES[number % len(FIRST_NAMES)]} {number}"}
+
+
+def _user_rows(people, password_hash):
+    for number in range(1, people + 1):
+        yield {"id": number, "username": f"user{number}", "password": password_hash, "person_id": number}
+
+
+def _restaurant_rows(rng, restaurants):
+    for number in range(1, restaurants + 1):
+        yield {"id": number, "name": restaurant_name(number),
+               "address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}",
+               "phone_number": f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+               "cuisine": rng.choice(CUISINES), "rating": rng.randint(1, 5)}
+
+
+def _tag_rows():
+    for number, name in enumerate(TAG_NAMES, 1):
+        yield {"id": number, "name": name, "restaurant_count": 0}
+
+
+def _restaurant_tag_rows(rng, restaurants):
+    for number in range(1, restaurants + 1):
+        for tag_id in sorted(rng.sample(range(1, len(TAG_NAMES) + 1), rng.randint(0, 4))):
+            yield {"restaurant_id": number, "tag_id": tag_id}
+
+
+def _meal_rows(rng, meals, restaurants, people):
+    for number in range(1, meals + 1):
+        # Skewed towards low restaurant ids: a few busy restaurants, a long tail of quiet ones
+        restaurant_id = int(rng.random() ** 2 * restaurants) + 1
+        price = round(rng.uniform(5, 60), 2) if rng.random() < 0.9 else None
+        notes = " ".join(rng.choices(NOTE_WORDS, k=rng.randint(3, 8))) if rng.random() < 0.5 else None
+        yield {"id": number, "restaurant_id": restaurant_id, "person_id": rng.randint(1, people),
+               "name": rng.choice(DISHES), "date": FIRST_DAY + timedelta(days=rng.randrange(DAYS)),
+               "price": price, "rating": str(rng.randint(1, 5)), "notes": notes}
+
+
+def _insert_batches(connection, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            connection.execute(insert(table), batch)
+            batch = []
+    if batch:
+        connection.execute(insert(table), batch)
+
+
+def generate(connection, size, seed=DEFAULT_SEED, password_hash=None):
+    """
+    Fill an empty database with the rows for a size, then rebuild the statistics and search index.
+    - password_hash: stored for every user (hashing once per user would dominate the run)
+    """
+    rng = random.Random(seed)
+    sizes = counts(size)
+    password_hash = password_hash or generate_password_hash(PASSWORD)
+
+    _insert_batches(connection, People.__table__, _people_rows(sizes["people"]))
+    _insert_batches(connection, User.__table__, _user_rows(sizes["people"], password_hash))
+    _insert_batches(connection, Restaurant.__table__, _restaurant_rows(rng, sizes["restaurants"]))
+    _insert_batches(connection, Tag.__table__, _tag_rows())
+    _insert_batches(connection, restaurant_tags, _restaurant_tag_rows(rng, sizes["restaurants"]))
+    _insert_batches(connection, Meal.__table__,
+                    _meal_rows(rng, sizes["meals"], sizes["restaurants"], sizes["people"]))
+
+    # Derived data, as the importer would leave it
+    rebuild_stats(connection)
+    rebuild_tag_counts(connection)
+    rebuild_search_index(connection)
+    return sizes
+
+
+# DATABASES
+def default_path(size, seed=DEFAULT_SEED):
+    return os.path.join(tempfile.gettempdir(), f"restaurants-bench-{size}-{seed}.db")
+
+
+def dataset_app(size, seed=DEFAULT_SEED, path=None, regenerate=False, overrides=None):
+    """
+    App bound to the benchmark database for a size, generated first if it is missing or incomplete.
+    - overrides: extra config settings (e.g. PASSWORD_HASH_WORKERS)
+    """
+    path = path or default_path(size, seed)
+    if regenerate:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    settings = {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.abspath(path), "SQLALCHEMY_ENGINE_OPTIONS": {}}
+    settings.update(overrides or {})
+    app = create_app(overrides=settings)
+
+    with app.app_context():
+        init_db()
+        with db.engine.connect() as connection:
+            meals = connection.execute(select(func.count()).select_from(Meal.__table__)).scalar()
+        if meals != SIZES[size]:
+            if meals:
+                raise SystemExit(f"{path} holds {meals} meals, not {SIZES[size]} - use --regenerate")
+            start = time.perf_counter()
+            password_hash = generate_password_hash(PASSWORD, method=app.config["PASSWORD_HASH_METHOD"],
+                                                   salt_length=app.config["PASSWORD_SALT_LENGTH"])
+            with db.engine.begin() as connection:
+                generate(connection, size, seed, password_hash)
+            print(f"Generated the {size} dataset in {time.perf_counter() - start:.1f} s: {path}")
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a benchmark database.")
+    parser.add_argument("--size", choices=list(SIZES), default="1k")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--database", help="SQLite file to create (default: in the temp folder).")
+    parser.add_argument("--regenerate", action="store_true", help="Delete the database and generate it again.")
+    args = parser.parse_args()
+
+    path = args.database or default_path(args.size, args.seed)
+    dataset_app(args.size, args.seed, path, args.regenerate)
+    print(f"{path}: {counts(args.size)}")
+    print(f"Serve it with:  DATABASE_URL=sqlite:///{os.path.abspath(path)} python run.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# Load test: concurrent logged-in users browsing, searching and logging in
+# Run from the project folder:
+#   in process (Flask test client):  python -m benchmarks.loadtest [--size 1k] [--workers 8] [--seconds 10]
+#   against a running server:        python -m benchmarks.loadtest --url http://127.0.0.1:5000 --size 1k
+#     (serve the same dataset: python -m benchmarks.datagen --size 1k prints the DATABASE_URL to use, and start
+#     the server with RATE_LIMIT_ENABLED=0: every simulated user logs in from the same address)
+# - Each worker logs in as its own user, then sends requests from MIX until time is up
+# - Reports requests/sec overall and latency percentiles per request type, see benchmarks/report.py for
+#   --output / --baseline (compare e.g. with --metric p95_ms --metric requests_per_sec)
+
+# Standard library imports
+import argparse
+import http.cookiejar
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Local app imports
+from benchmarks import report
+from benchmarks.datagen import DEFAULT_SEED, PASSWORD, SIZES, counts, dataset_app, CUISINES, NOTE_WORDS
+
+# Request types and how often each is picked
+MIX = {"index": 20, "restaurant": 40, "restaurant_page_2": 5, "search": 25, "facets": 8, "login": 2}
+
+# Cursor for the second page of restaurant 1's meals, filled in by find_page_cursors()
+PAGE_CURSORS = []
+
+
+def next_request(rng, sizes):
+    """(request type, method, path, form) for the next request."""
+    kind = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+    if kind == "index":
+        return kind, "GET", "/", None
+    if kind == "restaurant":
+        # Busy restaurants are looked at more, like the meals in the dataset
+        return kind, "GET", f"/restaurant/{int(rng.random() ** 2 * sizes['restaurants']) + 1}", None
+    if kind == "restaurant_page_2":
+        return kind, "GET", "/restaurant/1?" + urllib.parse.urlencode({"cursor": rng.choice(PAGE_CURSORS)}), None
+    if kind == "search":
+        return kind, "GET", "/search?" + urllib.parse.urlencode({"q": rng.choice(NOTE_WORDS)}), None
+    if kind == "facets":
+        return kind, "GET", "/search?" + urllib.parse.urlencode({"cuisine": rng.choice(CUISINES), "min_rating": 3}), None
+    return kind, "POST", "/login", {"username": f"user{rng.randint(1, sizes['people'])}", "password": PASSWORD}
+
+
+# CLIENTS
+class TestClientSession:
+    """One logged-in user through the Flask test client (in this process)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None):
+        response = self.client.open(path, method=method, data=form)
+        response.close()
+        return response.status_code
+
+
+class HTTPSession:
+    """One logged-in user against a running server (cookies kept, redirects not followed)."""
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                                  self.NoRedirect)
+
+    def request(self, method, path, form=None):
+        data = urllib.parse.urlencode(form).encode() if form is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=data, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+
+
+def find_page_cursors(session):
+    """Read the older meals link from restaurant 1's page."""
+    if isinstance(session, TestClientSession):
+        body = session.client.get("/restaurant/1").get_data(as_text=True)
+    else:
+        with session.opener.open(session.base_url + "/restaurant/1") as response:
+            body = response.read().decode()
+    marker = "cursor="
+    if marker in body:
+        start = body.index(marker) + len(marker)
+        end = min(body.find(character, start) for character in '"&' if body.find(character, start) != -1)
+        PAGE_CURSORS.append(urllib.parse.unquote(body[start:end]))
+    else:
+        PAGE_CURSORS.append("")
+
+
+def run(new_session, sizes, workers, seconds, seed):
+    """Drive `workers` concurrent users for `seconds`. Returns ({request type: [durations]}, errors, elapsed)."""
+    samples = {kind: [] for kind in MIX}
+    errors = {kind: 0 for kind in MIX}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(number):
+        rng = random.Random(seed * 1000 + number)
+        session = new_session()
+        status = session.request("POST", "/login", {"username": f"user{number % sizes['people'] + 1}",
+                                                    "password": PASSWORD})
+        if status != 302:
+            raise RuntimeError(f"Worker {number} could not log in (HTTP {status})")
+        while time.perf_counter() < deadline:
+            kind, method, path, form = next_request(rng, sizes)
+            start = time.perf_counter()
+            status = session.request(method, path, form)
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[kind].append(elapsed)
+                # Pages answer 200 (304 never happens without If-None-Match), log in answers with a redirect
+                if status >= 400:
+                    errors[kind] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(worker, number) for number in range(workers)]:
+            future.result()
+    return samples, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test.")
+    parser.add_argument("--size", choices=list(SIZES), default="1k")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--database", help="Benchmark SQLite file for the test client (default: temp folder).")
+    parser.add_argument("--url", help="Base URL of a running server to test instead of the test client.")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent users.")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    report.add_arguments(parser)
+    args = parser.parse_args()
+
+    sizes = counts(args.size)
+    if args.url:
+        new_session = lambda: HTTPSession(args.url)
+        target = args.url
+    else:
+        # Every worker logs in from the same address, the login rate limit would turn most of them away
+        app = dataset_app(args.size, args.seed, args.database, overrides={"RATE_LIMIT_ENABLED": False})
+        new_session = lambda: TestClientSession(app)
+        target = "test client"
+
+    first = new_session()
+    first.request("POST", "/login", {"username": "user1", "password": PASSWORD})
+    find_page_cursors(first)
+
+    print(f"{args.workers} workers for {args.seconds:.0f} s against {target} ({args.size} dataset)...")
+    samples, errors, elapsed = run(new_session, sizes, args.workers, args.seconds, args.seed)
+
+    total = sum(len(durations) for durations in samples.values())
+    results = {"all": {**report.summarize([d for durations in samples.values() for d in durations]),
+                       "requests_per_sec": round(total / elapsed, 1), "errors": sum(errors.values())}}
+    print(f"{'request':<20} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, durations in samples.items():
+        if durations:
+            results[kind] = {**report.summarize(durations), "errors": errors[kind]}
+    for kind, result in results.items():
+        print(f"{kind:<20} {result['runs']:>7} {result['errors']:>7} {result['p50_ms']:>9.2f} "
+              f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+    print(f"\n{results['all']['requests_per_sec']:.1f} requests/sec")
+
+    document = report.results_document("loadtest", results, size=args.size, seed=args.seed, target=target,
+                                       workers=args.workers, seconds=args.seconds)
+    code = report.finish(document, args)
+    sys.exit(code or (1 if results["all"]["errors"] else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Benchmark results as JSON, and comparison against a baseline for CI
+# Compare two result files (exits 1 if a metric got worse by more than the threshold):
+#   python -m benchmarks.report baseline.json results.json [--threshold 0.2] [--metric p50_ms ...]
+# - Metrics ending in _ms are better lower, metrics ending in _per_sec are better higher
+# - Benchmarks only in one of the files are listed but never fail the comparison
+
+# Standard library imports
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_METRICS = ("p50_ms",)
+
+
+def summarize(samples):
+    """Latency summary of a list of durations in seconds."""
+    ordered = sorted(samples)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    total = sum(ordered)
+    return {"runs": len(ordered), "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+            "p50_ms": round(percentile(0.50), 3), "p95_ms": round(percentile(0.95), 3),
+            "p99_ms": round(percentile(0.99), 3), "ops_per_sec": round(len(ordered) / total, 1) if total else None}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def results_document(suite, results, **details):
+    """Result file contents: suite name, run details (size, seed...) and {benchmark: metrics}."""
+    return {"suite": suite, "date": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+            "python": sys.version.split()[0], **details, "results": results}
+
+
+def save(document, path):
+    with open(path, "w") as file:
+        json.dump(document, file, indent=2)
+        file.write("\n")
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, metrics=DEFAULT_METRICS):
+    """
+    Compare two result documents.
+    Returns (rows, regressions): rows are (benchmark, metric, baseline value, current value, change) for
+    every metric in both, change is the relative slowdown (positive is worse).
+    """
+    rows, regressions = [], []
+    for name, values in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        for metric in metrics:
+            old, new = before.get(metric), values.get(metric)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if metric.endswith("_per_sec") else (new - old) / old
+            row = (name, metric, old, new, change)
+            rows.append(row)
+            if change > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def print_comparison(baseline, current, threshold=DEFAULT_THRESHOLD, metrics=DEFAULT_METRICS):
+    """Print the comparison table. Returns the regressions."""
+    rows, regressions = compare(baseline, current, threshold, metrics)
+    print(f"Compared with {baseline.get('commit') or 'baseline'} ({baseline.get('date')}), "
+          f"fail above {threshold:.0%} worse (+ is worse):")
+    for name, metric, old, new, change in rows:
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"  {name:<28} {metric:<16} {old:>10.3f} -> {new:>10.3f}  {change:+7.1%}{flag}")
+    missing = sorted(set(baseline["results"]) ^ set(current["results"]))
+    if missing:
+        print(f"  not in both: {', '.join(missing)}")
+    return regressions
+
+
+def add_arguments(parser):
+    """--output / --baseline / --threshold / --metric options shared by the benchmark scripts."""
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Results JSON to compare with, exits 1 on a regression.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown as a fraction (0.2 = 20%%).")
+    parser.add_argument("--metric", action="append", dest="metrics",
+                        help=f"Metric to compare, repeatable (default: {', '.join(DEFAULT_METRICS)}).")
+
+
+def finish(document, args):
+    """Save the results and compare them with the baseline, as asked on the command line. Returns the exit code."""
+    if args.output:
+        save(document, args.output)
+        print(f"\nSaved to {args.output}")
+    if args.baseline:
+        print()
+        if print_comparison(load(args.baseline), document, args.threshold, args.metrics or DEFAULT_METRICS):
+            return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results with a baseline.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--metric", action="append", dest="metrics")
+    args = parser.parse_args()
+    regressions = print_comparison(load(args.baseline), load(args.current), args.threshold,
+                                   args.metrics or DEFAULT_METRICS)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
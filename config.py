@@ -2,6 +2,35 @@
 
 # Imports os module which is used to access environment variables
 import os
+from datetime import timedelta
+
+
+def engine_options(config):
+    """
+    SQLAlchemy engine options for the database in a loaded config (a dict or an app.config).
+    Called by create_app() once overrides are applied, so they match the database actually used.
+    """
+    # SQLite is a local file, there's no server connection to size or keep alive - it is tuned with
+    # the SQLITE_PRAGMAS below instead (applied to every new connection by app/database.py)
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],  # connections kept open per worker process
+        'max_overflow': config['DB_MAX_OVERFLOW'],  # extra connections allowed under load, closed when returned
+        'pool_timeout': config['DB_POOL_TIMEOUT'],  # seconds to wait for a connection before failing the request
+        'pool_pre_ping': True,  # test connections on checkout (database restarts, dropped idle connections)
+        'pool_recycle': config['DB_POOL_RECYCLE'],  # replace connections older than this many seconds
+    }
+
+
+def max_content_length(config):
+    """
+    Largest request body werkzeug reads (413 above it, before any of it is spooled to disk): the biggest upload
+    allowed plus UPLOAD_OVERHEAD_BYTES for the multipart headers and the other form fields.
+    Called by create_app() once overrides are applied, like engine_options().
+    """
+    return max(config['MEDIA_MAX_BYTES'], config['IMPORT_MAX_BYTES']) + config['UPLOAD_OVERHEAD_BYTES']
+
 
 # Create class for the configuration settings
 class Config:
@@ -17,16 +46,163 @@ class Config:
     # Disables feature signaling every change in the db
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Server databases (e.g. Postgres): connection pool per worker process, turned into SQLALCHEMY_ENGINE_OPTIONS
+    # by create_app() (unless that is set explicitly)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800
+
+    # SQLite: set on every new connection
+    # - WAL lets readers carry on while one connection writes, synchronous=NORMAL is safe with WAL and
+    #   skips an fsync per commit
+    # - busy_timeout makes a writer wait (milliseconds) for the write lock instead of failing with "database is locked"
+    # - mmap_size reads the database file through memory mapping (bytes)
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+    }
+
+    # Number of restaurants per page of search results (and the most a request can ask for)
+    SEARCH_PAGE_SIZE = 20
+    SEARCH_MAX_PAGE_SIZE = 100
+    # Most used tags shown on the search page
+    TAG_CLOUD_SIZE = 30
+
+    # Number of meals per page on the restaurant page (and the most an API request can ask for)
+    MEALS_PAGE_SIZE = 20
+    MEALS_MAX_PAGE_SIZE = 100
+
+    # Templates (app/rendering.py): compiled at start-up, compiled code kept on disk for the next worker (None: off)
+    TEMPLATE_PRECOMPILE = True
+    TEMPLATE_CACHE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'template_cache')
+    # Listing pages with at least this many rows are streamed to the browser as they render
+    TEMPLATE_STREAM_MIN_ROWS = 50
+    # Rendered listing rows kept in memory per worker (0: render every row each time), seconds before one expires
+    FRAGMENT_CACHE_SIZE = 5000
+    FRAGMENT_CACHE_TTL = 600
+
+    # Server-side page cache: most pages kept in memory per worker and seconds before an entry expires
+    PAGE_CACHE_SIZE = 512
+    PAGE_CACHE_TTL = 300
+
+    # Logged-in user snapshots kept in memory per worker, and seconds before one is loaded again from the db
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 60
+
+    # Password hashing - method and cost in werkzeug's format (stored hashes with other settings are upgraded at login)
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    PASSWORD_SALT_LENGTH = 16
+    # Processes hashing passwords (0 hashes inline in the request), hashes allowed to wait, and seconds to wait
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    PASSWORD_HASH_QUEUE_LIMIT = 32
+    PASSWORD_HASH_TIMEOUT = 10
+
+    # Login and register attempts (app/ratelimit.py): (attempts, seconds) per client IP and per username - a burst
+    # of that many attempts, refilled evenly over the seconds - and most IPs/usernames tracked per worker
+    # (RATE_LIMIT_ENABLED=0 in the environment turns it off, e.g. for load tests against a running server)
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+    RATE_LIMIT_PER_IP = (20, 60)
+    RATE_LIMIT_PER_USERNAME = (5, 60)
+    RATE_LIMIT_MAX_KEYS = 10000
+
+    # Reverse proxies in front of the app (nginx, a load balancer...) to trust for the client address and scheme.
+    # The per-IP rate limit uses request.remote_addr, which behind a proxy is the proxy's own address: every client
+    # would share one bucket. With TRUSTED_PROXIES=n create_app() takes the address from the nth last entry of
+    # X-Forwarded-For (and the scheme from X-Forwarded-Proto). Leave it 0 when clients connect directly, or a client
+    # could pick its own address with the header
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+    # Bulk import: rows inserted per transaction
+    IMPORT_BATCH_SIZE = 1000
+    # Export: rows fetched from the streaming cursor at a time, and characters per chunk sent to the client
+    EXPORT_BATCH_SIZE = 1000
+    EXPORT_CHUNK_SIZE = 64 * 1024
+
+    # Background jobs (app/jobs.py): worker threads per web process (0: run `flask jobs-worker` instead), seconds
+    # between checks for new jobs, attempts before a job fails and seconds before the first retry (doubles each time)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_POLL_INTERVAL = 1.0
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_DELAY = 5
+    # Seconds without progress before a running job is taken over by another worker, rows per transaction,
+    # how long finished jobs are kept for status polling, and where uploads wait for their import job
+    JOB_STALE_AFTER = 600
+    JOB_BATCH_SIZE = 1000
+    JOB_RETENTION = timedelta(days=7)
+    JOB_UPLOAD_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'uploads')
+    # Largest file accepted by /import
+    IMPORT_MAX_BYTES = 200 * 1024 * 1024
+    # Lease of a rebuild that runs as one transaction and can't report progress on the way (refresh_stats)
+    JOB_REBUILD_LEASE = 3600
+
+    # Meal photos (app/media.py): storage folder, largest upload, bytes read at a time while storing one, and
+    # thumbnail sizes (longest side in pixels, made by a background job when Pillow is installed)
+    MEDIA_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'media')
+    MEDIA_MAX_BYTES = 20 * 1024 * 1024
+    MEDIA_CHUNK_SIZE = 64 * 1024
+    MEDIA_THUMBNAIL_SIZES = (200, 800)
+    # Room for multipart boundaries, part headers and small form fields on top of an upload's own size
+    UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+    # Restaurant locations (app/geo.py): the offline geocoder's lookup file (CSV: address,latitude,longitude) - or
+    # GEOCODER, a function address -> (latitude, longitude) or None that replaces it - then the radius of a
+    # "near me" lookup when none is given and the largest allowed (km, also for a box: centre to corner), and
+    # restaurants per response
+    GEOCODER = None
+    GEOCODER_FILE = os.environ.get('GEOCODER_FILE') or os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'geocode.csv')
+    GEO_DEFAULT_RADIUS_KM = 2.0
+    GEO_MAX_RADIUS_KM = 50.0
+    GEO_PAGE_SIZE = 20
+    GEO_MAX_PAGE_SIZE = 100
+
+    # Spending and visit analytics (app/analytics.py): timelines kept in memory per worker (0: load each time),
+    # seconds before one expires, the longest date range of a report, and the most visited restaurants listed by
+    # default / at most
+    ANALYTICS_CACHE_SIZE = 1024
+    ANALYTICS_CACHE_TTL = 600
+    ANALYTICS_MAX_YEARS = 10
+    ANALYTICS_TOP_RESTAURANTS = 10
+    ANALYTICS_MAX_TOP_RESTAURANTS = 100
+
+    # Recommendations (app/recommend.py, needs NumPy): people most like you that vote, share of the score from
+    # restaurant features (cuisine, rating, tags) vs meal history, seconds between checks for new data,
+    # top-k lists kept per worker and seconds before one is computed again, and the most a request can ask for
+    RECOMMEND_NEIGHBORS = 50
+    RECOMMEND_CONTENT_WEIGHT = 0.3
+    RECOMMEND_REFRESH_INTERVAL = 2.0
+    RECOMMEND_CACHE_SIZE = 4096
+    RECOMMEND_CACHE_TTL = 300
+    RECOMMEND_PAGE_SIZE = 10
+    RECOMMEND_MAX_PAGE_SIZE = 50
+
+    # Request metrics at /metrics (Prometheus format), distinct SQL statements tracked and slowest reported
+    METRICS_ENABLED = True
+    # /metrics requires "Authorization: Bearer <token>", without a token it is only served in debug/testing
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_MAX_STATEMENTS = 500
+    METRICS_SLOW_STATEMENTS = 20
+    # Sampling profiler: 1 in N requests (N in the control file, see `flask profile-requests`) dumped to PROFILE_DIR
+    PROFILE_CONTROL_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'profile_every')
+    PROFILE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'profiles')
+    PROFILE_MAX_FILES = 200
+
+    # Browsers may keep static files for this long
+    SEND_FILE_MAX_AGE_DEFAULT = timedelta(hours=12)
+
 
-# TODO: FIGURE OUT HOW TO USE THESE AND IF THEY ARE NEEDED IN THIS PROJECT
-# class DevelopmentConfig(Config):
-#     DEBUG = True
+# Development: debug mode and a small pool (server databases only)
+class DevelopmentConfig(Config):
+    DEBUG = True
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 2))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 2))
 
-# class ProductionConfig(Config):
-#     DEBUG = FALSE
 
-### IF ^ ADDED, MODIFY __INIT__.PY FILE FOR MULTIPLE ENVIRONMENT CONFIGURATIONS, SOMETHING LIKE THIS
-    # if os.environ.get('FLASK_ENV') == 'production':
-    #     app.config.from_object('config.ProductionConfig')
-    # else:
-    #     app.config.from_object('config.DevelopmentConfig')
+# Production (FLASK_ENV=production): bigger pool, set DATABASE_URL and SECRET_KEY in the environment
+class ProductionConfig(Config):
+    DEBUG = False
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_RECYCLE = 600
@@ -1,9 +1,15 @@
-# Entry point for Flask app - imports Flask app instance and starts the app
+# Entry point for Flask app - creates the Flask app instance and starts the app
+# gunicorn run:app and flask --app run <command> use the `app` created here
 
-# Import app instance and db instance from __init__.py
-from app import app
+from app import create_app
+
+# Create the app for the environment in FLASK_ENV (development by default)
+app = create_app()
 
 # If this run.py file is being run directly (not imported), then start Flask's development web server in debug mode
 if __name__ == '__main__':
+    # Create missing tables and apply pending migrations before serving (production runs flask db-upgrade instead)
+    from app.migrations import init_db
+    with app.app_context():
+        init_db()
     app.run(debug=True)  # OMIT DEBUG MODE FOR PRODUCTION ENVIRONMENT
-
@@ -1,8 +1,55 @@
 # For premade queries for testing
 
-from app import app, db
-from app import models
-from app.models import People, User, Restaurant, Meal
+# Standard library imports
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+# Third-party imports
+import pytest
+from flask import request
+from sqlalchemy import event, text, update
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app import create_app, db
+from app import cache, identity, jobs, media, metrics, models, passwords, ratelimit, recommend, rendering, stats
+from app.models import People, User, Restaurant, Meal, Tag
+from app.migrations import MIGRATIONS, current_version, init_db
+from app.queries import load_meal_page
+from app.search import expand_terms, search_restaurants
+from app.tagging import tags_named
+from config import engine_options
+
+
+# App bound to a throwaway database and instance folder, built once for the tests in this file
+# (the tests never touch instance/restaurants.db or the other files of a developer's instance folder)
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    app = make_app(tmp_path_factory.mktemp("instance"))
+    with app.app_context():
+        init_db()
+    return app
+
+
+# App whose database and instance files all live in the folder instance (the schema isn't created), plus settings
+def make_app(instance, **settings):
+    return create_app(overrides={
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(instance / "restaurants.db"),
+        "TEMPLATE_CACHE_DIR": str(instance / "template_cache"),
+        "MEDIA_DIR": str(instance / "media"),
+        "JOB_UPLOAD_DIR": str(instance / "uploads"),
+        "GEOCODER_FILE": str(instance / "geocode.csv"),
+        "PROFILE_CONTROL_FILE": str(instance / "profile_every"),
+        "PROFILE_DIR": str(instance / "profiles"),
+        **settings,
+    })
 
 
 # Query users table
@@ -12,9 +59,974 @@ def query_users():
             print(user.__dict__)
 
 
+# Record every SQL statement sent to the db while inside the with block
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+# Add a restaurant with tags and meal_count meals eaten by a few different people
+def make_restaurant(meal_count):
+    suffix = uuid.uuid4().hex[:8]
+    people = [People(name=f"Test Person {i} {suffix}") for i in range(4)]
+    restaurant = Restaurant(name=f"Test Restaurant {suffix}", address="1 Main St",
+                            phone_number="555-555-5555", cuisine="Italian", rating=4)
+    restaurant.tags = tags_named(db.session, ["favorites", "cheap", "patio"])
+    restaurant.meals = [
+        Meal(name=f"Dish {i}", date=date(2024, 1, 1) + timedelta(days=i), price=10 + i, rating="Good",
+             person=people[i % len(people)], notes="Test meal")
+        for i in range(meal_count)
+    ]
+    db.session.add_all(people + [restaurant])
+    db.session.commit()
+    return restaurant.id, [person.id for person in people]
+
+
+# Delete test restaurants that still exist (with their meals, tags and photos), then the given people
+def cleanup_restaurants(ids, people=()):
+    db.session.rollback()
+    for restaurant_id in ids:
+        restaurant = db.session.get(Restaurant, restaurant_id)
+        if restaurant is not None:
+            db.session.delete(restaurant)
+    db.session.flush()
+    for person_id in people:
+        db.session.delete(db.session.get(People, person_id))
+    db.session.commit()
+
+
+# Test client logged in as a new user: yields (client, user id, person id), both removed after the test
+@pytest.fixture
+def logged_in_client(app):
+    with app.app_context():
+        person = People(name="Test Viewer")
+        viewer = User(username=f"viewer-{uuid.uuid4().hex[:8]}", password="x", person=person)
+        db.session.add(viewer)
+        db.session.commit()
+        viewer_id, person_id = viewer.id, person.id
+
+    client = app.test_client()
+    # Log in by putting the user id in the Flask-Login session
+    with client.session_transaction() as session:
+        session["_user_id"] = str(viewer_id)
+    yield client, viewer_id, person_id
+
+    with app.app_context():
+        # A test may have deleted the user already
+        viewer = db.session.get(User, viewer_id)
+        if viewer is not None:
+            db.session.delete(viewer)
+            db.session.flush()
+        db.session.delete(db.session.get(People, person_id))
+        db.session.commit()
+
+
+# Restaurant page must issue the same small number of statements however many meals there are
+def test_restaurant_page_query_count(app, logged_in_client):
+    client, _, _ = logged_in_client
+    with app.app_context():
+        small_id, small_people = make_restaurant(meal_count=2)
+        big_id, big_people = make_restaurant(meal_count=60)
+
+    try:
+        # Warm up the cached identity of the logged-in user so both requests below are measured the same way
+        client.get("/")
+
+        counts = []
+        for restaurant_id in (small_id, big_id):
+            with app.app_context(), count_queries() as statements:
+                response = client.get(f"/restaurant/{restaurant_id}")
+            assert response.status_code == 200
+            counts.append(len(statements))
+
+        # Page version + restaurant/tags/statistics + meal page/people (user comes from the identity cache)
+        assert counts[0] == counts[1]
+        assert counts[1] <= 3
+    finally:
+        with app.app_context():
+            cleanup_restaurants([small_id, big_id], small_people + big_people)
+
+
+# The JSON API walks every meal exactly once with keyset cursors, newest first, and bounds the page size
+def test_api_meal_pages(app, logged_in_client):
+    client, _, _ = logged_in_client
+    with app.app_context():
+        restaurant_id, people = make_restaurant(meal_count=25)
+
+    try:
+        dates, cursor = [], None
+        while True:
+            query = {"limit": 7, "fields": "id,date"} | ({"cursor": cursor} if cursor else {})
+            response = client.get(f"/api/restaurants/{restaurant_id}/meals", query_string=query)
+            assert response.status_code == 200
+            page = response.get_json()
+            assert len(page["items"]) <= 7 and all(set(item) == {"id", "date"} for item in page["items"])
+            dates.extend(item["date"] for item in page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        assert len(dates) == 25 and dates == sorted(set(dates), reverse=True)
+
+        response = client.get(f"/api/restaurants/{restaurant_id}/meals?limit=100000")
+        assert len(response.get_json()["items"]) == 25
+        assert client.get(f"/api/restaurants/{restaurant_id}/meals?fields=password").status_code == 400
+        assert client.get(f"/api/restaurants/{restaurant_id}/meals?cursor=nonsense").status_code == 400
+    finally:
+        with app.app_context():
+            cleanup_restaurants([restaurant_id], people)
+
+
+# Tag names are shared, restaurant counts follow every change and all-of / any-of filters use them
+def test_tag_counts_and_filters(app):
+    with app.app_context():
+        suffix = uuid.uuid4().hex[:8]
+        first_id, first_people = make_restaurant(meal_count=0)
+        second_id, second_people = make_restaurant(meal_count=0)
+        both, only_first = f"both {suffix}", f"first {suffix}"
+
+        def count(name):
+            db.session.expire_all()
+            return Tag.query.filter_by(name=name).one().restaurant_count
+
+        try:
+            first, second = db.session.get(Restaurant, first_id), db.session.get(Restaurant, second_id)
+            first.tags = tags_named(db.session, [both.upper(), only_first])
+            second.tags = tags_named(db.session, [f"  {both} "])
+            db.session.commit()
+
+            assert Tag.query.filter_by(name=both).count() == 1
+            assert count(both) == 2 and count(only_first) == 1
+
+            all_of, _ = search_restaurants(tags=[both, only_first], sort="name", limit=10)
+            any_of, _ = search_restaurants(tags=[both, only_first], tag_mode="any", sort="name", limit=10)
+            assert [r.id for r in all_of] == [first_id]
+            assert sorted(r.id for r in any_of) == sorted([first_id, second_id])
+
+            first.tags = [tag for tag in first.tags if tag.name != only_first]
+            db.session.commit()
+            assert count(only_first) == 0
+            db.session.delete(db.session.get(Restaurant, second_id))
+            db.session.commit()
+            assert count(both) == 1
+
+            db.session.delete(db.session.get(Restaurant, first_id))
+            db.session.commit()
+            assert count(both) == 0
+        finally:
+            cleanup_restaurants([first_id, second_id], first_people + second_people)
+
+
+# Deleting a restaurant answers 202 at once, the job removes it in batches and keeps the derived data right
+def test_delete_restaurant_job(app, logged_in_client):
+    client, _, _ = logged_in_client
+    with app.app_context():
+        restaurant_id, people = make_restaurant(meal_count=25)
+        cheap_before = Tag.query.filter_by(name="cheap").one().restaurant_count
+
+    # No worker threads: the jobs are run one by one below
+    settings = {"JOB_WORKERS": app.config["JOB_WORKERS"], "JOB_BATCH_SIZE": app.config["JOB_BATCH_SIZE"]}
+    app.config.update(JOB_WORKERS=0, JOB_BATCH_SIZE=10)
+    try:
+        response = client.delete(f"/api/restaurants/{restaurant_id}")
+        assert response.status_code == 202 and response.get_json()["status"] == "queued"
+        # Asking twice gives the same job
+        assert client.delete(f"/api/restaurants/{restaurant_id}").get_json()["id"] == response.get_json()["id"]
+
+        with app.app_context():
+            while jobs.run_next():
+                pass
+        status = client.get(response.headers["Location"]).get_json()
+        assert status["status"] == "done" and status["result"]["meals_deleted"] == 25
+
+        with app.app_context():
+            assert db.session.get(Restaurant, restaurant_id) is None
+            assert Meal.query.filter_by(restaurant_id=restaurant_id).count() == 0
+            assert Tag.query.filter_by(name="cheap").one().restaurant_count == cheap_before - 1
+        assert client.get(f"/restaurant/{restaurant_id}").status_code == 404
+    finally:
+        app.config.update(settings)
+        with app.app_context():
+            cleanup_restaurants([restaurant_id], people)
+
+
+# A rebuild that can't report progress takes a long lease first, and an import whose worker died on its last
+# attempt is failed by housekeeping with its upload deleted
+def test_job_leases_and_failed_uploads(app, tmp_path):
+    settings = {"JOB_WORKERS": app.config["JOB_WORKERS"], "JOB_UPLOAD_DIR": app.config["JOB_UPLOAD_DIR"]}
+    app.config.update(JOB_WORKERS=0, JOB_UPLOAD_DIR=str(tmp_path))
+    job_ids = []
+    try:
+        with app.app_context():
+            job = jobs.enqueue("refresh_stats")
+            job_ids.append(job.id)
+            assert jobs.run_next()
+            job = db.session.get(models.Job, job.id)
+            assert job.status == jobs.DONE and job.progress == {"stage": "rebuilding statistics"}
+            assert job.run_after > datetime.now() + timedelta(seconds=app.config["JOB_STALE_AFTER"])
+
+            upload = tmp_path / "upload.csv"
+            upload.write_text("name\n")
+            job = jobs.enqueue("import", {"path": str(upload), "kind": "restaurants", "format": "csv"})
+            job_ids.append(job.id)
+            # Claimed by a worker that then stops: the lease runs out on the only attempt
+            assert jobs._claim().id == job.id
+            with db.engine.begin() as connection:
+                connection.execute(update(models.Job.__table__).where(models.Job.id == job.id)
+                                   .values(run_after=datetime.now() - timedelta(seconds=1)))
+            jobs.housekeeping()
+            db.session.expire_all()
+            assert db.session.get(models.Job, job.id).status == jobs.FAILED
+            assert not upload.exists()
+    finally:
+        app.config.update(settings)
+        with app.app_context():
+            models.Job.query.filter(models.Job.id.in_(job_ids)).delete()
+            db.session.commit()
+
+
+# Two requests enqueueing the same key at once get one job: the partial unique index refuses the second insert
+def test_enqueue_same_key_race(app, monkeypatch):
+    workers = app.config["JOB_WORKERS"]
+    app.config["JOB_WORKERS"] = 0
+    key = f"race-{uuid.uuid4().hex[:8]}"
+    try:
+        with app.app_context():
+            first = jobs.enqueue("refresh_stats", key=key)
+            # The second request looked before the first one committed
+            lookup, missed = jobs._active_job, []
+            monkeypatch.setattr(jobs, "_active_job", lambda key: lookup(key) if missed else missed.append(key))
+            assert jobs.enqueue("refresh_stats", key=key).id == first.id
+            assert models.Job.query.filter_by(key=key).count() == 1
+
+            # Once the job has finished, the key is free again
+            monkeypatch.undo()
+            assert jobs.run_next()
+            assert jobs.enqueue("refresh_stats", key=key).id != first.id
+    finally:
+        app.config["JOB_WORKERS"] = workers
+        with app.app_context():
+            models.Job.query.filter_by(key=key).delete()
+            db.session.commit()
+
+
+# The same photo uploaded twice is stored once, and is served with Range, ETag and immutable caching
+def test_meal_photo_storage(app, logged_in_client, tmp_path, monkeypatch):
+    client, _, _ = logged_in_client
+    with app.app_context():
+        restaurant_id, people = make_restaurant(meal_count=1)
+        meal_id = Meal.query.filter_by(restaurant_id=restaurant_id).one().id
+
+    settings = {name: app.config[name] for name in ("MEDIA_DIR", "MEDIA_MAX_BYTES", "JOB_WORKERS")}
+    app.config.update(MEDIA_DIR=str(tmp_path), JOB_WORKERS=0)
+    # Smallest JPEG header is enough: the type is checked from the first bytes
+    photo = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 4
+    try:
+        first = client.post(f"/api/meals/{meal_id}/photos", data={"photo": (io.BytesIO(photo), "dinner.jpg")})
+        second = client.post(f"/api/meals/{meal_id}/photos", data=photo, content_type="image/jpeg")
+        assert first.status_code == second.status_code == 201
+        assert first.get_json()["sha256"] == second.get_json()["sha256"]
+        assert len([name for _, _, names in os.walk(tmp_path / "originals") for name in names]) == 1
+        assert client.post(f"/api/meals/{meal_id}/photos", data=b"not an image",
+                           content_type="image/jpeg").status_code == 415
+
+        # Bodies too big for any photo are refused from their length before the form is read (not an image
+        # either, which would be 415 once read)
+        assert app.config["MAX_CONTENT_LENGTH"] == (max(app.config["MEDIA_MAX_BYTES"], app.config["IMPORT_MAX_BYTES"])
+                                                    + app.config["UPLOAD_OVERHEAD_BYTES"])
+        app.config["MEDIA_MAX_BYTES"] = len(photo)
+        big = bytes(len(photo) + app.config["UPLOAD_OVERHEAD_BYTES"] + 1)
+        response = client.post(f"/api/meals/{meal_id}/photos", data={"photo": (io.BytesIO(big), "big.jpg")})
+        assert response.status_code == 413 and "at most" in response.get_json()["error"]
+        app.config["MEDIA_MAX_BYTES"] = settings["MEDIA_MAX_BYTES"]
+
+        url = first.get_json()["url"]
+        response = client.get(url)
+        assert response.data == photo and "immutable" in response.headers["Cache-Control"]
+        assert client.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+        partial = client.get(url, headers={"Range": "bytes=0-3"})
+        assert partial.status_code == 206 and partial.data == photo[:4]
+
+        # prune_media runs while the same photo is uploaded again, after the file was found stored: the upload
+        # puts the file back once its rows are committed
+        with app.app_context():
+            models.MealPhoto.query.filter_by(meal_id=meal_id).delete()
+            db.session.commit()
+        store_stream = media.store_stream
+
+        def store_then_prune(stream):
+            stored = store_stream(stream)
+            jobs.enqueue("prune_media")
+            while jobs.run_next():
+                pass
+            return stored
+
+        monkeypatch.setattr(media, "store_stream", store_then_prune)
+        response = client.post(f"/api/meals/{meal_id}/photos", data=photo, content_type="image/jpeg")
+        assert response.status_code == 201 and client.get(url).data == photo
+        assert not os.listdir(tmp_path / "tmp")
+    finally:
+        app.config.update(settings)
+        with app.app_context():
+            cleanup_restaurants([restaurant_id], people)
+
+
+# A visit's meals are checked together and saved all or none, duplicates are refused, a meal loads in one query
+def test_add_visit_meals(app, logged_in_client):
+    client, _, viewer_person_id = logged_in_client
+    with app.app_context():
+        restaurant_id, people = make_restaurant(meal_count=0)
+    guest = f"Test Guest {uuid.uuid4().hex[:8]}"
+
+    url = f"/api/restaurants/{restaurant_id}/meals"
+    meals = [{"name": "Pizza", "price": "12.5"}, {"name": "Salad", "person_id": people[0]},
+             {"name": "Soup", "person": guest}]
+    try:
+        client.get("/")
+        response = client.post(url, json={"date": "2024-03-01", "meals": meals + [{"name": "Pie", "price": "-1"}]})
+        assert response.status_code == 400 and [error["index"] for error in response.get_json()["errors"]] == [3]
+        # nan and infinity parse as floats but aren't prices
+        for price in ("nan", "inf", "-inf"):
+            response = client.post(url, json={"date": "2024-03-01", "meals": [{"name": "Pie", "price": price}]})
+            assert response.status_code == 400
+        with app.app_context():
+            assert Meal.query.filter_by(restaurant_id=restaurant_id).count() == 0
+
+        response = client.post(url, json={"date": "2024-03-01", "meals": meals})
+        assert response.status_code == 201
+        items = response.get_json()["items"]
+        assert [item["person_id"] for item in items[:2]] == [viewer_person_id, people[0]]
+        assert items[2]["person"] == guest
+
+        # Same meal for the same person on the same day, by id or by name
+        response = client.post(url, json={"date": "2024-03-01", "meals": [{"name": "Soup", "person": guest},
+                                                                         {"name": "Cake"}]})
+        assert response.status_code == 400 and [error["index"] for error in response.get_json()["errors"]] == [0]
+        with app.app_context():
+            assert db.session.get(Restaurant, restaurant_id).stats.meal_count == 3
+
+        with app.app_context(), count_queries() as statements:
+            page = client.get(f"/meal/{items[0]['id']}")
+        assert page.status_code == 200 and b"Pizza" in page.data
+        assert len(statements) == 1
+        assert client.post(f"/meal/{items[0]['id']}", data={"action": "delete_meal"}).status_code == 302
+        assert client.get(f"/meal/{items[0]['id']}").status_code == 404
+    finally:
+        with app.app_context():
+            cleanup_restaurants([restaurant_id], people)
+            People.query.filter_by(name=guest).delete()
+            db.session.commit()
+
+
+# Registering writes the person and user in one transaction, a taken username is refused by the unique
+# constraint, and repeated attempts for a username are turned away with 429 before any password is checked
+def test_register_and_rate_limit(app):
+    client = app.test_client()
+    username = f"signup-{uuid.uuid4().hex[:8]}"
+    form = {"name": "Test Signup", "username": username, "password": "secret", "confirmation": "secret"}
+    settings = {name: app.config[name] for name in ("PASSWORD_HASH_WORKERS", "PASSWORD_HASH_METHOD")}
+    app.config.update(PASSWORD_HASH_WORKERS=0, PASSWORD_HASH_METHOD="pbkdf2:sha256:1000")
+    ratelimit.ip_limiter.clear()
+    ratelimit.username_limiter.clear()
+    try:
+        with app.app_context(), count_queries() as statements:
+            assert client.post("/register", data=form).status_code == 302
+        assert sum(statement.startswith("INSERT") for statement in statements) == 2
+        assert not any(statement.startswith("SELECT") for statement in statements)
+
+        assert app.test_client().post("/register", data=form).headers["Location"] == "/register"
+        with app.app_context():
+            assert User.query.filter_by(username=username).count() == 1
+
+        capacity = ratelimit.username_limiter.capacity
+        statuses = [app.test_client().post("/login", data={"username": username, "password": "wrong"}).status_code
+                    for _ in range(capacity)]
+        assert 429 in statuses and statuses[0] == 200
+        response = app.test_client().post("/login", data={"username": username.upper(), "password": "secret"})
+        assert response.status_code == 429 and int(response.headers["Retry-After"]) >= 1
+    finally:
+        app.config.update(settings)
+        ratelimit.ip_limiter.clear()
+        ratelimit.username_limiter.clear()
+        with app.app_context():
+            user = User.query.filter_by(username=username).one()
+            person_id = user.person_id
+            db.session.delete(user)
+            db.session.flush()
+            db.session.delete(db.session.get(People, person_id))
+            db.session.commit()
+
+
+# Behind TRUSTED_PROXIES reverse proxies, the client address (the rate limit's bucket) is the one the last proxy
+# put in X-Forwarded-For, not the proxy's or one the client wrote there itself. Without them the header is ignored
+def test_trusted_proxies(app, tmp_path):
+    assert not app.config["TRUSTED_PROXIES"] and not isinstance(app.wsgi_app, ProxyFix)
+
+    proxied = make_app(tmp_path, TRUSTED_PROXIES=1)
+    addresses = []
+    proxied.before_request(lambda: addresses.append(request.remote_addr))
+    client = proxied.test_client()
+    for forwarded_for in ("203.0.113.7", "192.0.2.1, 198.51.100.2"):
+        client.get("/login", headers={"X-Forwarded-For": forwarded_for}, environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    assert addresses == ["203.0.113.7", "198.51.100.2"]
+
+
+# Hashes made in the process pool and inline verify each other, and hashes stored by older werkzeug versions
+# (pbkdf2, 260000 rounds) still verify and are flagged for rehashing
+def test_password_pool(app):
+    # Werkzeug 2's default method, as stored before scrypt
+    old_hash = "pbkdf2:sha256:260000$ThI7OTvd$b02a55422d8d96b6952c488dcdadc2a49c2af2d63b1bcc26e3c2a5d85b1b32dc"
+    settings = {name: app.config[name] for name in ("PASSWORD_HASH_WORKERS", "PASSWORD_HASH_METHOD")}
+    app.config.update(PASSWORD_HASH_METHOD="pbkdf2:sha256:1000")
+    try:
+        with app.app_context():
+            app.config["PASSWORD_HASH_WORKERS"] = 0
+            inline_hash = passwords.hash_password("secret")
+            app.config["PASSWORD_HASH_WORKERS"] = 1
+            pool_hash = passwords.hash_password("secret")
+            assert pool_hash != inline_hash and not passwords.needs_rehash(pool_hash)
+            for workers in (0, 1):
+                app.config["PASSWORD_HASH_WORKERS"] = workers
+                assert passwords.verify_password(inline_hash, "secret")
+                assert passwords.verify_password(pool_hash, "secret")
+                assert passwords.verify_password(old_hash, "secret")
+                assert not passwords.verify_password(pool_hash, "wrong")
+            assert passwords.needs_rehash(old_hash)
+    finally:
+        passwords.shutdown()
+        app.config.update(settings)
+
+
+# Listing rows are rendered once per restaurant version, and a long listing is streamed (then served from cache)
+def test_listing_fragments_and_streaming(app, logged_in_client):
+    client, _, _ = logged_in_client
+    with app.app_context():
+        restaurant_id, people = make_restaurant(meal_count=1)
+        query = f"/search?q={db.session.get(Restaurant, restaurant_id).name.split()[-1]}"
+
+    minimum = app.config["TEMPLATE_STREAM_MIN_ROWS"]
+    try:
+        rendering.fragment_cache.clear()
+        assert b"Italian" in client.get(query).data
+        with app.app_context():
+            db.session.get(Restaurant, restaurant_id).cuisine = "Thai"
+            db.session.commit()
+        # New version, new row
+        assert b"Thai" in client.get(query).data
+        assert len(rendering.fragment_cache) == 2
+
+        # Streamed: the page is cached once its last chunk has been sent
+        app.config["TEMPLATE_STREAM_MIN_ROWS"] = 1
+        cached_pages = len(cache.page_cache)
+        streamed = client.get(f"{query}&limit=5", buffered=False)
+        assert len(cache.page_cache) == cached_pages
+        assert b"Thai" in streamed.get_data() and len(cache.page_cache) == cached_pages + 1
+    finally:
+        app.config["TEMPLATE_STREAM_MIN_ROWS"] = minimum
+        with app.app_context():
+            cleanup_restaurants([restaurant_id], people)
+
+
+# Recommendations come from people who eat at the same places, and new meals are added to the model in place
+def test_recommendations(app, logged_in_client):
+    pytest.importorskip("numpy")
+    # The logged-in user is the newcomer
+    client, _, newcomer = logged_in_client
+    with app.app_context():
+        suffix = uuid.uuid4().hex[:8]
+        regular = People(name=f"Test Regular {suffix}")
+        first, second, third = [Restaurant(name=f"Test Recommend {name} {suffix}", cuisine=cuisine, rating=4)
+                                for name, cuisine in (("A", "Italian"), ("B", "Italian"), ("C", "Thai"))]
+        first.meals = [Meal(name="Dish", date=date(2024, 1, 1), price=10, rating="Favorite", person=regular),
+                       Meal(name="Dish", date=date(2024, 1, 1), price=10, rating="Favorite", person_id=newcomer)]
+        second.meals = [Meal(name="Dish", date=date(2024, 1, 2), price=10, rating="Favorite", person=regular)]
+        db.session.add_all([regular, first, second, third])
+        db.session.commit()
+        ids = [first.id, second.id, third.id]
+        people = [regular.id]
+        regular_at_second = second.meals[0].id
+
+    try:
+        with app.app_context():
+            recommend.reset_model()
+            model = recommend.get_model()
+            # The regular also went to B, so B is the newcomer's best pick - and A (already visited) is left out
+            picks = [restaurant_id for restaurant_id, _ in model.for_person(newcomer, 10)]
+            assert picks[0] == ids[1] and ids[0] not in picks
+            assert model.similar_to(ids[0], 1)[0][0] == ids[1]
+
+            # A new meal is added to the loaded matrix, not rebuilt from scratch
+            meal_count = model.meal_count
+            db.session.add(Meal(name="Dish", date=date(2024, 1, 3), price=10, rating="Good",
+                                person_id=newcomer, restaurant_id=ids[2]))
+            db.session.commit()
+            model.refresh(force=True)
+            assert model.meal_count == meal_count + 1
+            assert ids[2] not in [restaurant_id for restaurant_id, _ in model.for_person(newcomer, 10)]
+
+            # An edited rating isn't a new meal: the matrix is rebuilt with it
+            before = dict(model.for_person(newcomer, 10))[ids[1]]
+            db.session.get(Meal, regular_at_second).rating = "Pass"
+            db.session.commit()
+            model.refresh(force=True)
+            assert dict(model.for_person(newcomer, 10))[ids[1]] < before
+            assert model.meal_count == meal_count + 1
+
+        response = client.get(f"/api/restaurants/{ids[0]}/similar?fields=id,name&limit=1")
+        assert response.status_code == 200 and response.get_json()["items"][0]["id"] == ids[1]
+        assert client.get("/recommendations").status_code == 200
+    finally:
+        with app.app_context():
+            recommend.reset_model()
+            cleanup_restaurants(ids, people)
+
+
+# Restaurants get coordinates from the lookup file, and "near me" finds them through the location index
+def test_restaurant_locations(app, logged_in_client, tmp_path):
+    client, _, _ = logged_in_client
+    lookup = tmp_path / "geocode.csv"
+    lookup.write_text("address,latitude,longitude\n\"1 Main Street, Springfield\",40.0,-75.0\n"
+                      "Shelbyville,40.05,-75.0\nCapital City,41.0,-75.0\n")
+    geocoder_file = app.config["GEOCODER_FILE"]
+    app.config["GEOCODER_FILE"] = str(lookup)
+    ids = []
+    try:
+        with app.app_context():
+            suffix = uuid.uuid4().hex[:8]
+            near, town, far = [Restaurant(name=f"Test Location {name} {suffix}", address=address, cuisine=cuisine,
+                                          rating=rating)
+                               for name, address, cuisine, rating in (("A", "1 Main St, Springfield", "Italian", 4),
+                                                                      ("B", "9 Elm St, Shelbyville", "Thai", 5),
+                                                                      ("C", "Unknown Rd", "Thai", 3))]
+            db.session.add_all([near, town, far])
+            db.session.commit()
+            ids = [near.id, town.id, far.id]
+            # Street words are abbreviated, an unknown street falls back to the town
+            assert (near.latitude, near.longitude) == (40.0, -75.0) and town.latitude == 40.05
+            assert far.latitude is None
+
+        def nearby(query):
+            response = client.get(f"/api/restaurants/nearby?fields=id&{query}")
+            assert response.status_code == 200
+            return [(item["id"], round(item["distance_km"], 1)) for item in response.get_json()["items"]]
+
+        assert nearby("lat=40&lon=-75&radius_km=10") == [(ids[0], 0.0), (ids[1], 5.6)]
+        assert nearby("lat=40&lon=-75&radius_km=5") == [(ids[0], 0.0)]
+        assert nearby("lat=40&lon=-75&radius_km=10&cuisine=Thai&min_rating=5") == [(ids[1], 5.6)]
+        assert [item for item, _ in nearby("bbox=40.01,-75.1,40.1,-74.9")] == [ids[1]]
+        assert client.get("/api/restaurants/nearby?lat=95&lon=0").status_code == 400
+        assert client.get("/api/restaurants/nearby?bbox=40.1,-75,40,-74").status_code == 400
+        # The box is capped like the radius (a world box would load every restaurant)
+        assert client.get("/api/restaurants/nearby?bbox=-90,-180,90,180").status_code == 400
+
+        # Moving and deleting restaurants updates the index
+        with app.app_context():
+            db.session.get(Restaurant, ids[0]).address = "Capital City"
+            db.session.delete(db.session.get(Restaurant, ids[1]))
+            db.session.commit()
+        assert nearby("lat=40&lon=-75&radius_km=10") == []
+        assert nearby("lat=41&lon=-75&radius_km=1") == [(ids[0], 0.0)]
+    finally:
+        app.config["GEOCODER_FILE"] = geocoder_file
+        with app.app_context():
+            cleanup_restaurants(ids)
+
+
+# Analytics add up visit days over any date range, follow meal edits at once and refuse bad or huge ranges
+def test_person_analytics(app, logged_in_client):
+    client, _, person_id = logged_in_client
+    with app.app_context():
+        suffix = uuid.uuid4().hex[:8]
+        pasta = Restaurant(name=f"Test Analytics Pasta {suffix}", cuisine="Italian")
+        curry = Restaurant(name=f"Test Analytics Curry {suffix}", cuisine="Thai")
+        meals = [Meal(name=name, date=day, price=price, person_id=person_id, restaurant=restaurant)
+                 for name, day, price, restaurant in (("A", date(2024, 1, 5), 10.0, pasta),
+                                                      ("B", date(2024, 1, 5), 20.0, pasta),
+                                                      ("C", date(2024, 1, 5), 15.0, curry),
+                                                      ("D", date(2024, 3, 2), None, pasta),
+                                                      ("E", date(2023, 12, 31), 7.0, curry))]
+        db.session.add_all([pasta, curry] + meals)
+        db.session.commit()
+        ids = [pasta.id, curry.id]
+        dearest, moved = meals[1].id, meals[4].id
+
+    def report(query="start=2024-01-01&end=2024-03-31"):
+        response = client.get(f"/api/analytics?{query}")
+        assert response.status_code == 200
+        return response.get_json()
+
+    try:
+        # Two visits on Jan 5th (one per restaurant), the unpriced meal counts as a meal but not in the prices
+        first = report()
+        assert first["summary"] == {"meals": 4, "visits": 3, "priced_meals": 3, "spend": 45.0, "average_price": 15.0,
+                                    "min_price": 10.0, "max_price": 20.0}
+        assert [(month["month"], month["visits"], month["meals"], month["spend"]) for month in first["by_month"]] == \
+            [("2024-01", 2, 3, 45.0), ("2024-02", 0, 0, 0.0), ("2024-03", 1, 1, 0.0)]
+        assert [(group["cuisine"], group["visits"], group["spend"]) for group in first["by_cuisine"]] == \
+            [("Italian", 2, 30.0), ("Thai", 1, 15.0)]
+        assert [(item["id"], item["visits"], item["meals"]) for item in first["top_restaurants"]] == \
+            [(ids[0], 2, 3), (ids[1], 1, 1)]
+        assert report("start=2023-12-31&end=2023-12-31")["summary"]["spend"] == 7.0
+        assert client.get("/api/analytics?start=2024-02-01&end=2024-01-01").status_code == 400
+        assert client.get("/api/analytics?start=yesterday").status_code == 400
+        assert client.get("/api/analytics?start=0001-01-01&end=9999-11-30").status_code == 400
+        # The dashboard falls back to this year
+        assert client.get("/user?start=0001-01-01&end=9999-11-30").status_code == 200
+
+        # No meals in the range: zero totals, one row per month, nothing to rank
+        empty = report("start=2020-01-01&end=2020-02-29")
+        assert empty["summary"] == {"meals": 0, "visits": 0, "priced_meals": 0, "spend": 0.0, "average_price": None,
+                                    "min_price": None, "max_price": None}
+        assert [month["month"] for month in empty["by_month"]] == ["2020-01", "2020-02"]
+        assert empty["by_cuisine"] == [] and empty["top_restaurants"] == []
+        # The last month there is
+        assert [month["month"] for month in report("start=9999-12-01&end=9999-12-31")["by_month"]] == ["9999-12"]
+
+        # Edits and deletes show up right away (the cached timeline is keyed by the person's data version)
+        with app.app_context():
+            db.session.get(Meal, moved).date = date(2024, 2, 10)
+            db.session.delete(db.session.get(Meal, dearest))
+            db.session.commit()
+        second = report()
+        assert second["summary"] == {"meals": 4, "visits": 4, "priced_meals": 3, "spend": 32.0, "average_price": 10.67,
+                                     "min_price": 7.0, "max_price": 15.0}
+        assert [month["spend"] for month in second["by_month"]] == [25.0, 7.0, 0.0]
+        assert report("start=2023-12-31&end=2023-12-31")["summary"]["visits"] == 0
+
+        page = client.get("/user?start=2024-01-01&end=2024-03-31")
+        assert page.status_code == 200 and f"Test Analytics Pasta {suffix}" in page.get_data(as_text=True)
+    finally:
+        with app.app_context():
+            cleanup_restaurants(ids)
+
+
+# Every SQLite connection gets the configured PRAGMAs, and pool options follow the database actually used
+def test_engine_settings(app):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            pragmas = {name: connection.execute(text(f"PRAGMA {name}")).scalar()
+                       for name in ("journal_mode", "synchronous", "busy_timeout")}
+        # synchronous=NORMAL reads back as 1
+        assert pragmas == {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000}
+        assert app.config["SQLALCHEMY_ENGINE_OPTIONS"] == {}
+
+    # A server database from the overrides gets the pool settings of the config class
+    settings = dict(app.config, SQLALCHEMY_DATABASE_URI="postgresql://localhost/restaurants", DB_POOL_SIZE=3)
+    options = engine_options(settings)
+    assert options["pool_size"] == 3 and options["max_overflow"] == app.config["DB_MAX_OVERFLOW"]
+    assert options["pool_pre_ping"]
+
+
+# The search index follows inserts, updates and deletes, tolerates typos, filters by facet and pages by keyset
+def test_search_index_and_paging(app, logged_in_client):
+    client, _, person_id = logged_in_client
+    with app.app_context():
+        suffix = uuid.uuid4().hex[:8]
+        house, bar, noodles = [Restaurant(name=f"Kestrel {name} {suffix}", cuisine=cuisine, rating=rating)
+                               for name, cuisine, rating in (("Gnocchi House", "Italian", 4),
+                                                             ("Gnocchi Bar", "Thai", 5), ("Ramen", "Thai", 2))]
+        db.session.add_all([house, bar, noodles])
+        db.session.commit()
+        ids = [house.id, bar.id, noodles.id]
+
+    def found(query, **filters):
+        restaurants, _ = search_restaurants(query=query, sort="name", **filters)
+        return [restaurant.id for restaurant in restaurants]
+
+    def token(*values):
+        return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+    try:
+        with app.app_context():
+            assert found("gnocchi") == [ids[1], ids[0]]
+            # Misspelled and partial words
+            assert expand_terms(db.session.connection(), "gnochi") == [["gnocchi"]]
+            assert found("kestrel gnochi") == [ids[1], ids[0]] and found("gnoc") == [ids[1], ids[0]]
+
+            # Meal notes are indexed with their restaurant, renames and deletes are synced
+            db.session.add(Meal(name="Dessert", date=date(2024, 1, 1), person_id=person_id, restaurant_id=ids[2],
+                                notes="Best tiramisu"))
+            db.session.get(Restaurant, ids[1]).name = f"Kestrel Udon Bar {suffix}"
+            db.session.commit()
+            assert found("tiramisu") == [ids[2]]
+            assert found("gnocchi") == [ids[0]] and found("udon") == [ids[1]]
+
+            # Facets combine with the text
+            assert found("kestrel", cuisine="Thai") == [ids[2], ids[1]]
+            assert found("kestrel", cuisine="Thai", min_rating=4) == [ids[1]]
+
+            # Keyset pages, one restaurant at a time, in every sort
+            for sort in ("name", "rating", "relevance", "last_visit"):
+                seen, cursor = [], None
+                while True:
+                    page, cursor = search_restaurants(query="kestrel", sort=sort, cursor=cursor, limit=1)
+                    seen.extend(restaurant.id for restaurant in page)
+                    if not cursor:
+                        break
+                assert sorted(seen) == sorted(ids)
+
+            # Tampered cursors are refused, not sent to the database
+            for values in ([[1], 2], ["a", {"x": 1}], ["a", "2"], [True, 1]):
+                with pytest.raises(ValueError):
+                    search_restaurants(query="kestrel", sort="name", cursor=token(*values))
+            with pytest.raises(ValueError):
+                load_meal_page(ids[2], token("2024-01-01", [3]))
+
+            db.session.delete(db.session.get(Restaurant, ids[0]))
+            db.session.commit()
+            assert found("gnocchi") == []
+
+        assert client.get(f"/api/restaurants?sort=name&cursor={token([1], 2)}").status_code == 400
+        assert client.get(f"/api/restaurants/{ids[2]}/meals?cursor={token('2024-01-01', [3])}").status_code == 400
+    finally:
+        with app.app_context():
+            cleanup_restaurants(ids)
+
+
+# Request metrics: cumulative histograms, Prometheus text, a token outside debug, and the profiler switch
+def test_request_metrics(app, tmp_path):
+    latency = metrics.Histogram((0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(seconds)
+    assert list(latency.cumulative()) == [(0.1, 1), (1.0, 3)] and latency.count == 4 and latency.sum == 4.25
+
+    client = app.test_client()
+    settings = {name: app.config[name] for name in ("DEBUG", "METRICS_TOKEN", "PROFILE_CONTROL_FILE", "PROFILE_DIR")}
+    app.config.update(PROFILE_CONTROL_FILE=str(tmp_path / "profile_every"), PROFILE_DIR=str(tmp_path / "profiles"))
+    try:
+        metrics.registry.reset()
+        client.get("/about")
+        client.get("/about")
+        text = client.get("/metrics").get_data(as_text=True)
+        assert "# TYPE http_request_duration_seconds histogram" in text
+        assert 'http_request_duration_seconds_bucket{endpoint="main.about",le="+Inf"} 2' in text
+        assert 'http_requests_total{endpoint="main.about",status="200"} 2' in text
+
+        # Deployed without a token: not served. With one: only to a client that sends it
+        app.config["DEBUG"] = False
+        assert client.get("/metrics").status_code == 404
+        app.config["METRICS_TOKEN"] = "secret"
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
+
+        # Every request profiled, then none (the control file is re-read on the next check)
+        runner = app.test_cli_runner()
+        assert "1 in 1" in runner.invoke(metrics.profile_requests_command, ["--every", "1"]).output
+        metrics.sampler.checked_at = 0
+        client.get("/about")
+        assert [name for name in os.listdir(tmp_path / "profiles") if name.endswith(".prof")]
+        runner.invoke(metrics.profile_requests_command, ["--off"])
+        metrics.sampler.checked_at = 0
+        profiles = len(os.listdir(tmp_path / "profiles"))
+        client.get("/about")
+        assert len(os.listdir(tmp_path / "profiles")) == profiles
+    finally:
+        app.config.update(settings)
+        metrics.sampler.checked_at = 0
+
+
+# The statistics rollups follow every meal insert, update and delete, and match a rebuild from the meals table
+def test_stats_rollups(app):
+    with app.app_context():
+        restaurant_id, people = make_restaurant(meal_count=0)
+        person_id = people[0]
+
+        def rollups():
+            db.session.expire_all()
+            restaurant = db.session.get(models.RestaurantStats, restaurant_id)
+            months = {row.month: (row.meal_count, row.visit_count, row.price_total)
+                      for row in models.PersonMonthStats.query.filter_by(person_id=person_id) if row.meal_count}
+            days = {row.date: (row.meal_count, row.price_count, row.price_total, row.price_min, row.price_max)
+                    for row in models.VisitDayStats.query.filter_by(person_id=person_id) if row.meal_count}
+            return ((restaurant.meal_count, restaurant.price_count, restaurant.price_total, restaurant.last_visit),
+                    months, days)
+
+        try:
+            lunch = Meal(name="Lunch", date=date(2024, 5, 1), price=10.0, person_id=person_id,
+                         restaurant_id=restaurant_id)
+            dinner = Meal(name="Dinner", date=date(2024, 5, 1), price=None, person_id=person_id,
+                          restaurant_id=restaurant_id)
+            db.session.add_all([lunch, dinner])
+            db.session.commit()
+            assert rollups() == ((2, 1, 10.0, date(2024, 5, 1)), {"2024-05": (2, 1, 10.0)},
+                                 {date(2024, 5, 1): (2, 1, 10.0, 10.0, 10.0)})
+
+            dinner.date, dinner.price = date(2024, 6, 3), 25.0
+            db.session.commit()
+            assert rollups() == ((2, 2, 35.0, date(2024, 6, 3)), {"2024-05": (1, 1, 10.0), "2024-06": (1, 1, 25.0)},
+                                 {date(2024, 5, 1): (1, 1, 10.0, 10.0, 10.0),
+                                  date(2024, 6, 3): (1, 1, 25.0, 25.0, 25.0)})
+
+            db.session.delete(lunch)
+            db.session.commit()
+            expected = ((1, 1, 25.0, date(2024, 6, 3)), {"2024-06": (1, 1, 25.0)},
+                        {date(2024, 6, 3): (1, 1, 25.0, 25.0, 25.0)})
+            assert rollups() == expected
+
+            # Recomputed from scratch, the tables hold the same numbers
+            with db.engine.begin() as connection:
+                stats.rebuild_stats(connection)
+                stats.rebuild_visit_days(connection)
+            assert rollups() == expected
+        finally:
+            cleanup_restaurants([restaurant_id], people)
+
+
+# Cached pages answer a matching If-None-Match with 304, and a write to their data changes the ETag
+def test_page_etags(app, logged_in_client):
+    client, _, _ = logged_in_client
+    with app.app_context():
+        restaurant_id, people = make_restaurant(meal_count=2)
+
+    try:
+        urls = [f"/restaurant/{restaurant_id}", f"/api/restaurants/{restaurant_id}/meals", "/api/restaurants"]
+        etags = {}
+        for url in urls:
+            response = client.get(url)
+            assert response.status_code == 200 and "no-cache" in response.headers["Cache-Control"]
+            etags[url] = response.headers["ETag"]
+            repeat = client.get(url, headers={"If-None-Match": etags[url]})
+            assert repeat.status_code == 304 and not repeat.data and repeat.headers["ETag"] == etags[url]
+
+        with app.app_context():
+            db.session.add(Meal(name="Dessert", date=date(2024, 2, 1), price=7.0, person_id=people[0],
+                                restaurant_id=restaurant_id))
+            db.session.commit()
+
+        for url in urls:
+            response = client.get(url, headers={"If-None-Match": etags[url]})
+            assert response.status_code == 200 and response.headers["ETag"] != etags[url]
+        assert b"Dessert" in client.get(f"/restaurant/{restaurant_id}").data
+    finally:
+        with app.app_context():
+            cleanup_restaurants([restaurant_id], people)
+
+
+# A logged-in user is loaded once into the identity cache, and is evicted when their person is renamed or the
+# user is deleted, so a deleted user's session is logged out on its next request
+def test_identity_cache(app, logged_in_client):
+    client, user_id, person_id = logged_in_client
+    assert client.get("/api/tags").status_code == 200
+    assert identity.user_cache.get(user_id).person_name == "Test Viewer"
+
+    with app.app_context():
+        db.session.get(People, person_id).name = "Test Viewer Renamed"
+        db.session.commit()
+        assert identity.user_cache.get(user_id) is None
+        assert identity.load_user(str(user_id)).person_name == "Test Viewer Renamed"
+
+        db.session.delete(db.session.get(User, user_id))
+        db.session.commit()
+        assert identity.user_cache.get(user_id) is None
+    assert client.get("/api/tags").status_code == 401
+    assert client.get("/user").status_code == 302
+
+
+# Exports round-trip as CSV, JSON Lines and gzip in small batches and chunks, since_id / since_date only export
+# the newer rows, and restaurant_tags (no id of its own) is only exported in full
+def test_export_formats(app, logged_in_client):
+    client, _, _ = logged_in_client
+    with app.app_context():
+        restaurant_id, people = make_restaurant(meal_count=4)
+        meals = Meal.query.filter_by(restaurant_id=restaurant_id).order_by(Meal.id).all()
+        expected = [{"id": meal.id, "name": meal.name, "date": meal.date.isoformat(), "price": meal.price}
+                    for meal in meals]
+
+    def exported(query):
+        response = client.get(f"/export/meals?{query}")
+        assert response.status_code == 200
+        data = response.data
+        if "gzip=1" in query:
+            assert response.mimetype == "application/gzip"
+            data = gzip.decompress(data)
+        text = data.decode("utf-8")
+        if "format=jsonl" in query:
+            rows = [json.loads(line) for line in text.splitlines()]
+        else:
+            rows = [dict(row, id=int(row["id"]), restaurant_id=int(row["restaurant_id"]), price=float(row["price"]))
+                    for row in csv.DictReader(io.StringIO(text))]
+        return [{name: row[name] for name in ("id", "name", "date", "price")}
+                for row in rows if row["restaurant_id"] == restaurant_id]
+
+    settings = {name: app.config[name] for name in ("EXPORT_BATCH_SIZE", "EXPORT_CHUNK_SIZE")}
+    app.config.update(EXPORT_BATCH_SIZE=2, EXPORT_CHUNK_SIZE=64)
+    try:
+        for query in ("format=csv", "format=jsonl", "format=csv&gzip=1", "format=jsonl&gzip=1"):
+            assert exported(f"{query}&since_id={expected[0]['id'] - 1}") == expected
+        assert exported(f"format=jsonl&since_id={expected[1]['id']}") == expected[2:]
+        assert exported(f"format=csv&since_date={expected[2]['date']}") == expected[2:]
+
+        assert client.get("/export/restaurants?since_date=2024-01-01").status_code == 400
+        # Tag links have no id of their own: no watermark, the whole table every time
+        assert client.get("/export/restaurant_tags?since_id=1").status_code == 400
+        links = list(csv.DictReader(io.StringIO(client.get("/export/restaurant_tags").get_data(as_text=True))))
+        assert len([link for link in links if int(link["restaurant_id"]) == restaurant_id]) == 3
+        assert client.get("/export/meals?format=xml").status_code == 400
+    finally:
+        app.config.update(settings)
+        with app.app_context():
+            cleanup_restaurants([restaurant_id], people)
+
+
+# A database made before the migrations (tags as one row per restaurant and name) is upgraded to the latest
+# version once: tags are normalized and deduplicated, the derived tables filled, and a second run does nothing
+def test_schema_migrations(tmp_path):
+    database = tmp_path / "restaurants.db"
+    with sqlite3.connect(database) as connection:
+        connection.executescript("""
+            CREATE TABLE people (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL);
+            CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR NOT NULL UNIQUE, password VARCHAR NOT NULL,
+                                person_id INTEGER NOT NULL REFERENCES people (id));
+            CREATE TABLE restaurants (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE, address VARCHAR,
+                                      phone_number VARCHAR(15), cuisine VARCHAR, rating INTEGER);
+            CREATE TABLE meals (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, date DATE NOT NULL, price FLOAT,
+                                rating VARCHAR, person_id INTEGER NOT NULL REFERENCES people (id), notes VARCHAR,
+                                restaurant_id INTEGER NOT NULL REFERENCES restaurants (id));
+            CREATE TABLE tags (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL,
+                               restaurant_id INTEGER NOT NULL REFERENCES restaurants (id));
+            INSERT INTO people VALUES (1, 'Old Eater');
+            INSERT INTO restaurants VALUES (1, 'Old Noodles', '1 Old Street', NULL, 'Japanese', 4),
+                                           (2, 'Old Tacos', '2 Old Street', NULL, 'Mexican', 3);
+            INSERT INTO meals VALUES (1, 'Ramen', '2020-03-01', 12.5, 'good', 1, NULL, 1),
+                                     (2, 'Gyoza', '2020-03-01', 6.0, 'good', 1, NULL, 1),
+                                     (3, 'Tacos', '2020-04-02', NULL, 'ok', 1, NULL, 2);
+            INSERT INTO tags (name, restaurant_id) VALUES ('Cheap', 1), (' cheap ', 1), ('Late  Night', 1),
+                                                          ('CHEAP', 2), ('', 2), ('gone', 99);
+        """)
+    connection.close()
+
+    app = make_app(tmp_path)
+    with app.app_context():
+        try:
+            assert init_db() == [version for version, _, _ in MIGRATIONS]
+            assert init_db() == []
+            with db.engine.connect() as connection:
+                assert current_version(connection) == MIGRATIONS[-1][0] == 9
+
+            assert {tag.name: tag.restaurant_count for tag in Tag.query} == {"cheap": 2, "late night": 1}
+            noodles = db.session.get(Restaurant, 1)
+            assert sorted(tag.name for tag in noodles.tags) == ["cheap", "late night"]
+            assert noodles.version == 1
+            assert db.session.get(models.RestaurantStats, 1).meal_count == 2
+            assert [restaurant.id for restaurant in search_restaurants("noodles")[0]] == [1]
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+
+
 # Group all test queries
 def main():
+    app = create_app()
     with app.app_context():  # Application context
+        init_db()
         query_users()
         ## ADD ALL NEW TEST FUNCTIONS HERE
         ## COMMENT OUT FUCTIONS IF NOT NEEDED
@@ -22,4 +1034,4 @@ def main():
 
 # Ensure the test functions only run when executed, not imported
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()